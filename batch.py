@@ -0,0 +1,525 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+
+from choices import FORMATS, ENGINES
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('files', nargs='+', help='data files to calibrate (glob patterns are expanded)')
+    add_calibration_arguments(parser)
+    parser.add_argument('--format', default='txt', choices=FORMATS,
+                        help='txt: DataLoader.save per file (not with --drift-*), '
+                             'txt-fast: bulk formatted text per file, npz/hdf5/parquet: all spectra in the --output file')
+    parser.add_argument('--output', default=None, help='output file for npz/hdf5/parquet')
+    parser.add_argument('--stack', default=None,
+                        help='write all spectra into one .npz as 2-D arrays sharing one axis instead of per-file text')
+    parser.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--grid', nargs=3, type=float, default=None, metavar=('START', 'STOP', 'STEP'),
+                        help='also resample all calibrated spectra onto this common axis and save them with '
+                             'their mean, median and standard deviation')
+    parser.add_argument('--grid-output', default=None,
+                        help='base name of the --grid output (<base>.npz and <base>.txt, default: grid_<time>)')
+    parser.add_argument('--drift-peaks', nargs='+', type=float, default=None,
+                        help='true positions of peaks present in every file (internal standard); '
+                             'each spectrum is corrected so that they match')
+    parser.add_argument('--drift-refs', nargs='+', default=None,
+                        help='reference files measured between the data files; '
+                             'their drift is interpolated over the file modification times')
+    parser.add_argument('--drift-window', type=float, default=10.0,
+                        help='half width of the search window around each drift peak')
+    parser.add_argument('--drift-order', type=int, default=0, choices=[0, 1],
+                        help='0: shift only, 1: linear correction (needs two or more peaks)')
+
+
+def add_calibration_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--ref', default=None, help='reference spectrum file')
+    parser.add_argument('--refs', nargs='+', default=None,
+                        help='Rayleigh references for several center wavelengths (the center is read from the file '
+                             'name); each data file is calibrated with the reference of its center')
+    parser.add_argument('--model', default=None, help='saved calibration (.npz) to apply instead of fitting --ref')
+    parser.add_argument('--save-model', default=None, help='save the calibration to this file (.npz)')
+    parser.add_argument('--measurement', default='Raman', help='Raman or Rayleigh')
+    parser.add_argument('--material', default=None, help='reference material, e.g. sulfur')
+    parser.add_argument('--dimension', type=int, default=1, help='1: Linear, 2: Quadratic, 3: Cubic')
+    parser.add_argument('--function', default=None, help='fitting function (default: first of the list)')
+    parser.add_argument('--center', type=float, default=630, help='center wavelength for Rayleigh')
+    parser.add_argument('--ranges', default=None,
+                        help='JSON file: [[x0, y0, x1, y1], ...] or {"ranges": [...], "x_true": [...]}')
+    parser.add_argument('--auto-ranges', action='store_true', help='find the ranges from the reference peaks')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='reject ranges farther than this from any true peak')
+    parser.add_argument('--engine', default='fast', choices=ENGINES,
+                        help='fast: fit all ranges at once, calibrator: Calibrator.calibrate')
+    parser.add_argument('--robust', default='huber', choices=['huber', 'ransac', 'none'],
+                        help='regression of the axis polynomial with the fast engine')
+
+
+def load_ranges(filename: str):
+    with open(filename, 'r') as f:
+        obj = json.load(f)
+    if isinstance(obj, dict):
+        ranges, x_true = obj['ranges'], obj.get('x_true')
+    else:
+        ranges, x_true = obj, None
+    ranges = [tuple(map(float, r)) for r in ranges]
+    if x_true is not None:
+        x_true = list(map(float, x_true))
+    return ranges, x_true
+
+
+def expand_files(patterns):
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern))
+        if matched:
+            yield from matched
+        else:
+            yield pattern
+
+
+def make_calibrator(args: argparse.Namespace, measurement: str, material: str, dimension: int):
+    # 参照物質のデータベースで自分で追加した物質も使えるCalibrator
+    from calibrator import Calibrator
+    from database import ReferenceDatabase, DEFAULT_DATABASE
+
+    calibrator = Calibrator(measurement=measurement, material=material, dimension=dimension)
+    db = ReferenceDatabase(getattr(args, 'database', None) or DEFAULT_DATABASE)
+    db.install(calibrator)
+    db.close()
+    calibrator.set_measurement(measurement)
+    calibrator.set_material(material)
+    return calibrator
+
+
+def prepare_calibrator(args: argparse.Namespace):
+    # --modelまたは--refからキャリブレーション済みのCalibratorを用意する
+    # (calibrator, filename_ref)を返す．失敗した場合はNone
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from calibrator import Calibrator
+    from dataloader import DataLoader
+    from model import CalibrationModel, ModelStore
+    from pipeline import assign_nearest, calibrate_reference_cached
+    from peaks import get_peak_index, auto_ranges
+
+    if args.model is not None:
+        from multicenter import CalibrationTable
+        try:
+            if CalibrationTable.is_table(args.model):
+                print(f'{args.model} holds calibrations for several center wavelengths. '
+                      f'It can only be applied with batch.', file=sys.stderr)
+                return None
+            model = CalibrationModel.load(args.model)
+        except (OSError, KeyError, ValueError) as e:
+            print(f'Could not load {args.model}: {e}', file=sys.stderr)
+            return None
+        calibrator = Calibrator(measurement=model.measurement, material=model.material, dimension=model.dimension)
+        model.restore(calibrator)
+        print(f'Loaded {args.model}', file=sys.stderr)
+        return calibrator, model.filename_ref
+
+    if args.ref is None or args.material is None:
+        print('Either --model or both --ref and --material are required.', file=sys.stderr)
+        return None
+    if args.ranges is None and not args.auto_ranges:
+        print('Either --ranges or --auto-ranges is required.', file=sys.stderr)
+        return None
+    filename_ref = os.path.abspath(args.ref)
+
+    dl_ref = DataLoader()
+    dl_ref.load_file(filename_ref)
+    spec_ref = dl_ref.spec_dict[filename_ref]
+    calibrator = make_calibrator(args, args.measurement, args.material, args.dimension)
+    function = args.function or calibrator.get_function_list()[0]
+    if args.ranges is None:
+        ranges, x_true = auto_ranges(spec_ref.xdata, spec_ref.ydata, get_peak_index(calibrator),
+                                     tolerance=args.tolerance)
+    else:
+        ranges, x_true = load_ranges(args.ranges)
+        if x_true is None:
+            x_true = assign_nearest(get_peak_index(calibrator), ranges, tolerance=args.tolerance)
+    ok, model, cached = calibrate_reference_cached(ModelStore(), calibrator, spec_ref, filename_ref,
+                                                   args.measurement, args.material, args.dimension, function,
+                                                   ranges, x_true=x_true, center=args.center, engine=args.engine,
+                                                   robust=args.robust)
+    if not ok:
+        print('Calibration failed.', file=sys.stderr)
+        return None
+    if cached:
+        print('Used the previous result for the same reference and ranges.', file=sys.stderr)
+    print('Found peak, True value, Residual', file=sys.stderr)
+    for fitted_x, true_x, residual in zip(model.fitted_x, model.found_x_true, model.residuals()):
+        print(f'{fitted_x:.2f}, {true_x:.2f}, {residual:+.3f}', file=sys.stderr)
+    if args.save_model is not None:
+        model.save(args.save_model)
+    return calibrator, filename_ref
+
+
+def run(args: argparse.Namespace) -> int:
+    from profiling import tracer
+    from multicenter import CalibrationTable
+
+    if args.grid is not None and (args.refs is not None or args.drift_peaks is not None
+                                  or args.drift_refs is not None):
+        print('--grid cannot be combined with --refs or --drift-*.', file=sys.stderr)
+        return 1
+    grid_x = None
+    if args.grid is not None:
+        from grid import make_grid
+        try:
+            grid_x = make_grid(*args.grid)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+    # DataLoader.saveはファイルごとの補正量を書けないので，txtでは黙って別の形式にせずに止める
+    if (args.drift_peaks is not None or args.drift_refs is not None) and args.format == 'txt':
+        print('--format txt (DataLoader.save) cannot record the drift correction. '
+              'Use --format txt-fast, npz, hdf5 or parquet.', file=sys.stderr)
+        return 1
+    if args.format not in ('txt', 'txt-fast') and args.stack is None and args.output is None:
+        print(f'--output is required for {args.format}.', file=sys.stderr)
+        return 1
+    if args.model is not None and not os.path.isfile(args.model):
+        print(f'{args.model} was not found.', file=sys.stderr)
+        return 1
+    if args.refs is not None or (args.model is not None and CalibrationTable.is_table(args.model)):
+        return run_multicenter(args, [os.path.abspath(f) for f in expand_files(args.files)])
+
+    with tracer.span('prepare_calibrator'):
+        prepared = prepare_calibrator(args)
+    if prepared is None:
+        return 1
+    calibrator, filename_ref = prepared
+
+    filenames = [os.path.abspath(f) for f in expand_files(args.files)]
+    if args.drift_peaks is not None or args.drift_refs is not None:
+        return run_drift(args, filenames, calibrator, filename_ref)
+    if grid_x is None:
+        return run_main(args, filenames, calibrator, filename_ref)
+
+    # --gridでは保存するために読み込んだスペクトルをそのまま補間にも使い，ファイルを2回読まない
+    from grid import GridAggregator
+    base = args.grid_output or f'grid_{time.strftime("%Y%m%d%H%M%S")}'
+    with GridAggregator(grid_x, directory=os.path.dirname(os.path.abspath(base))) as aggregator:
+        status = run_main(args, filenames, calibrator, filename_ref, aggregator)
+        if status != 1:
+            status = max(status, save_grid(aggregator, base))
+    return status
+
+
+def run_main(args: argparse.Namespace, filenames: list, calibrator, filename_ref: str, aggregator=None) -> int:
+    if args.stack is not None:
+        return run_stack(args, filenames, calibrator, filename_ref, aggregator)
+    if args.format != 'txt':
+        return run_export(args, filenames, calibrator, filename_ref, aggregator)
+    return run_files(args, filenames, calibrator, filename_ref, aggregator)
+
+
+def run_files(args: argparse.Namespace, filenames: list, calibrator, filename_ref: str, aggregator=None) -> int:
+    from parallel import calibrate_files
+    from profiling import tracer
+
+    n = 0
+    failed = 0
+    if aggregator is None:
+        results = calibrate_files(filenames, calibrator, filename_ref, workers=args.workers)
+    else:
+        results = calibrate_files_to_grid(filenames, calibrator, filename_ref, aggregator, workers=args.workers)
+    with tracer.span('calibrate_files', files=len(filenames), workers=args.workers):
+        for filename, error in results:
+            if error is None:
+                n += 1
+                print(filename)
+            else:
+                failed += 1
+                print(f'Failed: {filename}: {error}', file=sys.stderr)
+    tracer.count('files saved', n)
+    print(f'Calibrated {n} files ({failed} failed).', file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+def calibrate_files_to_grid(filenames: list, calibrator, filename_ref: str, aggregator, workers: int = None):
+    # parallel.calibrate_filesと同じく(filename, error)を返す．読み込みは並列に行い，保存と補間はここで行う
+    from dataloader import DataLoader
+    from parallel import iter_load
+    from pipeline import apply_calibration
+
+    dl = DataLoader()
+    for filename, spec, error in iter_load(filenames, workers=workers):
+        if error is None:
+            try:
+                apply_calibration(spec, calibrator, filename_ref)
+                dl.spec_dict[filename] = spec
+                dl.save(filename)
+            except Exception as e:
+                error = e
+            finally:
+                if filename in dl.spec_dict:
+                    dl.delete_file(filename)
+        if error is None:
+            aggregator.add_spectrum(filename, spec)
+        yield filename, error
+
+
+def save_grid(aggregator, base: str) -> int:
+    from profiling import tracer
+
+    if len(aggregator) == 0:
+        print('No spectrum was resampled onto the grid.', file=sys.stderr)
+        return 2
+    with tracer.span('save_grid', files=len(aggregator), points=len(aggregator.grid)):
+        saved = aggregator.save(base)
+    print(f'Resampled {len(aggregator)} files onto {len(aggregator.grid)} points: {", ".join(saved)}',
+          file=sys.stderr)
+    return 0
+
+
+def run_stack(args: argparse.Namespace, filenames: list, calibrator, filename_ref: str, aggregator=None) -> int:
+    # マッピングデータなど，軸が共通の大量のスペクトルをまとめて処理する
+    from spectra import load_arrays, save_arrays_npz
+
+    arrays, unread = load_arrays(filenames)
+    for filename, error in unread:
+        print(f'Failed: {filename}: {error}', file=sys.stderr)
+    failed = len(unread)
+    calibrated = []
+    for array in arrays:
+        try:
+            array.calibrate(calibrator, filename_ref)
+        except ValueError as e:
+            failed += len(array)
+            print(f'Failed: {len(array)} files with {array.xdata.shape[0]} channels: {e}', file=sys.stderr)
+            continue
+        calibrated.append(array)
+        if aggregator is not None:
+            aggregator.add(array.filenames, array.resample(aggregator.grid))
+    save_arrays_npz(args.stack, calibrated)
+    n = sum(len(array) for array in calibrated)
+    print(f'Calibrated {n} files ({failed} failed) into {args.stack}.', file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+def run_export(args: argparse.Namespace, filenames: list, calibrator, filename_ref: str, aggregator=None) -> int:
+    # 読み込んだものから順に書き出す．1つでも失敗したら出力は残さない
+    from export import open_writer, metadata
+    from parallel import iter_load
+    from pipeline import apply_calibration
+    from profiling import tracer
+
+    if args.format != 'txt-fast' and args.output is None:
+        print(f'--output is required for {args.format}.', file=sys.stderr)
+        return 1
+    points = 0
+    try:
+        with tracer.span('export', files=len(filenames), format=args.format, workers=args.workers):
+            with open_writer(args.format, args.output) as writer:
+                for filename, spec, error in tracer.iterate('load_file', iter_load(filenames, workers=args.workers)):
+                    if error is not None:
+                        raise RuntimeError(f'{filename}: {error}')
+                    points += len(spec.xdata)
+                    with tracer.span('apply_calibration'):
+                        apply_calibration(spec, calibrator, filename_ref)
+                    with tracer.span('write_spectrum'):
+                        writer.add(filename, spec.xdata, spec.ydata, metadata(spec))
+                    if aggregator is not None:
+                        aggregator.add_spectrum(filename, spec)
+    except Exception as e:
+        print(f'Failed: {e}', file=sys.stderr)
+        print('Nothing was written.', file=sys.stderr)
+        if aggregator is not None:
+            aggregator.clear()
+        return 2
+    if tracer.enabled:
+        tracer.count('files loaded', writer.n)
+        tracer.count('points loaded', points)
+        tracer.count('bytes loaded', sum(os.path.getsize(f) for f in filenames if os.path.exists(f)))
+        tracer.count('files saved', writer.n)
+        if args.output is not None and os.path.exists(args.output):
+            tracer.count('bytes saved', os.path.getsize(args.output))
+    print(f'Calibrated {writer.n} files.', file=sys.stderr)
+    return 0
+
+
+def run_drift(args: argparse.Namespace, filenames: list, calibrator, filename_ref: str) -> int:
+    # 参照の校正結果を全ファイルに適用したうえで，ファイルごとの軸のずれを補正する
+    # 軸が共通のファイルはまとめてピーク位置を求めるので，大量のスペクトルでも速い
+    import numpy as np
+    from spectra import load_arrays
+    from export import open_writer, metadata
+    from drift import peak_positions, fit_corrections, interpolate_corrections, apply_corrections, file_times
+
+    peaks = args.drift_peaks if args.drift_peaks is not None else list(calibrator.found_x_true)
+    fmt = args.format
+
+    times_ref = coeffs_ref = None
+    if args.drift_refs is not None:
+        names, measured = [], []
+        arrays, unread = load_arrays([os.path.abspath(f) for f in expand_files(args.drift_refs)])
+        for filename, error in unread:
+            print(f'Skipped {filename}: {error}', file=sys.stderr)
+        for array in arrays:
+            try:
+                array.calibrate(calibrator, filename_ref)
+            except ValueError as e:
+                print(f'Skipped {len(array)} references: {e}', file=sys.stderr)
+                continue
+            names += array.filenames
+            measured.append(peak_positions(array.xdata, array.ydata, peaks, args.drift_window))
+        if not names:
+            print('No usable drift reference.', file=sys.stderr)
+            return 1
+        coeffs_ref = fit_corrections(np.vstack(measured), peaks, args.drift_order)
+        times_ref = file_times(names)
+        for name, (a, b) in zip(names, coeffs_ref):
+            print(f'{os.path.basename(name)}: {a:+.4f} + {b:.6f} x', file=sys.stderr)
+
+    n = failed = uncorrected = 0
+    arrays, unread = load_arrays(filenames)
+    for filename, error in unread:
+        failed += 1
+        print(f'Failed: {filename}: {error}', file=sys.stderr)
+    try:
+        with open_writer(fmt, args.output) as writer:
+            for array in arrays:
+                try:
+                    array.calibrate(calibrator, filename_ref)
+                except ValueError as e:
+                    failed += len(array)
+                    print(f'Failed: {len(array)} files with {array.xdata.shape[0]} channels: {e}', file=sys.stderr)
+                    continue
+                if coeffs_ref is None:
+                    measured = peak_positions(array.xdata, array.ydata, peaks, args.drift_window)
+                    coeffs = fit_corrections(measured, peaks, args.drift_order)
+                else:
+                    coeffs = interpolate_corrections(times_ref, coeffs_ref, file_times(array.filenames))
+                uncorrected += int(np.isnan(coeffs[:, 0]).sum())
+                xdata = apply_corrections(array.xdata, coeffs)
+                meta = metadata(array)
+                for i, filename in enumerate(array.filenames):
+                    meta['drift'] = f'{coeffs[i, 0]:+.4f} + {coeffs[i, 1]:.6f} x'
+                    writer.add(filename, xdata[i], array.ydata[i], meta)
+                    n += 1
+    except Exception as e:
+        print(f'Failed: {e}', file=sys.stderr)
+        print('Nothing was written.', file=sys.stderr)
+        return 2
+    print(f'Calibrated {n} files ({failed} failed). '
+          f'The drift peaks were not found in {uncorrected} files, which were not corrected.', file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+def prepare_table(args: argparse.Namespace):
+    # --refsの参照を中心波長ごとにキャリブレーションするか，保存した表を読み込む．失敗した場合はNone
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from dataloader import DataLoader
+    from model import ModelStore
+    from multicenter import CalibrationTable, calibrate_centers, detect_center
+
+    if args.refs is None:
+        try:
+            table = CalibrationTable.load(args.model)
+        except (OSError, KeyError, ValueError) as e:
+            print(f'Could not load {args.model}: {e}', file=sys.stderr)
+            return None
+        print(f'Loaded {args.model}: {", ".join(f"{c:g}" for c in table.centers())} nm', file=sys.stderr)
+        return table
+    if args.material is None:
+        print('--material is required with --refs.', file=sys.stderr)
+        return None
+
+    refs = {}
+    dl = DataLoader()
+    for filename in expand_files(args.refs):
+        filename = os.path.abspath(filename)
+        try:
+            center = detect_center(filename)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return None
+        if center is None:
+            print(f'The center wavelength is not in the file name: {filename}', file=sys.stderr)
+            return None
+        dl.load_file(filename)
+        refs[center] = (filename, dl.spec_dict[filename])
+    # 組み込みの物質はここで取り込んでおき，中心波長ごとのスレッドでは読むだけにする
+    calibrator = make_calibrator(args, 'Rayleigh', args.material, args.dimension)
+    function = args.function or calibrator.get_function_list()[0]
+    table, failed = calibrate_centers(
+        lambda: make_calibrator(args, 'Rayleigh', args.material, args.dimension), ModelStore(),
+        refs, args.material, args.dimension, function, tolerance=args.tolerance, engine=args.engine)
+    for center in table.centers():
+        model = table.models[center]
+        print(f'{center:g} nm: {len(model.fitted_x)} peaks, RMS residual {model.rms_residual():.3f}', file=sys.stderr)
+    for center in failed:
+        print(f'{center:g} nm: calibration failed.', file=sys.stderr)
+    if len(table) == 0:
+        return None
+    if args.save_model is not None:
+        table.save(args.save_model)
+    return table
+
+
+def run_multicenter(args: argparse.Namespace, filenames: list) -> int:
+    # 各ファイルを中心波長で振り分けて，その中心波長の参照の結果を適用する
+    from export import open_writer, metadata
+    from parallel import iter_load
+
+    table = prepare_table(args)
+    if table is None:
+        return 1
+    if args.format == 'txt':
+        return run_multicenter_files(args, filenames, table)
+    if args.format != 'txt-fast' and args.output is None:
+        print(f'--output is required for {args.format}.', file=sys.stderr)
+        return 1
+    failed = 0
+    try:
+        with open_writer(args.format, args.output) as writer:
+            for filename, spec, error in iter_load(filenames, workers=args.workers):
+                if error is None:
+                    try:
+                        table.apply(filename, spec)
+                    except ValueError as e:
+                        error = e
+                if error is not None:
+                    failed += 1
+                    print(f'Failed: {filename}: {error}', file=sys.stderr)
+                    continue
+                writer.add(filename, spec.xdata, spec.ydata, metadata(spec))
+    except Exception as e:
+        print(f'Failed: {e}', file=sys.stderr)
+        print('Nothing was written.', file=sys.stderr)
+        return 2
+    print(f'Calibrated {writer.n} files ({failed} failed).', file=sys.stderr)
+    return 0 if failed == 0 else 2
+
+
+def run_multicenter_files(args: argparse.Namespace, filenames: list, table) -> int:
+    # --format txt: run_filesと同じく1ファイルずつDataLoader.saveで保存する
+    from dataloader import DataLoader
+    from parallel import iter_load
+
+    n = failed = 0
+    dl = DataLoader()
+    for filename, spec, error in iter_load(filenames, workers=args.workers):
+        if error is None:
+            try:
+                table.apply(filename, spec)
+                dl.spec_dict[filename] = spec
+                dl.save(filename)
+            except Exception as e:
+                error = e
+            finally:
+                if filename in dl.spec_dict:
+                    dl.delete_file(filename)
+        if error is None:
+            n += 1
+            print(filename)
+        else:
+            failed += 1
+            print(f'Failed: {filename}: {error}', file=sys.stderr)
+    print(f'Calibrated {n} files ({failed} failed).', file=sys.stderr)
+    return 0 if failed == 0 else 2
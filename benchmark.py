@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import numpy as np
+
+# 読み込み→キャリブレーション→保存の各段階の処理時間とピークメモリを計測する
+# ピークメモリ(ru_maxrss)はプロセス開始からの最大値なので段階ごとの値ではない．各段階の後の値を記録する
+# python benchmark.py --channels 1024 2048 --files 10 100 --output bench.json
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from calibrator import Calibrator
+from dataloader import DataLoader
+import parallel
+from pipeline import calibrate_reference
+from choices import ENGINES
+
+# 合成スペクトルのピークの半値半幅 [cm-1]
+PEAK_WIDTH = 3.0
+# 生データの軸のずれ (shift + scale * x)
+AXIS_SHIFT = 2.0
+AXIS_SCALE = 1.002
+
+
+def peak_rss_mb(children: bool = False):
+    # このプロセス(children=Trueなら終了した子プロセスのうち最大のもの)のこれまでの最大使用量
+    # 並列処理のワーカーはプールを閉じた後に子プロセスとして数えられる
+    try:
+        import resource
+    except ImportError:
+        if children:
+            return None
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # macOSはbyte，Linuxはkilobyte
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def synthetic_spectrum(x_true_peaks, n_channels: int, seed: int):
+    rng = np.random.default_rng(seed)
+    lo, hi = min(x_true_peaks), max(x_true_peaks)
+    margin = 0.1 * (hi - lo) + 10 * PEAK_WIDTH
+    x_true = np.linspace(lo - margin, hi + margin, n_channels)
+    y = 100 + rng.normal(0, 3, n_channels)
+    for p in x_true_peaks:
+        y += rng.uniform(500, 2000) / (1 + ((x_true - p) / PEAK_WIDTH) ** 2)
+    # 生データの軸は真の軸からずれているとする
+    x_raw = (x_true - AXIS_SHIFT) / AXIS_SCALE
+    return x_raw, y
+
+
+def write_wire(filename: str, x, y) -> None:
+    # WiREのテキスト出力はタブ区切りで，波数の降順
+    with open(filename, 'w') as f:
+        f.write('#Wave\t\t#Intensity\n')
+        np.savetxt(f, np.column_stack([x[::-1], y[::-1]]), fmt='%.6f', delimiter='\t')
+
+
+def write_solis(filename: str, x, y) -> None:
+    # Solisのテキスト出力はカンマ区切り
+    np.savetxt(filename, np.column_stack([x, y]), fmt='%.6f', delimiter=',')
+
+
+WRITERS = {'wire': write_wire, 'solis': write_solis}
+
+
+def ranges_for(x_true_peaks, x_raw, y) -> list:
+    ranges = []
+    for p in x_true_peaks:
+        center = (p - AXIS_SHIFT) / AXIS_SCALE
+        x0, x1 = center - 4 * PEAK_WIDTH, center + 4 * PEAK_WIDTH
+        mask = (x_raw >= x0) & (x_raw <= x1)
+        if mask.sum() < 5:
+            continue
+        ranges.append((x0, float(y[mask].min()), x1, float(y[mask].max())))
+    return ranges
+
+
+def timed(results: list, stage: str, n_files: int, n_points: int, func, **info):
+    t0 = time.perf_counter()
+    ret = func()
+    elapsed = time.perf_counter() - t0
+    results.append(dict(stage=stage, seconds=elapsed, files=n_files, points=n_points,
+                        files_per_second=n_files / elapsed if elapsed > 0 else None,
+                        points_per_second=n_points / elapsed if elapsed > 0 else None,
+                        process_peak_rss_mb=peak_rss_mb(), children_peak_rss_mb=peak_rss_mb(children=True),
+                        **info))
+    print(f'{stage:>12s} {json.dumps(info):60s} {elapsed * 1000:10.2f} ms', file=sys.stderr)
+    return ret
+
+
+def new_calibrator(material: str):
+    calibrator = Calibrator(measurement='Raman', material=material, dimension=1)
+    calibrator.set_measurement('Raman')
+    calibrator.set_material(material)
+    return calibrator
+
+
+def run_case(results: list, directory: str, material: str, fmt: str, n_channels: int, n_files: int,
+             workers: int) -> None:
+    calibrator = new_calibrator(material)
+    x_true_peaks = list(calibrator.get_true_x())
+    case = dict(material=material, format=fmt, channels=n_channels, workers=workers)
+
+    case_dir = os.path.join(directory, f'{material}_{fmt}_{n_channels}_{n_files}')
+    os.makedirs(case_dir)
+    filename_ref = os.path.join(case_dir, 'reference.txt')
+    x_raw, y_ref = synthetic_spectrum(x_true_peaks, n_channels, seed=0)
+    WRITERS[fmt](filename_ref, x_raw, y_ref)
+    filenames = []
+    for i in range(n_files):
+        filename = os.path.join(case_dir, f'data_{i:05d}.txt')
+        WRITERS[fmt](filename, *synthetic_spectrum(x_true_peaks, n_channels, seed=i + 1))
+        filenames.append(filename)
+    n_points = n_files * n_channels
+
+    dl_ref = DataLoader()
+    dl_ref.load_file(filename_ref)
+    spec_ref = dl_ref.spec_dict[filename_ref]
+    ranges = ranges_for(x_true_peaks, np.asarray(spec_ref.xdata), np.asarray(spec_ref.ydata))
+
+    dl_raw = DataLoader()
+    timed(results, 'load_files', n_files, n_points, lambda: dl_raw.load_files(filenames), **case)
+    dl_par = DataLoader()
+    timed(results, 'load_par', n_files, n_points,
+          lambda: parallel.load_files(dl_par, filenames, workers=workers), **case)
+
+    # 前のフィッティングの結果から始めないように(fastは前回のピーク位置を初期値にする)，毎回新しいCalibratorを使う
+    calibrated = None
+    for dimension in calibrator.get_dimension_list():
+        d = int(dimension[0])
+        if len(ranges) <= d:
+            continue
+        for function in calibrator.get_function_list():
+            for engine in ENGINES:
+                c = new_calibrator(material)
+                ok = timed(results, 'calibrate', 1, n_channels,
+                           lambda: calibrate_reference(c, spec_ref, 'Raman', material, d, function, ranges,
+                                                       engine=engine),
+                           dimension=d, function=function, engine=engine, **case)
+                results[-1]['ok'] = bool(ok)
+                if ok:
+                    calibrated = c
+    if calibrated is None:
+        return
+    calibrator = calibrated
+
+    timed(results, 'apply', n_files, n_points,
+          lambda: parallel.apply_to_all(dl_raw, calibrator, filename_ref), **case)
+    timed(results, 'save', n_files, n_points,
+          lambda: parallel.save_files(dl_raw, list(dl_raw.spec_dict.keys()), workers=1), **case)
+    timed(results, 'save_par', n_files, n_points,
+          lambda: parallel.save_files(dl_raw, list(dl_raw.spec_dict.keys()), workers=workers), **case)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark of the load -> calibrate -> save pipeline')
+    parser.add_argument('--materials', nargs='+', default=None, help='Raman materials (default: all)')
+    parser.add_argument('--formats', nargs='+', default=list(WRITERS), choices=list(WRITERS))
+    parser.add_argument('--channels', nargs='+', type=int, default=[1024])
+    parser.add_argument('--files', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--workers', type=int, default=parallel.default_workers())
+    parser.add_argument('--output', default=None, help='JSON file to write the results to (default: stdout)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated files')
+    args = parser.parse_args(argv)
+
+    materials = args.materials or Calibrator(measurement='Raman', material='sulfur', dimension=1).get_material_list()
+    directory = tempfile.mkdtemp(prefix='easycalibration_bench_')
+    results = []
+    try:
+        for material in materials:
+            for fmt in args.formats:
+                for n_channels in args.channels:
+                    for n_files in args.files:
+                        run_case(results, directory, material, fmt, n_channels, n_files, args.workers)
+    finally:
+        if args.keep:
+            print(f'Generated files are in {directory}', file=sys.stderr)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = dict(python=platform.python_version(), platform=platform.platform(), numpy=np.__version__,
+                  cpu_count=os.cpu_count(), workers=args.workers, results=results)
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
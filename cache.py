@@ -0,0 +1,95 @@
+import os
+import copy
+import shutil
+import pickle
+import hashlib
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.easycalibration', 'cache')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+class SpectrumCache:
+    # 読み込んだスペクトルをパス・更新時刻・サイズをキーとして保存しておく
+    # xdata, ydataは.npyで保存し，読み出し時はmmapするのでテキストの解析を行わない
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, filename: str) -> str:
+        st = os.stat(filename)
+        text = f'{os.path.abspath(filename)}\0{st.st_mtime_ns}\0{st.st_size}'
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, filename: str):
+        try:
+            entry = self._entry(self.key(filename))
+            with open(os.path.join(entry, 'meta.pkl'), 'rb') as f:
+                spec = pickle.load(f)
+            spec.xdata = np.load(os.path.join(entry, 'xdata.npy'), mmap_mode='r')
+            spec.ydata = np.load(os.path.join(entry, 'ydata.npy'), mmap_mode='r')
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return None
+        # LRUのために最終使用時刻を更新
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return spec
+
+    def put(self, filename: str, spec) -> None:
+        try:
+            entry = self._entry(self.key(filename))
+        except OSError:
+            return
+        if os.path.isdir(entry):
+            return
+        # 途中で失敗したエントリが読まれないように，一時ディレクトリに書いてからrenameする
+        tmp = f'{entry}.tmp{os.getpid()}'
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            np.save(os.path.join(tmp, 'xdata.npy'), np.asarray(spec.xdata))
+            np.save(os.path.join(tmp, 'ydata.npy'), np.asarray(spec.ydata))
+            meta = copy.copy(spec)
+            meta.xdata = None
+            meta.ydata = None
+            with open(os.path.join(tmp, 'meta.pkl'), 'wb') as f:
+                pickle.dump(meta, f)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def entries(self) -> list:
+        # (最終使用時刻, サイズ, パス)のリスト
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for d in os.scandir(self.directory):
+            if not d.is_dir() or '.tmp' in d.name:
+                continue
+            size = sum(f.stat().st_size for f in os.scandir(d.path))
+            entries.append((d.stat().st_mtime, size, d.path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> None:
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            # Windowsではmmap中のファイルは削除できないので，その場合は残しておく
+            try:
+                shutil.rmtree(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,7 @@
+# コマンドラインの選択肢．main.pyが引数の解析のために読み込むので，numpyなどの重いモジュールを読み込まないこと
+
+# 'txt'はDataLoader.saveで1ファイルずつ保存する従来の形式
+# それ以外はexport.pyで書き出す．'txt-fast'は1ファイルずつ，それ以外は全スペクトルを1つのファイルにまとめる
+FORMATS = ['txt', 'txt-fast', 'npz', 'hdf5', 'parquet']
+# 'fast': fitting.pyで全範囲を同時にフィッティングする．'calibrator': Calibrator.calibrateを使う
+ENGINES = ['fast', 'calibrator']
@@ -0,0 +1,238 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import threading
+
+# 参照物質の真のピーク位置を手元のSQLiteに保存して引く
+# Calibratorに入っている物質は起動時に取り込み，自分で測った標準物質などを追加できる
+# 位置に索引を張っているので「500から1600 cm-1の全てのピーク」のような範囲の検索が速い
+
+DEFAULT_DATABASE = os.path.join(os.path.expanduser('~'), '.easycalibration', 'references.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS units (measurement TEXT PRIMARY KEY, unit TEXT, ord INTEGER);
+CREATE TABLE IF NOT EXISTS materials (
+    measurement TEXT, material TEXT, builtin INTEGER, ord INTEGER, note TEXT,
+    PRIMARY KEY (measurement, material));
+CREATE TABLE IF NOT EXISTS lines (measurement TEXT, material TEXT, position REAL, intensity REAL);
+CREATE INDEX IF NOT EXISTS lines_position ON lines (measurement, position);
+CREATE INDEX IF NOT EXISTS lines_material ON lines (measurement, material);
+'''
+
+
+class InstalledDatabase(dict):
+    # install()で置き換えたCalibrator.database．組み込みの物質として取り込み直さないように区別する
+    pass
+
+
+class ReferenceDatabase:
+    def __init__(self, path: str = DEFAULT_DATABASE):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # GUIのジョブのスレッドからも引くので，1つの接続をロックして使う
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+        self._lines = {}
+        self._materials = {}
+        self._matcher = None
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _invalidate(self) -> None:
+        self._lines.clear()
+        self._materials.clear()
+        self._matcher = None
+        # 真値の索引(peaks.py)も物質名で保持しているので作り直させる
+        from peaks import clear_index_cache
+        clear_index_cache()
+
+    def import_builtin(self, database: dict) -> None:
+        # Calibrator.database ({測定: {'unit': 単位, 物質: 真値, ...}})を取り込む．内容が変わっていなければ何もしない
+        data = {m: {k: (v if k == 'unit' else [float(x) for x in v]) for k, v in d.items()}
+                for m, d in database.items()}
+        digest = hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'builtin'").fetchone()
+            if row is not None and row[0] == digest:
+                return
+            self.connection.execute('DELETE FROM lines WHERE (measurement, material) IN '
+                                    '(SELECT measurement, material FROM materials WHERE builtin = 1)')
+            self.connection.execute('DELETE FROM materials WHERE builtin = 1')
+            for i, (measurement, d) in enumerate(data.items()):
+                self.connection.execute('INSERT OR REPLACE INTO units VALUES (?, ?, ?)',
+                                        (measurement, d.get('unit', ''), i))
+                materials = [k for k in d if k != 'unit']
+                for j, material in enumerate(materials):
+                    # 同じ名前の自分で追加した物質は組み込みのもので置き換える
+                    self.connection.execute('DELETE FROM lines WHERE measurement = ? AND material = ?',
+                                            (measurement, material))
+                    self.connection.execute('INSERT OR REPLACE INTO materials VALUES (?, ?, 1, ?, NULL)',
+                                            (measurement, material, j))
+                    self.connection.executemany('INSERT INTO lines VALUES (?, ?, ?, NULL)',
+                                                [(measurement, material, x) for x in d[material]])
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('builtin', ?)", (digest,))
+        self._invalidate()
+
+    def measurements(self) -> list:
+        with self.lock:
+            return [r[0] for r in self.connection.execute('SELECT measurement FROM units ORDER BY ord')]
+
+    def unit(self, measurement: str) -> str:
+        with self.lock:
+            row = self.connection.execute('SELECT unit FROM units WHERE measurement = ?', (measurement,)).fetchone()
+        return '' if row is None else row[0]
+
+    def materials(self, measurement: str) -> list:
+        # 組み込みの物質が先，自分で追加した物質は名前順
+        if measurement not in self._materials:
+            with self.lock:
+                rows = self.connection.execute('SELECT material FROM materials WHERE measurement = ? '
+                                               'ORDER BY builtin DESC, ord, material', (measurement,)).fetchall()
+            self._materials[measurement] = [r[0] for r in rows]
+        return list(self._materials[measurement])
+
+    def is_builtin(self, measurement: str, material: str) -> bool:
+        with self.lock:
+            row = self.connection.execute('SELECT builtin FROM materials WHERE measurement = ? AND material = ?',
+                                          (measurement, material)).fetchone()
+        return row is not None and row[0] == 1
+
+    def lines(self, measurement: str, material: str):
+        # 位置の順のnp.ndarray．numpyはmain.pyの引数の解析で読み込まないように，ここで読み込む
+        import numpy as np
+        key = (measurement, material)
+        if key not in self._lines:
+            with self.lock:
+                rows = self.connection.execute('SELECT position FROM lines WHERE measurement = ? AND material = ? '
+                                               'ORDER BY position', key).fetchall()
+            if not rows and material not in self.materials(measurement):
+                raise KeyError(f'{material} is not in the database for {measurement}.')
+            self._lines[key] = np.array([r[0] for r in rows], dtype=float)
+        return self._lines[key]
+
+    def lines_between(self, measurement: str, lower: float, upper: float, materials: list = None) -> list:
+        # lowerからupperまでの(位置, 物質)を位置の順に返す
+        query = 'SELECT position, material FROM lines WHERE measurement = ? AND position BETWEEN ? AND ?'
+        params = [measurement, min(lower, upper), max(lower, upper)]
+        if materials is not None:
+            query += f' AND material IN ({", ".join("?" * len(materials))})'
+            params += list(materials)
+        with self.lock:
+            return self.connection.execute(query + ' ORDER BY position', params).fetchall()
+
+    def add_material(self, measurement: str, material: str, positions, unit: str = None, note: str = None) -> None:
+        # 自分で追加する物質．同じ名前があれば置き換える(組み込みの物質は置き換えられない)
+        positions = sorted(float(x) for x in positions)
+        if material == '' or material == 'unit':
+            raise ValueError(f'Invalid material name: {material!r}')
+        if len(positions) == 0:
+            raise ValueError('No peak position was given.')
+        if self.is_builtin(measurement, material):
+            raise ValueError(f'{material} is a built-in material of {measurement}.')
+        with self.lock, self.connection:
+            if self.connection.execute('SELECT 1 FROM units WHERE measurement = ?', (measurement,)).fetchone() is None:
+                if unit is None:
+                    raise ValueError(f'Unknown measurement {measurement}. Give its unit to add it.')
+                self.connection.execute('INSERT INTO units VALUES (?, ?, (SELECT COUNT(*) FROM units))',
+                                        (measurement, unit))
+            self.connection.execute('DELETE FROM lines WHERE measurement = ? AND material = ?', (measurement, material))
+            self.connection.execute('INSERT OR REPLACE INTO materials VALUES (?, ?, 0, 0, ?)',
+                                    (measurement, material, note))
+            self.connection.executemany('INSERT INTO lines VALUES (?, ?, ?, NULL)',
+                                        [(measurement, material, x) for x in positions])
+        self._invalidate()
+
+    def remove_material(self, measurement: str, material: str) -> None:
+        if self.is_builtin(measurement, material):
+            raise ValueError(f'{material} is a built-in material of {measurement}.')
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM lines WHERE measurement = ? AND material = ?', (measurement, material))
+            self.connection.execute('DELETE FROM materials WHERE measurement = ? AND material = ?',
+                                    (measurement, material))
+        self._invalidate()
+
+    def to_dict(self) -> dict:
+        # Calibrator.databaseと同じ形
+        database = InstalledDatabase()
+        for measurement in self.measurements():
+            database[measurement] = {'unit': self.unit(measurement)}
+            for material in self.materials(measurement):
+                database[measurement][material] = self.lines(measurement, material)
+        return database
+
+    def install(self, calibrator) -> None:
+        # 組み込みの物質を取り込み，自分で追加した物質もget_material_list, get_true_xで使えるようにする
+        if not isinstance(calibrator.database, InstalledDatabase):
+            self.import_builtin(calibrator.database)
+        calibrator.database = self.to_dict()
+
+    def match(self, filename: str):
+        # ファイル名に含まれる物質名を探して(測定, 物質)を返す．複数あれば最も長い名前．なければNone
+        if self._matcher is None:
+            names = {}
+            for measurement in self.measurements():
+                for material in self.materials(measurement):
+                    names.setdefault(material, measurement)
+            pattern = '|'.join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+            self._matcher = (re.compile(pattern) if names else None, names)
+        regex, names = self._matcher
+        if regex is None:
+            return None
+        found = [m.group(0) for m in regex.finditer(os.path.basename(filename))]
+        if not found:
+            return None
+        material = max(found, key=len)
+        return names[material], material
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument('action', choices=['list', 'show', 'query', 'add', 'remove'],
+                        help='list: materials, show: lines of a material, query: lines between two positions, '
+                             'add/remove: a user-defined material')
+    parser.add_argument('values', nargs='*',
+                        help='show/remove: MATERIAL, query: LOWER UPPER, add: MATERIAL POSITION [POSITION ...]')
+    parser.add_argument('--measurement', default='Raman', help='Raman or Rayleigh')
+    parser.add_argument('--unit', default=None, help='unit of a new measurement added with add')
+    parser.add_argument('--note', default=None, help='note on a material added with add')
+
+
+def run(args) -> int:
+    import sys
+    from calibrator import Calibrator
+
+    db = ReferenceDatabase(args.database or DEFAULT_DATABASE)
+    db.import_builtin(Calibrator(measurement='Raman', material='sulfur', dimension=1).database)
+    measurement, values = args.measurement, args.values
+    try:
+        if args.action == 'list':
+            for material in db.materials(measurement):
+                kind = 'built-in' if db.is_builtin(measurement, material) else 'user'
+                print(f'{material}\t{len(db.lines(measurement, material))}\t{kind}')
+        elif args.action == 'show':
+            for x in db.lines(measurement, values[0]):
+                print(f'{x:g}')
+        elif args.action == 'query':
+            for x, material in db.lines_between(measurement, float(values[0]), float(values[1])):
+                print(f'{x:g}\t{material}')
+        elif args.action == 'add':
+            db.add_material(measurement, values[0], [float(x) for x in values[1:]], unit=args.unit, note=args.note)
+            print(f'Added {values[0]} ({len(values) - 1} lines) to {measurement}.', file=sys.stderr)
+        elif args.action == 'remove':
+            db.remove_material(measurement, values[0])
+            print(f'Removed {values[0]} from {measurement}.', file=sys.stderr)
+    except IndexError:
+        print(f'Not enough values for {args.action}.', file=sys.stderr)
+        return 1
+    except (KeyError, ValueError) as e:
+        print(e.args[0] if e.args else e, file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
@@ -0,0 +1,62 @@
+import numpy as np
+
+
+def minmax_envelope(x, y, n_bins: int, xlim=None):
+    # 表示範囲をn_bins個に分割し，各区間の最小値と最大値だけを残す
+    # ピクセル幅程度のn_binsを与えれば，見た目を変えずに点数を2 * n_bins程度に減らせる
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if x.shape[0] > 1 and x[0] > x[-1]:
+        x = x[::-1]
+        y = y[::-1]
+    if xlim is not None:
+        lo, hi = sorted(xlim)
+        # 範囲外の1点まで含めると，端で線が途切れない
+        i0 = max(np.searchsorted(x, lo, side='left') - 1, 0)
+        i1 = min(np.searchsorted(x, hi, side='right') + 1, x.shape[0])
+        x = x[i0:i1]
+        y = y[i0:i1]
+    n = x.shape[0]
+    n_bins = max(int(n_bins), 1)
+    if n <= 2 * n_bins:
+        return x, y
+    width = n // n_bins
+    n_used = width * n_bins
+    blocks = y[:n_used].reshape(n_bins, width)
+    offset = np.arange(n_bins) * width
+    i_min = blocks.argmin(axis=1) + offset
+    i_max = blocks.argmax(axis=1) + offset
+    # 区間内での順序を保つ．両端の点も残す
+    idx = np.unique(np.concatenate([[0], i_min, i_max, np.arange(n_used, n)]))
+    return x[idx], y[idx]
+
+
+class LODPlotter:
+    # 間引いた線を描画し，ズームなどで表示範囲が変わったら間引き直す
+    def __init__(self, ax):
+        self.ax = ax
+        self.lines = []
+        self._callbacks = None
+
+    def plot(self, x, y, **kwargs):
+        # ax.clear()するとcallbackも線も消えるので，その場合は接続し直す
+        if self._callbacks is not self.ax.callbacks:
+            self._callbacks = self.ax.callbacks
+            self.ax.callbacks.connect('xlim_changed', self.refine)
+        self.lines = [item for item in self.lines if item[0].axes is not None]
+        xs, ys = minmax_envelope(x, y, self.n_bins())
+        line, = self.ax.plot(xs, ys, **kwargs)
+        self.lines.append((line, x, y))
+        return line
+
+    def n_bins(self) -> int:
+        return int(self.ax.bbox.width)
+
+    def refine(self, ax=None) -> None:
+        xlim = self.ax.get_xlim()
+        n_bins = self.n_bins()
+        for line, x, y in self.lines:
+            if line.axes is None:
+                continue
+            line.set_data(*minmax_envelope(x, y, n_bins, xlim=xlim))
+        self.ax.figure.canvas.draw_idle()
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+
+# 長時間の測定中に軸がずれていくのを，スペクトルごとに補正する
+# 補正は校正後の軸xに対する x' = a + b * x の係数(a, b)で表す
+
+
+def file_times(filenames) -> np.ndarray:
+    return np.array([os.path.getmtime(f) for f in filenames], dtype=float)
+
+
+def peak_positions(x, ydata, centers, half_width: float) -> np.ndarray:
+    # 共通の軸xを持つ全スペクトル(スペクトル数, チャンネル数)について，centersの周りの最大値の位置を一度に求める
+    # 最大値とその両隣を放物線で補間してチャンネル幅より細かく求める．範囲の端が最大の場合はnan
+    x = np.asarray(x, dtype=float)
+    ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+    if x[0] > x[-1]:
+        x = x[::-1]
+        ydata = ydata[:, ::-1]
+    n = ydata.shape[0]
+    rows = np.arange(n)
+    channels = np.arange(x.shape[0])
+    positions = np.full((n, len(centers)), np.nan)
+    for j, center in enumerate(centers):
+        i0, i1 = np.searchsorted(x, [center - half_width, center + half_width])
+        if i1 - i0 < 3:
+            continue
+        segment = ydata[:, i0:i1]
+        k = np.argmax(segment, axis=1)
+        inside = (k > 0) & (k < i1 - i0 - 1)
+        k = np.clip(k, 1, i1 - i0 - 2)
+        y0, y1, y2 = segment[rows, k - 1], segment[rows, k], segment[rows, k + 1]
+        denom = y0 - 2 * y1 + y2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = np.where(denom < 0, 0.5 * (y0 - y2) / denom, 0.0)
+        index = i0 + k + np.clip(delta, -1, 1)
+        positions[:, j] = np.where(inside, np.interp(index, channels, x), np.nan)
+    return positions
+
+
+def fit_corrections(measured, x_true, order: int = 0) -> np.ndarray:
+    # 各スペクトルで測ったピーク位置measured(スペクトル数, ピーク数)を真値x_trueに合わせる係数(a, b)を求める
+    # order=0はシフトのみ，order=1は1次式．有効なピークが足りないスペクトルは(nan, nan)
+    measured = np.atleast_2d(np.asarray(measured, dtype=float))
+    x_true = np.broadcast_to(np.asarray(x_true, dtype=float), measured.shape)
+    valid = ~np.isnan(measured)
+    count = valid.sum(axis=1)
+    p = np.where(valid, measured, 0.0)
+    t = np.where(valid, x_true, 0.0)
+    coeffs = np.full((measured.shape[0], 2), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if order == 0:
+            coeffs[:, 0] = (t - p).sum(axis=1) / count
+            coeffs[:, 1] = 1.0
+        elif order == 1:
+            mean_p = p.sum(axis=1) / count
+            mean_t = t.sum(axis=1) / count
+            dp = np.where(valid, p - mean_p[:, None], 0.0)
+            dt = np.where(valid, t - mean_t[:, None], 0.0)
+            b = (dp * dt).sum(axis=1) / (dp * dp).sum(axis=1)
+            coeffs[:, 0] = mean_t - b * mean_p
+            coeffs[:, 1] = b
+        else:
+            raise ValueError('order must be 0 or 1.')
+    coeffs[count < order + 1] = np.nan
+    return coeffs
+
+
+def interpolate_corrections(times_ref, coeffs_ref, times) -> np.ndarray:
+    # 間に挟んで測った参照の補正を，各スペクトルの測定時刻で線形補間する．範囲外は端の値
+    times_ref = np.asarray(times_ref, dtype=float)
+    coeffs_ref = np.asarray(coeffs_ref, dtype=float)
+    ok = ~np.isnan(coeffs_ref).any(axis=1)
+    if not ok.any():
+        raise ValueError('The drift could not be measured in any reference.')
+    times_ref, coeffs_ref = times_ref[ok], coeffs_ref[ok]
+    order = np.argsort(times_ref)
+    times_ref, coeffs_ref = times_ref[order], coeffs_ref[order]
+    times = np.asarray(times, dtype=float)
+    return np.column_stack([np.interp(times, times_ref, coeffs_ref[:, 0]),
+                            np.interp(times, times_ref, coeffs_ref[:, 1])])
+
+
+def apply_corrections(x, coeffs) -> np.ndarray:
+    # (スペクトル数, チャンネル数)の補正後の軸を返す．nanの行は補正しない
+    x = np.asarray(x, dtype=float)
+    coeffs = np.asarray(coeffs, dtype=float)
+    a = np.where(np.isnan(coeffs[:, 0]), 0.0, coeffs[:, 0])
+    b = np.where(np.isnan(coeffs[:, 1]), 1.0, coeffs[:, 1])
+    return a[:, None] + b[:, None] * x[None, :]
@@ -0,0 +1,234 @@
+import os
+import json
+import datetime
+import zipfile
+import numpy as np
+
+# 'txt'以外の形式をここで書き出す(形式の一覧はchoices.py)
+EXTENSIONS = {'npz': '.npz', 'hdf5': '.h5', 'parquet': '.parquet'}
+
+
+def temp_path(filename: str) -> str:
+    directory, basename = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, f'.{basename}.{os.getpid()}.tmp')
+
+
+def format_text(x, y, fmt: str = '%.6f') -> str:
+    # 1行ずつではなく全体を1回の%演算で整形する
+    data = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+    row = f'{fmt}\t{fmt}'
+    return '\n'.join([row] * data.shape[0]) % tuple(data.ravel()) + '\n'
+
+
+def metadata(spec) -> dict:
+    return dict(abs_path_ref=getattr(spec, 'abs_path_ref', None),
+                calibration=str(getattr(spec, 'calibration', None)))
+
+
+class BatchWriter:
+    # 一時ファイルに書き込み，close()でrenameする．途中で失敗した場合は何も残さない
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.tmp = temp_path(filename)
+        self.n = 0
+
+    def add(self, name: str, xdata, ydata, meta: dict = None) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        self._close()
+        os.replace(self.tmp, self.filename)
+
+    def abort(self) -> None:
+        try:
+            self._close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp):
+            os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class NpzWriter(BatchWriter):
+    # 配列を1つずつzipに書き込むので，全スペクトルをメモリに載せる必要はない
+    # np.load()でxdata_00000, ydata_00000, ..., filenames, metadataとして読める
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self.zf = zipfile.ZipFile(self.tmp, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self.names = []
+        self.meta = []
+
+    def _write_array(self, key: str, array) -> None:
+        with self.zf.open(key + '.npy', mode='w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+    def add(self, name: str, xdata, ydata, meta: dict = None) -> None:
+        self._write_array(f'xdata_{self.n:05d}', xdata)
+        self._write_array(f'ydata_{self.n:05d}', ydata)
+        self.names.append(name)
+        self.meta.append(meta or {})
+        self.n += 1
+
+    def _close(self) -> None:
+        if self.zf.fp is None:
+            return
+        self._write_array('filenames', np.array(self.names, dtype=str))
+        self._write_array('metadata', np.array(json.dumps(self.meta)))
+        self.zf.close()
+
+
+class Hdf5Writer(BatchWriter):
+    # /spectra/00000/xdata, ydata．属性にファイル名とキャリブレーションの情報を持つ
+    # h5pyで開けばスライスごとに読めるので，大きなバッチでも一部だけ読み込める
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        try:
+            import h5py
+        except ImportError:
+            raise RuntimeError('h5py is required for HDF5 export. Please run "pip install h5py".')
+        self.f = h5py.File(self.tmp, 'w')
+        self.group = self.f.create_group('spectra')
+
+    def add(self, name: str, xdata, ydata, meta: dict = None) -> None:
+        g = self.group.create_group(f'{self.n:05d}')
+        g.create_dataset('xdata', data=np.asarray(xdata))
+        g.create_dataset('ydata', data=np.asarray(ydata))
+        g.attrs['filename'] = name
+        for key, value in (meta or {}).items():
+            g.attrs[key] = '' if value is None else str(value)
+        self.n += 1
+
+    def _close(self) -> None:
+        if self.f:
+            self.f.close()
+
+
+class ParquetWriter(BatchWriter):
+    # 縦長の表(filename, xdata, ydata)として書き出す．row_group_rows行ごとにまとめて書き込む
+    def __init__(self, filename: str, row_group_rows: int = 1_000_000):
+        super().__init__(filename)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('pyarrow is required for Parquet export. Please run "pip install pyarrow".')
+        self.pa = pa
+        self.schema = pa.schema([('filename', pa.string()), ('xdata', pa.float64()), ('ydata', pa.float64()),
+                                 ('abs_path_ref', pa.string())])
+        self.writer = pq.ParquetWriter(self.tmp, self.schema)
+        self.row_group_rows = row_group_rows
+        self.buffer = []
+        self.n_buffered = 0
+
+    def add(self, name: str, xdata, ydata, meta: dict = None) -> None:
+        xdata = np.asarray(xdata, dtype=float)
+        n = xdata.shape[0]
+        ref = (meta or {}).get('abs_path_ref')
+        self.buffer.append(self.pa.table({
+            'filename': self.pa.array([name] * n, self.pa.string()),
+            'xdata': xdata,
+            'ydata': np.asarray(ydata, dtype=float),
+            'abs_path_ref': self.pa.array([ref] * n, self.pa.string()),
+        }, schema=self.schema))
+        self.n_buffered += n
+        self.n += 1
+        if self.n_buffered >= self.row_group_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.writer.write_table(self.pa.concat_tables(self.buffer))
+        self.buffer = []
+        self.n_buffered = 0
+
+    def _close(self) -> None:
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+        self.writer = None
+
+
+class TextWriter:
+    # DataLoader.saveと同様に<元のファイル名>_<タイムスタンプ>.txtを元のファイルと同じフォルダに書き出す
+    # 1ファイルずつ一時ファイルからrenameするので，途中で失敗しても書きかけのファイルは残らない
+    def __init__(self, timestamp: str = None):
+        self.timestamp = timestamp or datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        self.n = 0
+        self.written = []
+
+    def path(self, name: str) -> str:
+        return f'{os.path.splitext(name)[0]}_{self.timestamp}.txt'
+
+    def add(self, name: str, xdata, ydata, meta: dict = None) -> None:
+        filename = self.path(name)
+        tmp = temp_path(filename)
+        header = ''.join(f'# {key}: {value}\n' for key, value in (meta or {}).items())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(header)
+                f.write(format_text(xdata, ydata))
+            os.replace(tmp, filename)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.written.append(filename)
+        self.n += 1
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        # 1つのバッチとして扱うので，それまでに書いたファイルも消す
+        for filename in self.written:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.written = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+def open_writer(fmt: str, filename: str = None):
+    if fmt == 'txt-fast':
+        return TextWriter()
+    if filename is None:
+        raise ValueError(f'An output file is required for {fmt}.')
+    if fmt == 'npz':
+        return NpzWriter(filename)
+    if fmt == 'hdf5':
+        return Hdf5Writer(filename)
+    if fmt == 'parquet':
+        return ParquetWriter(filename)
+    raise ValueError(f'Unknown format: {fmt}')
+
+
+def export_spec_dict(spec_dict, fmt: str, filename: str = None, progress=None) -> list:
+    # 読み込み済みのスペクトルを書き出す．失敗した場合は途中までの出力を残さない
+    names = list(spec_dict.keys())
+    n = len(names)
+    with open_writer(fmt, filename) as writer:
+        for i, name in enumerate(names):
+            spec = spec_dict[name]
+            writer.add(name, spec.xdata, spec.ydata, metadata(spec))
+            if progress is not None:
+                progress(i + 1, n)
+    return names
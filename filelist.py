@@ -0,0 +1,213 @@
+import tkinter as tk
+from tkinter import ttk
+
+_REMOVED = object()
+
+
+class _Order:
+    # 削除した位置を空けたままにするキーの列．i番目のキーは生きているキーの数のFenwick木で探すのでO(log n)
+    # 空きが半分を超えたら詰め直すので，追加・削除もならしてO(log n)
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+        # tree[i]は(i - (i & -i), i]番目(1始まり)の生きているキーの数
+        n = len(self.keys)
+        self.tree = [0] + [1] * n
+        for i in range(1, n + 1):
+            j = i + (i & -i)
+            if j <= n:
+                self.tree[j] += self.tree[i]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, key) -> bool:
+        return key in self.positions
+
+    def _prefix(self, i: int) -> int:
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def append(self, key) -> None:
+        i = len(self.tree)
+        self.positions[key] = i - 1
+        self.keys.append(key)
+        self.tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def remove(self, key) -> None:
+        i = self.positions.pop(key) + 1
+        self.keys[i - 1] = _REMOVED
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+        if len(self.keys) > 2 * len(self.positions) + 64:
+            self.__init__([k for k in self.keys if k is not _REMOVED])
+
+    def get(self, rank: int):
+        # 生きているキーのうちrank番目(0始まり)
+        n = len(self.tree) - 1
+        position = 0
+        rest = rank + 1
+        step = 1 << n.bit_length() >> 1
+        while step:
+            if position + step <= n and self.tree[position + step] < rest:
+                position += step
+                rest -= self.tree[position]
+            step >>= 1
+        return self.keys[position]
+
+
+class FileList(ttk.Frame):
+    # 何千ファイルあっても表示している行だけをTreeviewに置く仮想リスト
+    # 追加・削除は変化したファイルの数だけの処理で済み，選択はファイル名で保持するのでスクロールしても消えない
+    # 表示順は_Orderで持つので，k個の追加・削除と表示する行の取り出しはO(k log n)
+    def __init__(self, master, height: int = 6, command=None):
+        super().__init__(master)
+        self.height = height
+        self.command = command
+        self.numbers = {}
+        self.order = _Order()
+        self.next_number = 0
+        self.selected = set()
+        self.focused = None
+        self.offset = 0
+        self.rendered = []
+        self.rendered_selection = set()
+        self.extend_selection = False
+
+        self.treeview = ttk.Treeview(self, height=height, selectmode=tk.EXTENDED)
+        self.treeview['columns'] = ['filename']
+        self.treeview.column('#0', width=40, stretch=tk.NO)
+        self.treeview.column('filename', width=400, anchor=tk.CENTER)
+        self.treeview.heading('#0', text='#')
+        self.treeview.heading('filename', text='filename')
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.treeview.pack(side=tk.LEFT)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.treeview.bind('<ButtonPress-1>', self.on_click, add='+')
+        self.treeview.bind('<<TreeviewSelect>>', self.on_select)
+        self.treeview.bind('<MouseWheel>', self.on_wheel)
+        self.treeview.bind('<Button-4>', lambda event: self.yview('scroll', -1, 'units'))
+        self.treeview.bind('<Button-5>', lambda event: self.yview('scroll', 1, 'units'))
+        self.treeview.bind('<Up>', lambda event: self.move_focus(-1))
+        self.treeview.bind('<Down>', lambda event: self.move_focus(1))
+        self.render()
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    def keys(self, start: int = 0, stop: int = None) -> list:
+        # 表示順でstart番目からstop番目まで
+        stop = len(self) if stop is None else min(stop, len(self))
+        return [self.order.get(i) for i in range(max(start, 0), stop)]
+
+    def bind_tree(self, sequence: str, func) -> None:
+        self.treeview.bind(sequence, func, add='+')
+
+    def add(self, keys) -> list:
+        # すでにあるものは追加しない．追加したものを返す
+        added = []
+        for key in keys:
+            if key in self.numbers:
+                continue
+            self.numbers[key] = self.next_number
+            self.order.append(key)
+            self.next_number += 1
+            added.append(key)
+        self.render()
+        return added
+
+    def remove(self, keys) -> None:
+        removed = {key for key in keys if key in self.numbers}
+        if not removed:
+            return
+        for key in removed:
+            del self.numbers[key]
+            self.order.remove(key)
+        self.selected -= removed
+        if self.focused in removed:
+            self.focused = None
+        self.render()
+
+    def clear(self) -> None:
+        self.numbers = {}
+        self.order = _Order()
+        self.next_number = 0
+        self.selected = set()
+        self.focused = None
+        self.offset = 0
+        self.render()
+
+    def selection(self) -> list:
+        return sorted(self.selected, key=self.numbers.get)
+
+    def focus(self):
+        return self.focused
+
+    def render(self) -> None:
+        n = len(self.numbers)
+        self.offset = max(0, min(self.offset, n - self.height))
+        self.rendered = self.keys(self.offset, self.offset + self.height)
+        self.treeview.delete(*self.treeview.get_children())
+        for i, key in enumerate(self.rendered):
+            self.treeview.insert('', tk.END, iid=str(i), text=str(self.numbers[key]), values=[key])
+        self.rendered_selection = {key for key in self.rendered if key in self.selected}
+        self.treeview.selection_set([str(i) for i, key in enumerate(self.rendered) if key in self.selected])
+        if self.focused in self.rendered:
+            self.treeview.focus(str(self.rendered.index(self.focused)))
+        if n == 0:
+            self.scrollbar.set(0, 1)
+        else:
+            self.scrollbar.set(self.offset / n, (self.offset + len(self.rendered)) / n)
+
+    def yview(self, *args) -> None:
+        if args[0] == 'moveto':
+            self.offset = int(float(args[1]) * len(self.numbers))
+        elif args[0] == 'scroll':
+            self.offset += int(args[1]) * (self.height if args[2] == 'pages' else 1)
+        self.render()
+
+    def on_wheel(self, event) -> None:
+        self.yview('scroll', -1 if event.delta > 0 else 1, 'units')
+
+    def on_click(self, event) -> None:
+        # CtrlまたはShiftを押しながらの選択は，表示範囲外の選択を残す
+        self.extend_selection = bool(event.state & 0x0005)
+
+    def on_select(self, event) -> None:
+        visible = {self.rendered[int(iid)] for iid in self.treeview.selection() if int(iid) < len(self.rendered)}
+        if visible == self.rendered_selection:
+            # render()による選択の復元
+            return
+        if self.extend_selection:
+            self.selected = (self.selected - set(self.rendered)) | visible
+        else:
+            self.selected = visible
+        self.rendered_selection = visible
+        iid = self.treeview.focus()
+        if iid != '' and int(iid) < len(self.rendered):
+            self.focused = self.rendered[int(iid)]
+        if self.command is not None:
+            self.command(event)
+
+    def move_focus(self, step: int):
+        # 表示範囲の端でカーソルキーを押したらスクロールする
+        if self.focused is None or self.focused not in self.numbers:
+            return None
+        i = self.rendered.index(self.focused) if self.focused in self.rendered else -1
+        if 0 <= i + step < len(self.rendered):
+            return None
+        position = self.offset + i + step
+        if i < 0 or not 0 <= position < len(self.numbers):
+            return 'break'
+        self.offset += step
+        self.focused = self.keys(position, position + 1)[0]
+        self.selected = {self.focused}
+        self.render()
+        if self.command is not None:
+            self.command(None)
+        return 'break'
@@ -0,0 +1,222 @@
+import itertools
+import numpy as np
+
+# Calibrator.calibrateの代わりに使う高速なフィッティング
+# 全範囲のピークを解析的なヤコビアンを使ったLevenberg-Marquardt法で同時にフィッティングし，
+# ピーク位置と真値の対応を外れ値に強い多項式回帰で求める．フィッティングできなかった範囲は除いて続ける
+
+# Voigt関数はCalibratorのフィッティングに任せる(pipeline.calibrate)
+FUNCTIONS = ['Lorentzian', 'Gaussian']
+LN2 = np.log(2)
+
+
+def peak_model(function: str, x, params):
+    # params[..., :] = (高さ, 中心, 半値半幅, ベースライン)．値とパラメータについての微分を返す
+    a, c, w, b = (params[..., i, None] for i in range(4))
+    u = (x - c) / w
+    if function == 'Lorentzian':
+        f = 1 / (1 + u ** 2)
+        df_du = -2 * u * f ** 2
+    elif function == 'Gaussian':
+        f = np.exp(-LN2 * u ** 2)
+        df_du = -2 * LN2 * u * f
+    else:
+        raise ValueError(f'Unknown function: {function}')
+    y = a * f + b
+    jac = np.stack([f, -a * df_du / w, -a * df_du * u / w, np.ones_like(f)], axis=-1)
+    return y, jac
+
+
+class PeakFit:
+    # 各範囲のフィッティング結果．okがFalseの範囲はcentersがnan
+    def __init__(self, function: str, ranges: list, params, ok):
+        self.function = function
+        self.ranges = ranges
+        self.params = params
+        self.ok = ok
+        self.centers = np.where(ok, params[:, 1], np.nan)
+        self.widths = np.where(ok, params[:, 2], np.nan)
+
+    def curve(self, i: int, n: int = 200):
+        x0, x1 = sorted(self.ranges[i][0::2])
+        x = np.linspace(x0, x1, n)
+        y, _ = peak_model(self.function, x, self.params[i])
+        return x, y
+
+
+def _initial_params(x, y, mask, ranges, warm_centers, warm_widths):
+    k = x.shape[0]
+    params = np.empty((k, 4))
+    for i in range(k):
+        xi, yi = x[i][mask[i]], y[i][mask[i]]
+        x0, x1 = sorted(ranges[i][0::2])
+        j = np.argmax(yi)
+        center, width = xi[j], (x1 - x0) / 8
+        # 前回のピーク位置が範囲内にあればそこから始める
+        for c, w in zip(warm_centers, warm_widths):
+            if x0 <= c <= x1:
+                center = c
+                if np.isfinite(w) and 0 < w < x1 - x0:
+                    width = w
+                break
+        params[i] = (yi.max() - yi.min(), center, width, yi.min())
+    return params
+
+
+def fit_peaks(x, y, ranges: list, function: str, warm_centers=(), warm_widths=None, max_iter: int = 100,
+              tol: float = 1e-10) -> PeakFit:
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ranges = [tuple(map(float, r)) for r in ranges]
+    k = len(ranges)
+    warm_centers = list(warm_centers) if warm_centers is not None else []
+    warm_widths = list(warm_widths) if warm_widths is not None else [np.nan] * len(warm_centers)
+
+    # 各範囲のデータを同じ長さに詰めて(範囲数, 点数)の配列にする
+    indices = []
+    for x0, _, x1, _ in ranges:
+        lo, hi = min(x0, x1), max(x0, x1)
+        indices.append(np.flatnonzero((x >= lo) & (x <= hi)))
+    m = max([len(i) for i in indices] + [1])
+    mask = np.zeros((k, m), dtype=bool)
+    X = np.zeros((k, m))
+    Y = np.zeros((k, m))
+    for i, index in enumerate(indices):
+        mask[i, :len(index)] = True
+        X[i, :len(index)] = x[index]
+        Y[i, :len(index)] = y[index]
+    enough = mask.sum(axis=1) >= 5
+    if not enough.any():
+        return PeakFit(function, ranges, np.full((k, 4), np.nan), enough)
+    X[~mask] = X[:, :1].repeat(m, axis=1)[~mask]
+
+    params = _initial_params(X, Y, mask | ~enough[:, None], ranges, warm_centers, warm_widths)
+    lam = np.full(k, 1e-3)
+
+    def residuals(p):
+        f, jac = peak_model(function, X, p)
+        r = np.where(mask, f - Y, 0.0)
+        return r, jac * mask[..., None], (r ** 2).sum(axis=1)
+
+    r, jac, cost = residuals(params)
+    for _ in range(max_iter):
+        jtj = np.einsum('kmi,kmj->kij', jac, jac)
+        g = np.einsum('kmi,km->ki', jac, r)
+        diag = np.einsum('kii->ki', jtj) + 1e-12
+        A = jtj + lam[:, None, None] * (diag[:, :, None] * np.eye(4))
+        try:
+            step = np.linalg.solve(A, -g[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            break
+        trial = params + step
+        trial[:, 2] = np.abs(trial[:, 2]) + 1e-12
+        r_new, jac_new, cost_new = residuals(trial)
+        better = np.isfinite(cost_new) & (cost_new < cost)
+        params = np.where(better[:, None], trial, params)
+        r = np.where(better[:, None], r_new, r)
+        jac = np.where(better[:, None, None], jac_new, jac)
+        converged = better & (cost - cost_new <= tol * np.maximum(cost, 1e-300))
+        cost = np.where(better, cost_new, cost)
+        lam = np.where(better, lam / 10, lam * 10)
+        if np.all(converged | ~enough | (lam > 1e12)):
+            break
+
+    lo = np.array([min(r[0], r[2]) for r in ranges])
+    hi = np.array([max(r[0], r[2]) for r in ranges])
+    ok = enough & np.isfinite(params).all(axis=1) & (params[:, 0] > 0) & (params[:, 2] > 0) \
+        & (params[:, 1] >= lo) & (params[:, 1] <= hi)
+    return PeakFit(function, ranges, params, ok)
+
+
+def _scale(r) -> float:
+    return 1.4826 * np.median(np.abs(r - np.median(r)))
+
+
+def robust_polyfit(x, y, deg: int, method: str = 'huber', threshold: float = None, max_iter: int = 50,
+                   min_scale: float = 0.0):
+    # (係数, インライアのマスク)を返す．点数が次数+1以下なら普通の最小二乗
+    # min_scaleは残差のばらつきの下限(チャンネル間隔など)．よく合っているときに正しい点まで外れ値にしない
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.shape[0]
+    if n <= deg + 1 or method == 'none':
+        return np.polyfit(x, y, min(deg, n - 1)), np.ones(n, dtype=bool)
+    if method == 'huber':
+        weights = np.ones(n)
+        coeffs = np.polyfit(x, y, deg)
+        for _ in range(max_iter):
+            r = y - np.polyval(coeffs, x)
+            s = max(_scale(r), min_scale)
+            if s == 0:
+                break
+            k = 1.345 * s
+            new = np.where(np.abs(r) <= k, 1.0, k / np.maximum(np.abs(r), 1e-300))
+            coeffs = np.polyfit(x, y, deg, w=np.sqrt(new))
+            if np.allclose(new, weights):
+                break
+            weights = new
+        r = y - np.polyval(coeffs, x)
+        s = max(_scale(r), min_scale)
+        limit = threshold if threshold is not None else 3 * s
+        inliers = np.abs(r) <= limit if limit > 0 else np.ones(n, dtype=bool)
+        return coeffs, inliers
+    if method == 'ransac':
+        if threshold is None:
+            r = y - np.polyval(np.polyfit(x, y, deg), x)
+            threshold = max(3 * max(_scale(r), min_scale), 1e-9 * (np.ptp(y) or 1.0))
+        subsets = list(itertools.islice(itertools.combinations(range(n), deg + 1), 500))
+        best, best_count, best_cost = None, -1, np.inf
+        for subset in subsets:
+            subset = list(subset)
+            if np.unique(x[subset]).shape[0] < deg + 1:
+                continue
+            c = np.polyfit(x[subset], y[subset], deg)
+            r = np.abs(y - np.polyval(c, x))
+            inliers = r <= threshold
+            count, cost = inliers.sum(), (r[inliers] ** 2).sum()
+            if count > best_count or (count == best_count and cost < best_cost):
+                best, best_count, best_cost = inliers, count, cost
+        # 次数+1点はどの組でも必ず通るので，それより多くの点が合う場合だけ採用する
+        if best is None or best_count <= deg + 1:
+            return np.polyfit(x, y, deg), np.ones(n, dtype=bool)
+        return np.polyfit(x[best], y[best], deg), best
+    raise ValueError(f'Unknown method: {method}')
+
+
+class FitResult:
+    def __init__(self, peaks: PeakFit, x_true, coefficients, inliers):
+        self.peaks = peaks
+        ok = peaks.ok
+        self.fitted_x = peaks.centers[ok]
+        self.x_true = np.asarray(x_true, dtype=float)[ok]
+        self.coefficients = coefficients
+        self.inliers = inliers
+        self.residuals = np.polyval(coefficients, self.fitted_x) - self.x_true
+
+
+def calibrate(calibrator, function: str, dimension: int, ranges: list, x_true: list, warm_centers=(),
+              robust: str = 'huber'):
+    # Calibrator.calibrate(mode='manual', ...)の後と同じ状態にする(calibration_infoは呼び出し側で設定する)
+    # 失敗した場合はNone
+    x = np.asarray(calibrator.xdata, dtype=float)
+    y = np.asarray(calibrator.ydata, dtype=float)
+    previous = getattr(calibrator, 'fit_result', None)
+    warm_widths = None
+    if previous is not None and len(warm_centers) == len(previous.fitted_x):
+        warm_widths = previous.peaks.widths[previous.peaks.ok]
+    peaks = fit_peaks(x, y, ranges, function, warm_centers=warm_centers, warm_widths=warm_widths)
+    dimension = int(dimension)
+    if peaks.ok.sum() < dimension + 1:
+        return None
+    x_true = np.asarray(x_true, dtype=float)
+    spacing = float(np.median(np.abs(np.diff(x)))) if x.shape[0] > 1 else 0.0
+    coefficients, inliers = robust_polyfit(peaks.centers[peaks.ok], x_true[peaks.ok], dimension, method=robust,
+                                           min_scale=spacing)
+    result = FitResult(peaks, x_true, coefficients, inliers)
+
+    calibrator.xdata_before = x.copy()
+    calibrator.xdata = np.polyval(coefficients, x)
+    calibrator.fitted_x = result.fitted_x.tolist()
+    calibrator.found_x_true = result.x_true.tolist()
+    calibrator.fit_result = result
+    return result
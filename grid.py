@@ -0,0 +1,193 @@
+import os
+import tempfile
+import numpy as np
+
+from spectra import group_spec_dict
+from model import save_arrays
+
+# キャリブレーション後のスペクトルを共通の軸(グリッド)に補間し，平均・中央値・標準偏差を求める
+# スペクトルは少しずつ追加するので，全スペクトルをメモリに載せる必要はない
+# 補間したスペクトルは一時ファイルに書き出しておき，中央値と.npzへの保存のときだけ少しずつ読む
+
+CHUNK = 256
+# 中央値を求めるときに一度に読む量
+BLOCK_BYTES = 64 * 1024 ** 2
+
+
+def make_grid(start: float, stop: float, step: float) -> np.ndarray:
+    # stopを含む等間隔の軸
+    if step <= 0 or stop <= start:
+        raise ValueError('The grid needs start < stop and step > 0.')
+    n = int(np.floor((stop - start) / step + 1e-9)) + 1
+    return start + step * np.arange(n)
+
+
+def default_grid(spec_dict):
+    # 全スペクトルを含む範囲と，最も細かいチャンネル間隔から(start, stop, step)を決める
+    start, stop, step = np.inf, -np.inf, np.inf
+    # キャリブレーション後は全スペクトルが同じxdataを共有していることが多いので，同じものは1回だけ見る
+    seen = set()
+    for spec in spec_dict.values():
+        if id(spec.xdata) in seen:
+            continue
+        seen.add(id(spec.xdata))
+        x = np.asarray(spec.xdata, dtype=float)
+        start, stop = min(start, x.min()), max(stop, x.max())
+        if x.shape[0] > 1:
+            step = min(step, np.median(np.abs(np.diff(x))))
+    if not np.isfinite(start) or not np.isfinite(step):
+        return None
+    return float(start), float(stop), float(step)
+
+
+def resample_spec_dict(spec_dict, grid, chunk: int = CHUNK, progress=None):
+    # (ファイル名のリスト, (ファイル数, グリッドの点数)の配列)をchunk個ずつ返す
+    # 軸が同じスペクトルはSpectrumArray.resampleでまとめて補間する
+    names = list(spec_dict.keys())
+    for i in range(0, len(names), chunk):
+        part = {name: spec_dict[name] for name in names[i:i + chunk]}
+        for array in group_spec_dict(part):
+            yield array.filenames, array.resample(grid)
+        if progress is not None:
+            progress(min(i + chunk, len(names)), len(names))
+
+
+class GridAggregator:
+    # 平均と標準偏差は追加するたびにまとめて更新する(Chanの方法)．グリッドの範囲外(nan)は数えない
+    def __init__(self, grid, keep: bool = True, directory: str = None):
+        self.grid = np.asarray(grid, dtype=float)
+        self.file = tempfile.NamedTemporaryFile(dir=directory, suffix='.grid', delete=False) if keep else None
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self.names) + len(self.pending)
+
+    def clear(self) -> None:
+        # 追加したスペクトルを全て捨てる
+        m = self.grid.shape[0]
+        self.names = []
+        self.pending = {}
+        self.count = np.zeros(m, dtype=np.int64)
+        self._mean = np.zeros(m)
+        self._m2 = np.zeros(m)
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.truncate()
+
+    def add_spectrum(self, name: str, spec) -> None:
+        # 1本ずつ読み込みながら加える．CHUNK本たまったら軸ごとにまとめて補間する
+        self.pending[name] = spec
+        if len(self.pending) >= CHUNK:
+            self.flush()
+
+    def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        for names, ydata in resample_spec_dict(pending, self.grid):
+            self.add(names, ydata)
+
+    def add(self, names, ydata) -> None:
+        ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+        if ydata.shape != (len(names), self.grid.shape[0]):
+            raise ValueError('ydata must have the shape (number of files, number of grid points).')
+        valid = ~np.isnan(ydata)
+        n_b = valid.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_b = np.where(n_b > 0, np.where(valid, ydata, 0.0).sum(axis=0) / n_b, 0.0)
+            m2_b = np.where(valid, (ydata - mean_b) ** 2, 0.0).sum(axis=0)
+            n = self.count + n_b
+            delta = mean_b - self._mean
+            self._mean = np.where(n > 0, self._mean + delta * n_b / n, 0.0)
+            self._m2 = np.where(n > 0, self._m2 + m2_b + delta ** 2 * self.count * n_b / n, 0.0)
+        self.count = n
+        self.names.extend(names)
+        if self.file is not None:
+            self.file.write(np.ascontiguousarray(ydata).tobytes())
+
+    def mean(self) -> np.ndarray:
+        self.flush()
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def std(self) -> np.ndarray:
+        # 標本標準偏差．2本未満の点はnan
+        self.flush()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > 1, np.sqrt(self._m2 / (self.count - 1)), np.nan)
+
+    def ydata(self):
+        # 補間したスペクトル全体．一時ファイルをmmapするのでメモリには読み込まない
+        if self.file is None:
+            raise ValueError('The resampled spectra were not kept.')
+        self.flush()
+        self.file.flush()
+        if len(self.names) == 0:
+            return np.empty((0, self.grid.shape[0]))
+        return np.memmap(self.file.name, dtype=float, mode='r', shape=(len(self.names), self.grid.shape[0]))
+
+    def median(self) -> np.ndarray:
+        ydata = self.ydata()
+        median = np.full(self.grid.shape[0], np.nan)
+        if ydata.shape[0] == 0:
+            return median
+        block = max(1, BLOCK_BYTES // (8 * ydata.shape[0]))
+        for j in range(0, ydata.shape[1], block):
+            part = np.array(ydata[:, j:j + block])
+            ok = self.count[j:j + block] > 0
+            if ok.any():
+                median[j:j + block][ok] = np.nanmedian(part[:, ok], axis=0)
+        return median
+
+    def statistics(self) -> dict:
+        stats = dict(grid=self.grid, mean=self.mean(), std=self.std(), count=self.count)
+        if self.file is not None:
+            stats['median'] = self.median()
+        return stats
+
+    def save_npz(self, filename: str) -> None:
+        # grid, filenames, ydata(ファイル数, グリッドの点数)と統計量
+        arrays = self.statistics()
+        arrays['filenames'] = np.array(self.names, dtype=str)
+        if self.file is not None:
+            arrays['ydata'] = self.ydata()
+        save_arrays(filename, arrays)
+
+    def save_text(self, filename: str) -> None:
+        # x, mean, std, median, countのタブ区切り
+        stats = self.statistics()
+        columns = ['grid', 'mean', 'std', 'median', 'count']
+        columns = [c for c in columns if c in stats]
+        data = np.column_stack([stats[c] for c in columns])
+        tmp = filename + '.tmp'
+        header = '\t'.join(['x'] + columns[1:]) + f'\nfiles: {len(self)}'
+        fmt = ['%d' if c == 'count' else '%.6f' for c in columns]
+        np.savetxt(tmp, data, fmt=fmt, delimiter='\t', header=header)
+        os.replace(tmp, filename)
+
+    def save(self, base: str) -> list:
+        # <base>.npzと<base>.txtに保存してそのパスを返す
+        self.save_npz(base + '.npz')
+        self.save_text(base + '.txt')
+        return [base + '.npz', base + '.txt']
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            try:
+                os.remove(self.file.name)
+            except OSError:
+                pass
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def save_grid(chunks, grid, base: str) -> list:
+    # chunksは(ファイル名のリスト, 補間したスペクトル)．<base>.npzと<base>.txtに保存してそのパスを返す
+    with GridAggregator(grid, directory=os.path.dirname(os.path.abspath(base))) as aggregator:
+        for names, ydata in chunks:
+            aggregator.add(names, ydata)
+        return aggregator.save(base)
@@ -0,0 +1,1342 @@
+import os
+import time
+import tkinter as tk
+from tkinter import ttk
+from tkinter import messagebox
+from tkinter import filedialog
+from tkinterdnd2 import TkinterDnD, DND_FILES
+from tooltip import TtkTooltipLabel
+from jobs import JobRunner
+from filelist import FileList
+from session import Session, DEFAULT_SESSION_DIR, LAST_SESSION
+from profiling import profiler, tracer
+from choices import FORMATS, ENGINES
+
+font_lg = ('Arial', 24)
+font_md = ('Arial', 16)
+font_sm = ('Arial', 12)
+
+# 起動を速くするため，重いモジュールはウィンドウを表示してからimport_heavy_modules()で読み込む
+plt = patches = FigureCanvasTkAgg = NavigationToolbar2Tk = None
+Calibrator = DataLoader = None
+assign_nearest = calibrate_reference_cached = None
+CalibrationModel = ModelStore = None
+LODPlotter = get_peak_index = auto_ranges = pack_spec_dict = parallel = None
+export = grid = None
+CalibrationTable = calibrate_centers = detect_center = None
+ReferenceDatabase = DEFAULT_DATABASE = None
+
+
+def import_heavy_modules() -> None:
+    global plt, patches, FigureCanvasTkAgg, NavigationToolbar2Tk, Calibrator, DataLoader, assign_nearest, \
+        calibrate_reference_cached, CalibrationModel, ModelStore, LODPlotter, get_peak_index, auto_ranges, \
+        pack_spec_dict, parallel, export, grid, CalibrationTable, calibrate_centers, detect_center, ReferenceDatabase, \
+        DEFAULT_DATABASE
+    if plt is not None:
+        return
+    with profiler.section('import matplotlib'):
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as patches
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    with profiler.section('import calibrator'):
+        from calibrator import Calibrator
+    with profiler.section('import dataloader'):
+        from dataloader import DataLoader
+    with profiler.section('import others'):
+        from pipeline import assign_nearest, calibrate_reference_cached
+        from model import CalibrationModel, ModelStore
+        from decimate import LODPlotter
+        from peaks import get_peak_index, auto_ranges
+        from spectra import pack_spec_dict
+        import parallel
+        import export
+        import grid
+        from multicenter import CalibrationTable, calibrate_centers, detect_center
+        from database import ReferenceDatabase, DEFAULT_DATABASE
+    with profiler.section('rcParams'):
+        set_rc_params()
+
+
+def set_rc_params() -> None:
+    plt.rcParams['font.family'] = 'Arial'
+
+    plt.rcParams['xtick.direction'] = 'in'
+    plt.rcParams['ytick.direction'] = 'in'
+    plt.rcParams['xtick.major.width'] = 1.0
+    plt.rcParams['ytick.major.width'] = 1.0
+    plt.rcParams['xtick.labelsize'] = 25
+    plt.rcParams['ytick.labelsize'] = 25
+
+    plt.rcParams['axes.linewidth'] = 1.0
+    plt.rcParams['axes.labelsize'] = 35         # 軸ラベルのフォントサイズ
+    plt.rcParams['axes.linewidth'] = 1.0        # グラフ囲う線の太さ
+
+    plt.rcParams['legend.loc'] = 'best'        # 凡例の位置、"best"でいい感じのところ
+    plt.rcParams['legend.frameon'] = True       # 凡例を囲うかどうか、Trueで囲う、Falseで囲わない
+    plt.rcParams['legend.framealpha'] = 1.0     # 透過度、0.0から1.0の値を入れる
+    plt.rcParams['legend.facecolor'] = 'white'  # 背景色
+    plt.rcParams['legend.edgecolor'] = 'black'  # 囲いの色
+    plt.rcParams['legend.fancybox'] = False     # Trueにすると囲いの四隅が丸くなる
+
+    plt.rcParams['lines.linewidth'] = 1.0
+    plt.rcParams['image.cmap'] = 'jet'
+    plt.rcParams['figure.subplot.top'] = 0.95
+    plt.rcParams['figure.subplot.bottom'] = 0.15
+    plt.rcParams['figure.subplot.left'] = 0.1
+    plt.rcParams['figure.subplot.right'] = 0.95
+
+
+def update_plot(func):
+    def wrapper(*args, **kwargs):
+        # 図ができるまでは何もしない
+        if not args[0].ready:
+            return
+        args[0].ax.clear()
+        with tracer.span(f'update_plot:{func.__name__}'):
+            ret = func(*args, **kwargs)
+        args[0].canvas.draw_idle()
+        return ret
+    return wrapper
+
+
+def table_errors_message(errors: list, shown: int = 3) -> str:
+    # 中心波長の表を適用できなかったファイルの数と，最初のいくつかの理由
+    if not errors:
+        return ''
+    msg = f'{len(errors)} files were not calibrated:\n'
+    msg += ''.join(f'{e}\n' for e in errors[:shown])
+    if len(errors) > shown:
+        msg += '...\n'
+    return msg
+
+
+class MainWindow(tk.Frame):
+    def __init__(self, master: tk.Tk, workers: int = None, cache=None, database: str = None, client=None):
+        super().__init__(master)
+        self.master = master
+        self.workers = workers
+        self.cache = cache
+        self.database = database
+        # service.ServiceClient．あればCALIBRATEとDOWNLOADをサービスで行う
+        self.client = client
+        self.ready = False
+        self.master.bind('<Control-Key-z>', self.undo)
+
+        self.x0, self.y0, self.x1, self.y1 = 0, 0, 0, 0
+        self.rectangles = []
+        self.texts = []
+        self.ranges = []
+        self.drawing = False
+        self.rect_drawing = None
+        # 矩形選択中はblittingで描画する
+        self.background = None
+        self.range_backgrounds = {}
+        self.time_last_preview = 0.0
+
+        self.new_window = None
+        self.widgets_assign = {}
+
+        self.dl_raw = None
+        self.dl_ref = None
+        self.calibrator = None
+        self.reference_db = None
+        self.model_store = None
+        self.model = None
+        self.model_cached = False
+        # Rayleighで複数の中心波長をまとめてキャリブレーションしたときの表
+        self.table = None
+        self.jobs = JobRunner(self.master, on_start=self.on_job_start, on_progress=self.on_job_progress,
+                              on_finish=self.on_job_finish)
+        self.button_states = {}
+        with profiler.section('create widgets'):
+            self.create_widgets()
+        # ウィンドウを表示してから残りの初期化を行う
+        self.master.after_idle(lambda: self.master.after(10, self.initialize))
+
+    def initialize(self) -> None:
+        self.master.update_idletasks()
+        profiler.mark('window shown')
+        import_heavy_modules()
+        with profiler.section('init data'):
+            self.workers = self.workers or parallel.default_workers()
+            self.dl_raw = DataLoader()
+            self.dl_ref = DataLoader()
+            self.calibrator = Calibrator(measurement='Raman', material='sulfur', dimension=1)
+            self.reference_db = ReferenceDatabase(self.database or DEFAULT_DATABASE)
+            self.reference_db.install(self.calibrator)
+            self.model_store = ModelStore()
+            self.set_options(self.optionmenu_measurement, self.measurement, self.calibrator.get_measurement_list(),
+                             command=self.change_measurement)
+            self.set_options(self.optionmenu_material, self.material, self.calibrator.get_material_list())
+            self.set_options(self.optionmenu_dimension, self.dimension, self.calibrator.get_dimension_list())
+            self.set_options(self.optionmenu_function, self.function, self.calibrator.get_function_list())
+        with profiler.section('create figure'):
+            self.create_figure()
+        self.ready = True
+        self.msg.set('Please drag & drop data files.')
+        profiler.mark('ready')
+        profiler.report()
+        if tracer.enabled:
+            self.update_trace_summary()
+
+    def update_trace_summary(self) -> None:
+        self.trace_summary.set(tracer.summary())
+        self.master.after(1000, self.update_trace_summary)
+
+    def set_options(self, optionmenu, variable, values, command=None) -> None:
+        menu = optionmenu['menu']
+        menu.delete(0, 'end')
+        for value in values:
+            if command is None:
+                menu.add_command(label=value, command=tk._setit(variable, value))
+            else:
+                menu.add_command(label=value, command=tk._setit(variable, value, command))
+        variable.set(values[0])
+
+    def create_widgets(self) -> None:
+        # スタイル設定
+        style = ttk.Style()
+        style.theme_use('winnative')
+        style.configure('TButton', font=font_md, width=14, padding=[0, 4, 0, 4], foreground='black')
+        style.configure('R.TButton', font=font_md, width=14, padding=[0, 4, 0, 4], foreground='red')
+        style.configure('TLabel', font=font_sm, padding=[0, 4, 0, 4], foreground='black')
+        style.configure('Color.TLabel', font=font_lg, padding=[0, 0, 0, 0], width=4, background='black')
+        style.configure('TEntry', font=font_md, width=14, padding=[0, 4, 0, 4], foreground='black')
+        style.configure('TCheckbutton', font=font_md, padding=[0, 4, 0, 4], foreground='black')
+        style.configure('TMenubutton', font=font_md, padding=[20, 4, 0, 4], foreground='black')
+        style.configure('TCombobox', font=font_md, padding=[20, 4, 0, 4], foreground='black')
+        style.configure('TTreeview', font=font_md, foreground='black')
+
+        self.width_canvas = 800
+        self.height_canvas = 600
+        # 図はinitialize()で作る．それまでは同じ大きさの領域を確保しておく
+        self.frame_figure = ttk.Frame(self.master, width=self.width_canvas, height=self.height_canvas)
+        self.frame_figure.grid(row=0, column=0, rowspan=3)
+        ttk.Label(self.frame_figure, text='Loading...').place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+
+        frame_download = ttk.LabelFrame(self.master, text='Data to calibrate')
+        frame_ref = ttk.LabelFrame(self.master, text='Reference')
+        frame_msg = ttk.LabelFrame(self.master, text='Message')
+        frame_button = ttk.LabelFrame(self.master, text='')
+        frame_download.grid(row=0, column=1)
+        frame_ref.grid(row=1, column=1)
+        frame_msg.grid(row=2, column=1)
+        frame_button.grid(row=3, column=1)
+
+        # frame_listbox
+        # 表示中の行だけを持つリストなので，ファイル数が多くても追加・削除が遅くならない
+        self.filelist = FileList(frame_download, height=6, command=self.select_data)
+        self.filelist.bind_tree('<Button-2>', self.delete_data)
+        self.filelist.bind_tree('<Button-3>', self.delete_data)
+        self.filelist.bind_tree('<Delete>', self.delete_data)
+
+        self.button_download = ttk.Button(frame_download, text='DOWNLOAD', command=self.download, state=tk.DISABLED)
+        self.export_format = tk.StringVar(value=FORMATS[0])
+        optionmenu_format = ttk.OptionMenu(frame_download, self.export_format, FORMATS[0], *FORMATS)
+        optionmenu_format.config(width=10)
+        optionmenu_format['menu'].config(font=font_sm)
+        self.overlay = tk.BooleanVar(value=True)
+        checkbutton_overlay = ttk.Checkbutton(frame_download, text='Overlay selected', variable=self.overlay,
+                                              command=lambda: self.select_data(None))
+        # DOWNLOADのときに共通の軸に補間したスペクトルと平均・中央値・標準偏差も保存する
+        self.use_grid = tk.BooleanVar(value=False)
+        self.grid_spec = tk.StringVar(value='')
+        checkbutton_grid = ttk.Checkbutton(frame_download, text='Resample to grid (start, stop, step)',
+                                           variable=self.use_grid, command=self.fill_grid)
+        entry_grid = ttk.Entry(frame_download, textvariable=self.grid_spec, justify=tk.CENTER)
+        self.filelist.pack()
+        checkbutton_overlay.pack()
+        checkbutton_grid.pack()
+        entry_grid.pack()
+        optionmenu_format.pack()
+        self.button_download.pack()
+
+        # frame_ref
+        self.filename_ref = tk.StringVar(value='')
+        self.label_ref = TtkTooltipLabel(frame_ref, text_tooltip='', textvariable=self.filename_ref, width=40)
+        self.label_ref.bind('<Button-1>', lambda e: self.show_spectrum_ref())
+        self.label_ref.bind('<Button-2>', lambda e: self.delete_spectrum_ref())
+
+        # 選択肢はinitialize()でCalibratorから設定する
+        self.measurement = tk.StringVar(value='')
+        self.material = tk.StringVar(value='')
+        self.center = tk.DoubleVar(value=630)
+        self.dimension = tk.StringVar(value='')
+        self.function = tk.StringVar(value='')
+        self.optionmenu_measurement = ttk.OptionMenu(frame_ref, self.measurement, '', command=self.change_measurement)
+        self.optionmenu_measurement.config(width=10)
+        self.optionmenu_measurement['menu'].config(font=font_sm)
+        self.optionmenu_material = ttk.OptionMenu(frame_ref, self.material, '')
+        self.optionmenu_material.config(width=10)
+        self.optionmenu_material['menu'].config(font=font_sm)
+        self.combobox_center = ttk.Combobox(frame_ref, textvariable=self.center, values=[500, 630, 760], justify=tk.CENTER, state=tk.DISABLED)
+        self.combobox_center.config(width=10)
+        self.optionmenu_dimension = ttk.OptionMenu(frame_ref, self.dimension, '')
+        self.optionmenu_dimension.config(width=10)
+        self.optionmenu_dimension['menu'].config(font=font_sm)
+        self.optionmenu_function = ttk.OptionMenu(frame_ref, self.function, '')
+        self.optionmenu_function.config(width=10)
+        self.optionmenu_function['menu'].config(font=font_sm)
+        # fast: fitting.pyでまとめてフィッティングする．calibrator: Calibrator.calibrate(従来どおり)
+        self.engine = tk.StringVar(value='calibrator')
+        optionmenu_engine = ttk.OptionMenu(frame_ref, self.engine, 'calibrator', *ENGINES)
+        optionmenu_engine.config(width=10)
+        optionmenu_engine['menu'].config(font=font_sm)
+        button_assign_manually = ttk.Button(frame_ref, text='ASSIGN', command=self.open_assign_window)
+        button_auto_range = ttk.Button(frame_ref, text='AUTO RANGE', command=self.select_ranges_automatically)
+        self.frame_assign = None
+        self.button_calibrate = ttk.Button(frame_ref, text='CALIBRATE', command=self.calibrate, state=tk.DISABLED)
+        self.label_ref.grid(row=0, column=0, columnspan=6)
+        self.optionmenu_measurement.grid(row=1, column=0)
+        self.optionmenu_material.grid(row=1, column=1)
+        self.combobox_center.grid(row=1, column=2)
+        self.optionmenu_dimension.grid(row=2, column=0)
+        self.optionmenu_function.grid(row=2, column=1)
+        button_assign_manually.grid(row=2, column=2)
+        button_save_model = ttk.Button(frame_ref, text='SAVE CALIB', command=self.save_model)
+        button_load_model = ttk.Button(frame_ref, text='LOAD CALIB', command=self.load_model)
+        button_auto_range.grid(row=3, column=0)
+        self.button_calibrate.grid(row=3, column=1, columnspan=2)
+        button_save_model.grid(row=4, column=0)
+        button_load_model.grid(row=4, column=1)
+        optionmenu_engine.grid(row=4, column=2)
+
+        # frame_msg
+        self.msg = tk.StringVar(value='Starting...')
+        label_msg = ttk.Label(master=frame_msg, textvariable=self.msg)
+        self.progressbar = ttk.Progressbar(frame_msg, orient=tk.HORIZONTAL, length=300, mode='determinate')
+        self.button_cancel = ttk.Button(frame_msg, text='CANCEL', command=self.jobs.cancel, state=tk.DISABLED)
+        label_msg.pack()
+        self.progressbar.pack()
+        self.button_cancel.pack()
+        # --traceのときは計測結果の要約を表示する
+        self.trace_summary = tk.StringVar(value='')
+        if tracer.enabled:
+            label_trace = ttk.Label(master=frame_msg, textvariable=self.trace_summary, font=('Courier', 10))
+            label_trace.pack()
+
+        # frame_button
+        self.button_reset = ttk.Button(frame_button, text='RESET', command=self.reset)
+        button_help = ttk.Button(frame_button, text='HELP', command=self.show_help)
+        button_database = ttk.Button(frame_button, text='DATABASE', command=self.open_database)
+        button_save_session = ttk.Button(frame_button, text='SAVE SESSION', command=self.save_session)
+        button_load_session = ttk.Button(frame_button, text='LOAD SESSION', command=self.load_session)
+        self.button_reset.grid(row=0, column=0)
+        button_help.grid(row=0, column=1)
+        button_database.grid(row=0, column=2)
+        button_save_session.grid(row=1, column=0)
+        button_load_session.grid(row=1, column=1)
+
+        # canvas_drop
+        self.canvas_drop = tk.Canvas(self.master, width=self.width_canvas, height=self.height_canvas)
+        self.canvas_drop.create_rectangle(0, 0, self.width_canvas, self.height_canvas / 2, fill='lightgray')
+        self.canvas_drop.create_rectangle(0, self.height_canvas / 2, self.width_canvas, self.height_canvas, fill='gray')
+        self.canvas_drop.create_text(self.width_canvas / 2, self.height_canvas * 1 / 4, text='Data to Calibrate',
+                                     font=('Arial', 30))
+        self.canvas_drop.create_text(self.width_canvas / 2, self.height_canvas * 3 / 4, text='Reference Data',
+                                     font=('Arial', 30))
+
+    def create_figure(self) -> None:
+        dpi = 50
+        if os.name == 'posix':
+            fig = plt.figure(figsize=(self.width_canvas / 2 / dpi, self.height_canvas / 2 / dpi), dpi=dpi)
+        else:
+            fig = plt.figure(figsize=(self.width_canvas / dpi, self.height_canvas / dpi), dpi=dpi)
+
+        fig.canvas.mpl_connect('button_press_event', self.on_press)
+        fig.canvas.mpl_connect('motion_notify_event', self.draw_preview)
+        fig.canvas.mpl_connect('button_release_event', self.on_release)
+        fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.ax = fig.add_subplot(111)
+        self.plotter = LODPlotter(self.ax)
+
+        self.canvas = FigureCanvasTkAgg(fig, self.master)
+        if tracer.enabled:
+            # draw_idleからも呼ばれるので，実際の描画をすべて計測できる
+            self.canvas.draw = tracer.wrap('canvas.draw', self.canvas.draw)
+        self.frame_figure.destroy()
+        self.canvas.get_tk_widget().grid(row=0, column=0, rowspan=3)
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self.master, pack_toolbar=False)
+        self.toolbar.update()
+        self.toolbar.grid(row=3, column=0)
+
+    def open_assign_window(self):
+        if not self.ready:
+            return
+        self.new_window = tk.Toplevel(self.master)
+        self.new_window.title('Assign Peaks')
+
+        self.frame_assign = ttk.Frame(self.new_window)
+        self.frame_assign.pack(fill=tk.BOTH, expand=True)
+
+        label_description = ttk.Label(self.frame_assign, text='適用したい場合はウィンドウを開いたままにしてください．')
+        label_index = ttk.Label(self.frame_assign, text='Index')
+        label_x = ttk.Label(self.frame_assign, text='x')
+        label_description.grid(row=0, column=0, columnspan=2)
+        label_index.grid(row=1, column=0)
+        label_x.grid(row=1, column=1)
+
+        self.refresh_assign_window()
+
+    def refresh_assign_window(self):
+        # clear
+        for w in self.widgets_assign.values():
+            for ww in w:
+                ww.destroy()
+        self.widgets_assign = {}
+        # create
+        self.calibrator.set_measurement(self.measurement.get())
+        self.calibrator.set_material(self.material.get())
+        x_true = self.calibrator.get_true_x()
+        auto_x_true = self.assign_peaks_automatically()
+        for i, (r, auto) in enumerate(zip(self.ranges, auto_x_true)):
+            label_index = ttk.Label(self.frame_assign, text=str(self.ranges.index(r)))
+            combobox_x = ttk.Combobox(self.frame_assign, values=list(x_true), justify=tk.CENTER)
+            combobox_x.set(auto)
+            label_index.grid(row=i + 2, column=0)
+            combobox_x.grid(row=i + 2, column=1)
+            self.widgets_assign[i] = (label_index, combobox_x)
+
+    def assign_peaks_automatically(self):
+        return assign_nearest(get_peak_index(self.calibrator), self.ranges)
+
+    def select_ranges_automatically(self):
+        if self.jobs.busy or self.filename_ref.get() == '':
+            return
+        spec_ref = self.dl_ref.spec_dict[self.filename_ref.get()]
+        self.calibrator.set_measurement(self.measurement.get())
+        self.calibrator.set_material(self.material.get())
+        ranges, x_true = auto_ranges(spec_ref.xdata, spec_ref.ydata, get_peak_index(self.calibrator))
+        if len(ranges) == 0:
+            self.msg.set('No peak was found.')
+            return
+        self.ranges = ranges
+        self.rectangles = [patches.Rectangle((x0, y0), x1 - x0, y1 - y0, linewidth=1, edgecolor='r', facecolor='none')
+                           for x0, y0, x1, y1 in ranges]
+        self.texts = []
+        if self.new_window is not None and self.new_window.winfo_exists():
+            self.refresh_assign_window()
+        self.show_spectrum_ref()
+        self.msg.set(f'Found {len(ranges)} peaks.')
+
+    def assign_peaks(self):
+        if self.new_window is None or not self.new_window.winfo_exists():
+            return self.assign_peaks_automatically()
+        found_x_true = []
+        for widgets in self.widgets_assign.values():
+            x = widgets[1].get()
+            found_x_true.append(float(x))
+        return found_x_true
+
+    def calibrate(self) -> None:
+        if len(self.ranges) == 0:
+            messagebox.showerror('Error', 'Choose range.')
+            self.show_spectrum_ref()
+            return
+        spec_ref = self.dl_ref.spec_dict[self.filename_ref.get()]
+        self.calibrator.set_measurement(self.measurement.get())
+        self.calibrator.set_material(self.material.get())
+        # Tkの変数はワーカースレッドから触らないので，ここで読んでおく
+        # 実行中に測定や物質を変えても影響しないように，ジョブには別のCalibratorを渡し，成功したら入れ替える
+        calibrator = self.new_calibrator(self.measurement.get(), self.material.get(), int(self.dimension.get()[0]))
+        args = (self.model_store, calibrator, spec_ref, self.filename_ref.get(), self.measurement.get(),
+                self.material.get(), int(self.dimension.get()[0]), self.function.get(), list(self.ranges))
+        kwargs = dict(x_true=self.assign_peaks(), center=self.center.get(), engine=self.engine.get())
+        # 同じ参照を範囲を変えてやり直す場合だけ，前回のピーク位置から始める
+        if self.model is not None and self.model.filename_ref == self.filename_ref.get():
+            kwargs['warm_centers'] = list(self.model.fitted_x)
+        self.jobs.submit('Calibrating', lambda job: self.calibrate_in_background(job, args, kwargs),
+                         on_done=lambda result: self.on_calibrated(result, calibrator), on_error=self.on_job_error)
+
+    def calibrate_in_background(self, job, args, kwargs):
+        with tracer.span('calibrate', function=args[7], dimension=args[6], n_ranges=len(args[8])):
+            if self.client is not None:
+                return self.calibrate_remotely(job, *args, **kwargs)
+            return calibrate_reference_cached(*args, **kwargs)
+
+    def calibrate_remotely(self, job, store, calibrator, spec_ref, filename_ref, measurement, material, dimension,
+                           function, ranges, x_true=None, center=None, engine='calibrator', warm_centers=None):
+        # サービスでフィッティングした結果をこちらのCalibratorに戻す．フィッティングの詳細はないので保存済みの結果と同じ扱い
+        model, _ = self.client.calibrate(spec_ref, filename_ref, measurement, material, dimension, function, ranges,
+                                         x_true=x_true, center=center, engine=engine, check=job.check)
+        calibrator.set_data(spec_ref.xdata, spec_ref.ydata)
+        model.restore(calibrator)
+        calibrator.fit_result = None
+        return True, model, True
+
+    @update_plot
+    def on_calibrated(self, result, calibrator) -> None:
+        ok, self.model, self.model_cached = result
+        if not ok:
+            self.msg.set('Calibration failed.')
+            return
+        self.calibrator = calibrator
+        self.table = None
+        self.button_calibrate.config(state=tk.DISABLED)
+        self.button_download.config(state=tk.ACTIVE)
+        msg = 'Successfully calibrated.\nYou can now download the calibrated data.\n'
+        if self.client is not None:
+            msg += f'(Calibrated by {self.client.url})\n'
+        elif self.model_cached:
+            msg += '(The previous result for the same reference and ranges was used.)\n'
+
+        parallel.apply_to_all(self.dl_raw, self.calibrator, self.filename_ref.get())
+
+        # 外れ値として多項式の回帰から除いたピークには*を付ける
+        fit_result = getattr(self.calibrator, 'fit_result', None)
+        inliers = fit_result.inliers if fit_result is not None else [True] * len(self.model.fitted_x)
+        msg += 'Found peak, True value, Residual\n'
+        for fitted_x, true_x, residual, inlier in zip(self.model.fitted_x, self.model.found_x_true,
+                                                      self.model.residuals(), inliers):
+            msg += f'{fitted_x:.2f}, {true_x:.2f}, {residual:+.2f}{"" if inlier else " *"}\n'
+        self.msg.set(msg)
+        for r in self.rectangles:
+            self.ax.add_patch(r)
+        self.show_fit_result()
+
+    def show_fit_result(self) -> None:
+        with tracer.span('show_fit_result'):
+            self._show_fit_result()
+
+    def _show_fit_result(self) -> None:
+        # 保存済みの結果を使った場合はフィッティングの詳細がないので，校正後のスペクトルと真値を表示する
+        fit_result = getattr(self.calibrator, 'fit_result', None)
+        if not self.model_cached and fit_result is not None:
+            # fitting.pyでフィッティングした場合は，元の軸のスペクトルに各ピークのフィッティング結果を重ねる
+            self.plotter.plot(self.calibrator.xdata_before, self.calibrator.ydata, color='k')
+            peaks = fit_result.peaks
+            for i in range(len(peaks.ranges)):
+                if peaks.ok[i]:
+                    self.ax.plot(*peaks.curve(i), color='r')
+            return
+        if not self.model_cached:
+            self.calibrator.show_fit_result(self.ax)
+            return
+        self.plotter.plot(self.calibrator.xdata, self.calibrator.ydata, color='k')
+        for x in self.calibrator.found_x_true:
+            self.ax.axvline(x, color='r', linestyle='dashed')
+
+    def save_model(self) -> None:
+        if not self.ready:
+            return
+        if self.model is None and self.table is None:
+            messagebox.showerror('Error', 'Calibrate first.')
+            return
+        filename = filedialog.asksaveasfilename(defaultextension='.npz', filetypes=[('Calibration', '*.npz')])
+        if not filename:
+            return
+        if self.table is not None:
+            self.table.save(filename)
+        else:
+            self.model.save(filename)
+        self.msg.set(f'Saved {filename}.')
+
+    def load_model(self) -> None:
+        if not self.ready or self.jobs.busy:
+            return
+        filename = filedialog.askopenfilename(filetypes=[('Calibration', '*.npz')])
+        if not filename:
+            return
+        try:
+            self.msg.set(self.apply_saved_calibration(filename))
+        except (OSError, KeyError, ValueError) as e:
+            self.msg.set(f'Could not load {os.path.basename(filename)}.\n{e}')
+
+    def apply_saved_calibration(self, filename: str) -> str:
+        # 保存したキャリブレーション結果(1つの結果または中心波長ごとの表)を読み込んで適用し，メッセージを返す
+        if CalibrationTable.is_table(filename):
+            self.table = CalibrationTable.load(filename)
+            n = self.apply_table(self.dl_raw.spec_dict)
+            self.button_download.config(state=tk.ACTIVE)
+            return (f'Loaded {os.path.basename(filename)}.\n'
+                    f'Centers: {", ".join(f"{c:g}" for c in self.table.centers())} nm\n'
+                    + (f'{n} files have no calibration for their center.' if n else ''))
+        self.table = None
+        self.model = CalibrationModel.load(filename)
+        self.measurement.set(self.model.measurement)
+        self.change_measurement()
+        self.material.set(self.model.material)
+        self.model.restore(self.calibrator)
+        # フィッティングの詳細はないので，保存済みの結果を使った場合と同じように表示する
+        self.model_cached = True
+        self.calibrator.fit_result = None
+        parallel.apply_to_all(self.dl_raw, self.calibrator, self.model.filename_ref)
+        self.button_download.config(state=tk.ACTIVE)
+        return f'Loaded {os.path.basename(filename)}.\nReference: {os.path.basename(self.model.filename_ref)}'
+
+    def snapshot(self) -> Session:
+        # 手動の割り当てはASSIGNのウィンドウが開いているときだけ保存する
+        x_true = None
+        if self.new_window is not None and self.new_window.winfo_exists():
+            x_true = self.assign_peaks()
+        return Session(self.measurement.get(), self.material.get(), self.dimension.get(), self.function.get(),
+                       self.center.get(), self.filename_ref.get(), self.ranges, x_true,
+                       list(self.dl_raw.spec_dict.keys()))
+
+    def save_session(self) -> None:
+        if not self.ready:
+            return
+        os.makedirs(DEFAULT_SESSION_DIR, exist_ok=True)
+        filename = filedialog.asksaveasfilename(defaultextension='.json', initialdir=DEFAULT_SESSION_DIR,
+                                                filetypes=[('Session', '*.json')])
+        if not filename:
+            return
+        self.snapshot().save(filename, model=self.table if self.table is not None else self.model)
+        self.msg.set(f'Saved {filename}.')
+
+    def autosave_session(self) -> None:
+        # 終了やRESETの前に作業状態を残しておく．LOAD SESSIONでlast.jsonを選べば戻せる
+        if not self.ready or (self.filename_ref.get() == '' and len(self.dl_raw.spec_dict) == 0):
+            return
+        try:
+            self.snapshot().save(LAST_SESSION, model=self.table if self.table is not None else self.model)
+        except OSError:
+            pass
+
+    def load_session(self) -> None:
+        if not self.ready or self.jobs.busy:
+            return
+        filename = filedialog.askopenfilename(initialdir=DEFAULT_SESSION_DIR, filetypes=[('Session', '*.json')])
+        if not filename:
+            return
+        self.restore_session(filename)
+
+    def restore_session(self, filename: str) -> None:
+        try:
+            session = Session.load(filename)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror('Error', f'Could not load the session: {e}')
+            return
+        self.clear_workspace()
+        self.measurement.set(session.measurement)
+        self.change_measurement()
+        self.material.set(session.material)
+        self.dimension.set(session.dimension)
+        self.function.set(session.function)
+        self.center.set(session.center)
+        self.calibrator.set_material(session.material)
+        self.jobs.submit('Restoring', lambda job: self.restore_in_background(job, session),
+                         on_done=lambda result: self.on_restored(session, result), on_error=self.on_job_error)
+
+    def restore_in_background(self, job, session: Session):
+        # キャッシュにあるファイルはテキストを解析せずに読み込まれる
+        filenames = [f for f in session.filenames if os.path.exists(f)]
+        dl_ref = self.load_in_background(job, [session.filename_ref], workers=1) \
+            if os.path.exists(session.filename_ref) else DataLoader()
+        dl_raw = self.load_in_background(job, filenames, workers=self.workers) if filenames else DataLoader()
+        return dl_ref, dl_raw, len(session.filenames) - len(filenames)
+
+    @update_plot
+    def on_restored(self, session: Session, result) -> None:
+        dl_ref, dl_raw, missing = result
+        msg = ''
+        if session.filename_ref in dl_ref.spec_dict:
+            self.dl_ref.spec_dict.update(dl_ref.spec_dict)
+            self.filename_ref.set(session.filename_ref)
+            self.label_ref.set_tooltip_text(session.filename_ref)
+            self.button_calibrate.config(state=tk.ACTIVE)
+        elif session.filename_ref != '':
+            msg += f'Reference not found: {session.filename_ref}\n'
+        self.dl_raw.spec_dict.update(dl_raw.spec_dict)
+        self.filelist.add(dl_raw.spec_dict.keys())
+        # 範囲の矩形はまとめて作り，描画は最後に1回だけ行う
+        self.ranges = list(session.ranges)
+        self.rectangles = [patches.Rectangle((x0, y0), x1 - x0, y1 - y0, linewidth=1, edgecolor='r', facecolor='none')
+                           for x0, y0, x1, y1 in self.ranges]
+        if session.calibration is not None and os.path.exists(session.calibration):
+            try:
+                self.apply_saved_calibration(session.calibration)
+            except (OSError, KeyError, ValueError) as e:
+                msg += f'Could not load the calibration: {e}\n'
+        if session.x_true is not None and len(session.x_true) == len(self.ranges):
+            self.open_assign_window()
+            for (_, combobox), x in zip(self.widgets_assign.values(), session.x_true):
+                combobox.set(x)
+        if self.filename_ref.get() != '':
+            self.show_spectrum_ref()
+        elif len(self.dl_raw.spec_dict) > 0:
+            self.show_spectrum(next(iter(self.dl_raw.spec_dict.values())))
+        msg += f'Restored {len(dl_raw.spec_dict)} files and {len(self.ranges)} ranges.\n'
+        if missing:
+            msg += f'{missing} files were not found.\n'
+        self.msg.set(msg)
+
+    def setattr_to_all_raw(self, key, value):
+        for spec in self.dl_raw.spec_dict.values():
+            setattr(spec, key, value)
+
+    def drop(self, event=None) -> None:
+        with tracer.span('drop'):
+            self._drop(event)
+
+    def _drop(self, event) -> None:
+        self.canvas_drop.place_forget()
+        if not self.ready or self.jobs.busy:
+            self.msg.set('Please wait until the current job is finished.')
+            return
+
+        master_geometry = list(map(int, self.master.winfo_geometry().split('+')[1:]))
+
+        dropped_place = (event.y_root - master_geometry[1] - 30) / self.height_canvas
+
+        threshold = 1 / 2
+
+        if event.data[0] == '{':
+            filenames = list(map(lambda x: x.strip('{').strip('}'), event.data.split('} {')))
+        else:
+            filenames = event.data.split()
+
+        # 読み込みは別のDataLoaderで行い，完了後にメインスレッドで反映する
+        if dropped_place > threshold and len(filenames) > 1:  # reference data of several center wavelengths
+            self.calibrate_all_centers(filenames)
+        elif dropped_place > threshold:  # reference data
+            filename = filenames[0]
+            self.jobs.submit('Loading', lambda job: self.load_in_background(job, [filename], workers=1),
+                             on_done=lambda dl: self.on_loaded_ref(filename, dl), on_error=self.on_job_error)
+        else:  # data to calibrate
+            self.jobs.submit('Loading', lambda job: self.load_in_background(job, filenames, workers=self.workers),
+                             on_done=lambda dl: self.on_loaded_raw(filenames, dl), on_error=self.on_job_error)
+
+    def calibrate_all_centers(self, filenames) -> None:
+        # 中心波長ごとの参照をまとめて読み込み，同時にキャリブレーションする
+        refs = {}
+        for filename in filenames:
+            try:
+                center = detect_center(filename)
+            except ValueError as e:
+                messagebox.showerror('Error', str(e))
+                return
+            if center is None:
+                messagebox.showerror('Error', f'The center wavelength is not in the file name: '
+                                              f'{os.path.basename(filename)}')
+                return
+            refs[center] = filename
+        if self.measurement.get() != 'Rayleigh':
+            self.measurement.set('Rayleigh')
+            self.change_measurement()
+        args = (refs, self.material.get(), int(self.dimension.get()[0]), self.function.get(), self.engine.get())
+        self.jobs.submit('Calibrating centers', lambda job: self.calibrate_centers_in_background(job, *args),
+                         on_done=self.on_calibrated_centers, on_error=self.on_job_error)
+
+    def calibrate_centers_in_background(self, job, refs, material, dimension, function, engine):
+        dl = self.load_in_background(job, list(refs.values()), workers=1)
+        specs = {center: (filename, dl.spec_dict[filename]) for center, filename in refs.items()}
+        with tracer.span('calibrate_centers', centers=len(specs)):
+            table, failed = calibrate_centers(
+                lambda: self.new_calibrator('Rayleigh', material, dimension),
+                self.model_store, specs, material, dimension, function, engine=engine)
+        return table, failed, specs
+
+    @update_plot
+    def on_calibrated_centers(self, result) -> None:
+        table, failed, specs = result
+        if len(table) == 0:
+            self.msg.set('Calibration failed.')
+            return
+        self.table = table
+        self.model = None
+        errors = self.apply_table(self.dl_raw.spec_dict)
+        self.button_download.config(state=tk.ACTIVE)
+        msg = 'Successfully calibrated.\nCenter, Peaks, RMS residual\n'
+        for center in table.centers():
+            model = table.models[center]
+            self.plotter.plot(model.xdata, specs[center][1].ydata, color=None)
+            msg += f'{center:g}, {len(model.fitted_x)}, {model.rms_residual():.3f}\n'
+        for center in failed:
+            msg += f'{center:g}: failed\n'
+        msg += table_errors_message(errors)
+        self.msg.set(msg)
+
+    def apply_table(self, spec_dict) -> list:
+        # 各ファイルを中心波長で振り分けて適用する．適用できなかったファイルのエラーのリストを返す
+        errors = []
+        for filename, spec in spec_dict.items():
+            try:
+                self.table.apply(filename, spec)
+            except ValueError as e:
+                errors.append(e)
+        return errors
+
+    def load_in_background(self, job, filenames, workers):
+        dl = DataLoader()
+        with tracer.span('load_files', files=len(filenames), workers=workers):
+            parallel.load_files(dl, filenames, workers=workers, progress=job.progress, cache=self.cache)
+        if tracer.enabled:
+            tracer.count('files loaded', len(dl.spec_dict))
+            tracer.count('points loaded', sum(len(spec.xdata) for spec in dl.spec_dict.values()))
+            tracer.count('bytes loaded', sum(os.path.getsize(f) for f in dl.spec_dict if os.path.exists(f)))
+        # 軸が共通のスペクトルはxdataを共有し，ydataを1つの2次元配列にまとめる
+        if len(dl.spec_dict) > 1:
+            pack_spec_dict(dl.spec_dict)
+        return dl
+
+    @update_plot
+    def on_loaded_ref(self, filename, dl) -> None:
+        if self.filename_ref.get() != '':
+            self.dl_ref.delete_file(self.filename_ref.get())
+        self.setattr_to_all_raw('abs_path_ref', filename)
+        self.filename_ref.set(filename)
+        self.label_ref.set_tooltip_text(filename)
+        self.dl_ref.spec_dict.update(dl.spec_dict)
+        self.rectangles = []
+        self.texts = []
+        self.ranges = []
+        self.refresh_assign_window()
+        self.show_spectrum(self.dl_ref.spec_dict[filename])
+        self.check_data_type(filename)
+        self.button_calibrate.config(state=tk.ACTIVE)
+        self.button_download.config(state=tk.DISABLED)
+
+    @update_plot
+    def on_loaded_raw(self, filenames, dl) -> None:
+        self.dl_raw.spec_dict.update(dl.spec_dict)
+        self.show_spectrum(self.dl_raw.spec_dict[filenames[0]])
+        self.filelist.add(dl.spec_dict.keys())
+        self.button_download.config(state=tk.DISABLED)
+        self.msg.set(f'Loaded {len(filenames)} files.')
+        if self.table is not None:
+            errors = self.apply_table(dl.spec_dict)
+            self.button_download.config(state=tk.ACTIVE)
+            if errors:
+                self.msg.set(f'Loaded {len(filenames)} files.\n{table_errors_message(errors)}')
+
+    def on_job_start(self, job) -> None:
+        self.button_states = {}
+        for button in [self.button_calibrate, self.button_download, self.button_reset]:
+            self.button_states[button] = str(button.cget('state'))
+            button.config(state=tk.DISABLED)
+        self.button_cancel.config(state=tk.ACTIVE)
+        self.progressbar.config(mode='indeterminate')
+        self.progressbar.start()
+        self.msg.set(f'{job.name}...')
+
+    def on_job_progress(self, job, i, n) -> None:
+        if str(self.progressbar.cget('mode')) != 'determinate':
+            self.progressbar.stop()
+            self.progressbar.config(mode='determinate')
+        self.progressbar.config(maximum=n, value=i)
+        self.msg.set(f'{job.name}... {i}/{n}')
+
+    def on_job_finish(self, job, kind) -> None:
+        for button, state in self.button_states.items():
+            button.config(state=state)
+        self.button_states = {}
+        self.button_cancel.config(state=tk.DISABLED)
+        self.progressbar.stop()
+        self.progressbar.config(mode='determinate', value=0)
+        if kind == 'cancelled':
+            self.msg.set(f'{job.name} cancelled.')
+
+    def on_job_error(self, e: Exception) -> None:
+        self.msg.set(f'Error: {e}')
+
+    def drop_enter(self, event: TkinterDnD.DnDEvent) -> None:
+        self.canvas_drop.place(anchor='nw', x=0, y=0)
+
+    def drop_leave(self, event: TkinterDnD.DnDEvent) -> None:
+        self.canvas_drop.place_forget()
+
+    def check_data_type(self, filename):
+        # deviceで判別できる場合
+        if self.dl_ref.spec_dict[filename].device == 'Renishaw':
+            self.calibrator.set_measurement('Raman')
+            self.measurement.set('Raman')
+        elif self.dl_ref.spec_dict[filename].device in ['CSS']:
+            self.calibrator.set_measurement('Rayleigh')
+            self.measurement.set('Rayleigh')
+        self.change_measurement()
+        try:
+            center = detect_center(filename)
+        except ValueError as e:
+            center = None
+            messagebox.showwarning('Warning', f'{e}\nPlease choose the center wavelength.')
+        if center is not None:
+            self.center.set(center)
+
+        # filenameに物質名が入っている場合
+        found = self.reference_db.match(filename)
+        if found is not None:
+            measurement, material = found
+            self.measurement.set(measurement)
+            self.change_measurement()
+            self.material.set(material)
+
+        self.calibrator.set_measurement(self.measurement.get())
+        self.calibrator.set_material(self.material.get())
+
+    def change_measurement(self, event=None):
+        if self.measurement.get() == 'Raman':
+            self.combobox_center.config(state=tk.DISABLED)
+        elif self.measurement.get() == 'Rayleigh':
+            self.combobox_center.config(state=tk.ACTIVE)
+        self.calibrator.set_measurement(self.measurement.get())
+        # update material
+        self.optionmenu_material['menu'].delete(0, 'end')
+        material_list = self.calibrator.get_material_list()
+        for material in material_list:
+            self.optionmenu_material['menu'].add_command(label=material, command=tk._setit(self.material, material))
+        self.material.set(material_list[0])
+        self.calibrator.set_material(material_list[0])
+
+    def show_spectrum(self, spec, color='k') -> None:
+        # 点数が多くても描画コストが表示幅程度で済むように間引いて描画する
+        self.plotter.plot(spec.xdata, spec.ydata, color=color)
+
+    @update_plot
+    def show_spectrum_ref(self) -> None:
+        if self.jobs.busy or self.filename_ref.get() == '':
+            return
+        # キャリブレーション後は詳細を表示
+        if self.calibrator.xdata_before is not None:
+            self.show_fit_result()
+        # キャリブレーション前はスペクトルのみ表示
+        else:
+            self.show_spectrum(self.dl_ref.spec_dict[self.filename_ref.get()])
+
+        self.texts = []
+        for ran, rec in zip(self.ranges, self.rectangles):
+            self.ax.add_patch(rec)
+            t = self.ax.text(ran[2], ran[3], str(self.ranges.index(ran)), color='r', fontsize=20)
+            self.texts.append(t)
+
+    @update_plot
+    def delete_spectrum_ref(self) -> None:
+        if self.jobs.busy or self.filename_ref.get() == '':
+            return
+        ok = messagebox.askyesno('確認', f'Delete {self.filename_ref.get()}?')
+        if not ok:
+            return
+        self.dl_ref.delete_file(self.filename_ref.get())
+        self.msg.set(f'Deleted {self.filename_ref.get()}.')
+        self.filename_ref.set('')
+        self.label_ref.set_tooltip_text('')
+
+    @update_plot
+    def select_data(self, event) -> None:
+        key = self.filelist.focus()
+        if key is None:
+            return
+        selection = self.filelist.selection()
+        if not self.overlay.get() or len(selection) <= 1:
+            self.show_spectrum(self.dl_raw.spec_dict[key])
+            return
+        for key in selection:
+            self.show_spectrum(self.dl_raw.spec_dict[key], color=None)
+
+    @update_plot
+    def delete_data(self, event) -> None:
+        # 選択中のファイルをまとめて削除する
+        keys = self.filelist.selection()
+        if not keys and self.filelist.focus() is not None:
+            keys = [self.filelist.focus()]
+        if self.jobs.busy or not keys:
+            return
+        text = keys[0] if len(keys) == 1 else f'{len(keys)} files'
+        ok = messagebox.askyesno('確認', f'Delete {text}?')
+        if not ok:
+            return
+        for key in keys:
+            self.dl_raw.delete_file(key)
+
+        self.filelist.remove(keys)
+        self.msg.set(f'Deleted {text}.')
+
+    def on_press(self, event):
+        if event.xdata is None or event.ydata is None:
+            return
+        # Toolbarのズーム機能を使っている状態では動作しないようにする
+        if self.toolbar._buttons['Zoom'].var.get():
+            return
+        self.x0 = event.xdata
+        self.y0 = event.ydata
+
+        self.drawing = True
+        if self.rect_drawing is not None and self.rect_drawing.axes is not None:
+            self.rect_drawing.remove()
+        # animatedな矩形は通常の描画に含まれないので，現在の画面を背景として保存しておく
+        self.rect_drawing = patches.Rectangle((self.x0, self.y0), 0, 0, linewidth=0.5, edgecolor='r',
+                                              linestyle='dashed', facecolor='none', animated=True)
+        self.ax.add_patch(self.rect_drawing)
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox) if self.canvas.supports_blit else None
+
+    def on_release(self, event):
+        if event.xdata is None or event.ydata is None:
+            return
+        # Toolbarのズーム機能を使っている状態では動作しないようにする
+        if self.toolbar._buttons['Zoom'].var.get():
+            return
+
+        # プレビュー用の矩形を消す
+        if self.rect_drawing is not None:
+            if self.rect_drawing.axes is not None:
+                self.rect_drawing.remove()
+            self.rect_drawing = None
+            if self.background is not None:
+                self.canvas.restore_region(self.background)
+                self.canvas.blit(self.ax.bbox)
+
+        self.drawing = False
+
+        self.x1 = event.xdata
+        self.y1 = event.ydata
+        if self.x0 == self.x1 or self.y0 == self.y1:
+            return
+        if self.is_overlapped(self.x0, self.x1):
+            messagebox.showerror('Error', 'Overlapped.')
+            return
+        x0, x1 = sorted([self.x0, self.x1])
+        y0, y1 = sorted([self.y0, self.y1])
+        r = patches.Rectangle((x0, y0), x1 - x0, y1 - y0, linewidth=1, edgecolor='r',
+                              facecolor='none')
+        self.ax.add_patch(r)
+        t = self.ax.text(x1, y1, str(len(self.rectangles)), color='r', fontsize=20)
+        self.rectangles.append(r)
+        self.texts.append(t)
+        self.ranges.append((x0, y0, x1, y1))
+        if self.background is not None:
+            # 全体を再描画せず，背景に新しい矩形だけを描き足す．undo用に描き足す前の背景を覚えておく
+            self.range_backgrounds[r] = self.background
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(r)
+            self.ax.draw_artist(t)
+            self.canvas.blit(self.ax.bbox)
+            self.background = None
+        else:
+            self.canvas.draw_idle()
+        if self.new_window is not None and self.new_window.winfo_exists():
+            self.refresh_assign_window()
+
+    def draw_preview(self, event):
+        if event.xdata is None or event.ydata is None:
+            return
+        if not self.drawing:
+            return
+        # Toolbarのズーム機能を使っている状態では動作しないようにする
+        if self.toolbar._buttons['Zoom'].var.get():
+            return
+        if self.rect_drawing is None:
+            return
+        # 60fps以上では描画しない
+        now = time.perf_counter()
+        if now - self.time_last_preview < 1 / 60:
+            return
+        self.time_last_preview = now
+        x1 = event.xdata
+        y1 = event.ydata
+        self.rect_drawing.set_bounds(self.x0, self.y0, x1 - self.x0, y1 - self.y0)
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.rect_drawing)
+        self.canvas.blit(self.ax.bbox)
+
+    def on_draw(self, event):
+        # 全体が再描画されたら保存していた背景は使えない
+        self.range_backgrounds = {}
+        if self.drawing and self.canvas.supports_blit:
+            self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+
+    def is_overlapped(self, x0, x1):
+        for x0_, y0_, x1_, y1_ in self.ranges:
+            if x0_ <= x0 <= x1_ or x0_ <= x1 <= x1_:
+                return True
+            if x0 <= x0_ <= x1 or x0 <= x1_ <= x1:
+                return True
+        return False
+
+    def undo(self, event):
+        if len(self.rectangles) == 0:
+            return
+        background = self.range_backgrounds.pop(self.rectangles[-1], None)
+        self.rectangles[-1].remove()
+        self.rectangles.pop()
+        self.texts[-1].remove()
+        self.texts.pop()
+        self.ranges.pop()
+        if background is not None:
+            self.canvas.restore_region(background)
+            self.canvas.blit(self.ax.bbox)
+        else:
+            self.canvas.draw_idle()
+
+    def download(self) -> None:
+        with tracer.span('download'):
+            self._download()
+
+    def _download(self) -> None:
+        try:
+            grid_x = self.get_grid()
+        except ValueError as e:
+            messagebox.showerror('Error', str(e))
+            return
+        fmt = self.export_format.get()
+        if fmt != 'txt' or self.uses_service():
+            self.download_as(fmt, grid_x)
+            return
+        filenames = list(self.dl_raw.spec_dict.keys())
+        spec_dict = dict(self.dl_raw.spec_dict)
+        self.jobs.submit('Saving',
+                         lambda job: self.save_in_background(job, filenames)
+                         + self.grid_in_background(job, spec_dict, grid_x, None),
+                         on_done=self.on_downloaded, on_error=self.on_job_error)
+
+    def download_as(self, fmt: str, grid_x=None) -> None:
+        filename = None
+        if fmt in export.EXTENSIONS:
+            ext = export.EXTENSIONS[fmt]
+            filename = filedialog.asksaveasfilename(defaultextension=ext, filetypes=[(fmt, '*' + ext)])
+            if not filename:
+                return
+        spec_dict = dict(self.dl_raw.spec_dict)
+        if self.uses_service():
+            # ファイルはサービスからも同じパスで見える必要がある(共有フォルダなど)
+            model = self.model
+            save = lambda job: self.apply_remotely(job, model, list(spec_dict), fmt, filename)
+        else:
+            save = lambda job: self.export_in_background(job, spec_dict, fmt, filename)
+        self.jobs.submit('Saving',
+                         lambda job: save(job) + self.grid_in_background(job, spec_dict, grid_x, filename),
+                         on_done=self.on_downloaded, on_error=self.on_job_error)
+
+    def uses_service(self) -> bool:
+        # 中心波長ごとの表はサービスに送らず，手元で保存する
+        return self.client is not None and self.model is not None and self.table is None
+
+    def fill_grid(self) -> None:
+        # 空欄のときはデータ全体の範囲と最も細かいチャンネル間隔を入れておく
+        if not self.ready or not self.use_grid.get() or self.grid_spec.get().strip() != '':
+            return
+        spec = grid.default_grid(self.dl_raw.spec_dict)
+        if spec is not None:
+            self.grid_spec.set(', '.join(f'{v:g}' for v in spec))
+
+    def get_grid(self):
+        # 補間しない場合はNone
+        if not self.use_grid.get():
+            return None
+        values = self.grid_spec.get().replace(',', ' ').split()
+        if len(values) != 3:
+            raise ValueError('Enter the grid as "start, stop, step".')
+        return grid.make_grid(*map(float, values))
+
+    def save_in_background(self, job, filenames):
+        with tracer.span('save_files', files=len(filenames), workers=self.workers):
+            saved = parallel.save_files(self.dl_raw, filenames, workers=self.workers, progress=job.progress)
+        tracer.count('files saved', len(saved))
+        return saved
+
+    def export_in_background(self, job, spec_dict, fmt, filename):
+        with tracer.span('export', files=len(spec_dict), format=fmt):
+            names = export.export_spec_dict(spec_dict, fmt, filename, progress=job.progress)
+        tracer.count('files saved', len(names))
+        if filename is not None and os.path.exists(filename):
+            tracer.count('bytes saved', os.path.getsize(filename))
+        return names
+
+    def apply_remotely(self, job, model, filenames, fmt, filename) -> list:
+        with tracer.span('apply_remotely', files=len(filenames), format=fmt):
+            result = self.client.apply(model, filenames, fmt=fmt, output=filename, check=job.check)
+        tracer.count('files saved', len(result['saved']))
+        if result['failed']:
+            raise RuntimeError(f'{len(result["failed"])} files failed on the service: '
+                               f'{os.path.basename(result["failed"][0][0])}: {result["failed"][0][1]}')
+        return [filename] if filename is not None else result['saved']
+
+    def grid_in_background(self, job, spec_dict, grid_x, filename) -> list:
+        # 1ファイルにまとめた場合はその横に，それ以外は最初のデータと同じフォルダにgrid_<時刻>.npz, .txtを保存する
+        if grid_x is None:
+            return []
+        job.check()
+        if filename is not None:
+            base = os.path.splitext(filename)[0] + '_grid'
+        else:
+            directory = os.path.dirname(next(iter(spec_dict)))
+            base = os.path.join(directory, f'grid_{time.strftime("%Y%m%d%H%M%S")}')
+        with tracer.span('resample', files=len(spec_dict), points=len(grid_x)):
+            return grid.save_grid(grid.resample_spec_dict(spec_dict, grid_x, progress=job.progress), grid_x, base)
+
+    def on_downloaded(self, filenames) -> None:
+        msg = 'Successfully downloaded.\n'
+        for filename in filenames:
+            msg += os.path.basename(filename) + '\n'
+        self.msg.set(msg)
+
+    @update_plot
+    def reset(self):
+        if self.jobs.busy:
+            return
+        self.autosave_session()
+        self.clear_workspace()
+        self.msg.set(f'Reset.')
+        if self.cache is not None and messagebox.askyesno('確認', 'Clear the cache of loaded spectra too?'):
+            self.cache.clear()
+            self.msg.set(f'Reset. Cache cleared.')
+
+    def clear_workspace(self) -> None:
+        self.rectangles = []
+        self.texts = []
+        self.ranges = []
+        self.refresh_assign_window()
+        self.filelist.clear()
+        self.filename_ref.set('')
+        self.label_ref.set_tooltip_text('')
+        self.dl_raw.__init__()
+        self.dl_ref.__init__()
+        self.calibrator.__init__(measurement='Raman', material='sulfur', dimension=1)
+        self.reference_db.install(self.calibrator)
+        self.calibrator.fit_result = None
+        self.model = None
+        self.model_cached = False
+        self.table = None
+        self.button_download.config(state=tk.DISABLED)
+        self.button_calibrate.config(state=tk.DISABLED)
+
+    def show_help(self):
+        messagebox.showinfo('HELP', '''
+        Raman\n
+        sulfur: 86 ~ 470 cm-1\n
+          naphthalene: 514 ~ 1576 cm-1\n
+          1,4-Bis(2-methylstyryl)benzene: 1178 ~ 1627 cm-1\n
+          acetonitrile: 2254 ~ 2940 cm-1\n\n
+        参照ピークが・・・\n2本か3本しかないとき:Linear\n
+        中心波長付近にあるとき: Quadratic\n
+        全体に分布しているとき: Cubic\n\n
+        Andorのデータはずれが大きく正しくできない\n
+          ことがあります。重要なものはSolisを使って\n
+          キャリブレーションしてください
+        ''')
+
+    def new_calibrator(self, measurement: str, material: str, dimension: int):
+        calibrator = Calibrator(measurement=measurement, material=material, dimension=dimension)
+        self.reference_db.install(calibrator)
+        calibrator.set_material(material)
+        return calibrator
+
+    def open_database(self):
+        if not self.ready:
+            return
+        window = tk.Toplevel(self.master)
+        window.title('Database')
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        # 範囲を指定して，今選んでいる測定の全物質のピークを探す
+        self.db_lower = tk.StringVar(value='')
+        self.db_upper = tk.StringVar(value='')
+        self.db_unit = tk.StringVar(value=self.reference_db.unit(self.measurement.get()))
+        entry_lower = ttk.Entry(frame, textvariable=self.db_lower, width=10, justify=tk.CENTER)
+        entry_upper = ttk.Entry(frame, textvariable=self.db_upper, width=10, justify=tk.CENTER)
+        label_unit = ttk.Label(frame, textvariable=self.db_unit)
+        button_search = ttk.Button(frame, text='SEARCH', command=self.search_database)
+        self.treeview_db = ttk.Treeview(frame, height=12, columns=['position', 'material'], show='headings')
+        self.treeview_db.heading('position', text='position')
+        self.treeview_db.heading('material', text='material')
+        self.treeview_db.column('position', width=120, anchor=tk.CENTER)
+        self.treeview_db.column('material', width=200, anchor=tk.CENTER)
+        self.treeview_db.bind('<<TreeviewSelect>>', self.select_database_line)
+
+        # 自分で測った標準物質を追加する．ピーク位置はカンマ区切り
+        self.db_material = tk.StringVar(value='')
+        self.db_positions = tk.StringVar(value='')
+        label_material = ttk.Label(frame, text='Material')
+        label_positions = ttk.Label(frame, text='Peaks (comma separated)')
+        entry_material = ttk.Entry(frame, textvariable=self.db_material, width=20)
+        entry_positions = ttk.Entry(frame, textvariable=self.db_positions, width=40)
+        button_add = ttk.Button(frame, text='ADD', command=self.add_user_material)
+        button_remove = ttk.Button(frame, text='REMOVE', command=self.remove_user_material)
+        button_web = ttk.Button(frame, text='WEB', command=self.open_database_web)
+
+        entry_lower.grid(row=0, column=0)
+        entry_upper.grid(row=0, column=1)
+        label_unit.grid(row=0, column=2)
+        button_search.grid(row=0, column=3)
+        self.treeview_db.grid(row=1, column=0, columnspan=4)
+        label_material.grid(row=2, column=0)
+        entry_material.grid(row=2, column=1, columnspan=3)
+        label_positions.grid(row=3, column=0)
+        entry_positions.grid(row=3, column=1, columnspan=3)
+        button_add.grid(row=4, column=0)
+        button_remove.grid(row=4, column=1)
+        button_web.grid(row=4, column=3)
+        self.search_database()
+
+    def search_database(self) -> None:
+        measurement = self.measurement.get()
+        try:
+            lower = float(self.db_lower.get()) if self.db_lower.get() != '' else float('-inf')
+            upper = float(self.db_upper.get()) if self.db_upper.get() != '' else float('inf')
+        except ValueError:
+            messagebox.showerror('Error', 'Enter numbers for the range.')
+            return
+        self.db_unit.set(self.reference_db.unit(measurement))
+        self.treeview_db.delete(*self.treeview_db.get_children())
+        for x, material in self.reference_db.lines_between(measurement, lower, upper):
+            self.treeview_db.insert('', tk.END, values=[f'{x:g}', material])
+
+    def select_database_line(self, event=None) -> None:
+        # 選んだ行の物質のピークを入力欄に出して，編集や削除をしやすくする
+        selection = self.treeview_db.selection()
+        if not selection:
+            return
+        material = self.treeview_db.item(selection[0], 'values')[1]
+        self.db_material.set(material)
+        lines = self.reference_db.lines(self.measurement.get(), material)
+        self.db_positions.set(', '.join(f'{x:g}' for x in lines))
+
+    def add_user_material(self) -> None:
+        try:
+            positions = [float(x) for x in self.db_positions.get().replace(' ', '').split(',') if x != '']
+            self.reference_db.add_material(self.measurement.get(), self.db_material.get().strip(), positions)
+        except ValueError as e:
+            messagebox.showerror('Error', str(e))
+            return
+        self.refresh_materials()
+        self.search_database()
+        self.msg.set(f'Added {self.db_material.get().strip()} to {self.measurement.get()}.')
+
+    def remove_user_material(self) -> None:
+        material = self.db_material.get().strip()
+        if material not in self.reference_db.materials(self.measurement.get()):
+            return
+        if not messagebox.askyesno('確認', f'Remove {material}?'):
+            return
+        try:
+            self.reference_db.remove_material(self.measurement.get(), material)
+        except ValueError as e:
+            messagebox.showerror('Error', str(e))
+            return
+        self.refresh_materials()
+        self.search_database()
+        self.msg.set(f'Removed {material} from {self.measurement.get()}.')
+
+    def refresh_materials(self) -> None:
+        # 選んでいる物質はそのままで，物質の選択肢だけを更新する
+        material = self.material.get()
+        self.reference_db.install(self.calibrator)
+        self.calibrator.set_measurement(self.measurement.get())
+        material_list = self.calibrator.get_material_list()
+        self.set_options(self.optionmenu_material, self.material, material_list)
+        if material in material_list:
+            self.material.set(material)
+        self.calibrator.set_material(self.material.get())
+
+    def open_database_web(self):
+        import webbrowser
+        webbrowser.open('https://www.chem.ualberta.ca/~mccreery/ramanmaterials.html')
+
+    def quit(self) -> None:
+        self.autosave_session()
+        self.master.quit()
+
+
+def main(workers: int = None, cache=None, database: str = None, client=None):
+    with profiler.section('create root window'):
+        root = TkinterDnD.Tk()
+    app = MainWindow(master=root, workers=workers, cache=cache, database=database, client=client)
+    root.protocol('WM_DELETE_WINDOW', app.quit)
+    root.drop_target_register(DND_FILES)
+    root.dnd_bind('<<DropEnter>>', app.drop_enter)
+    root.dnd_bind('<<DropLeave>>', app.drop_leave)
+    root.dnd_bind('<<Drop>>', app.drop)
+    app.mainloop()
@@ -0,0 +1,101 @@
+import queue
+import threading
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name: str, messages: queue.Queue):
+        self.name = name
+        self._messages = messages
+        self._cancel = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(self.name)
+
+    def progress(self, i: int, n: int) -> None:
+        # ワーカースレッドから呼ばれる．Tkには触らずキュー経由でメインスレッドに渡す
+        self.check()
+        self._messages.put(('progress', self, (i, n)))
+
+
+class JobRunner:
+    # 重い処理をワーカースレッドで実行し，結果をafter()によるポーリングでメインスレッドに返す
+    # 同時に実行するジョブは1つだけ
+    def __init__(self, master, on_start=None, on_progress=None, on_finish=None, interval: int = 50):
+        self.master = master
+        self.on_start = on_start
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.interval = interval
+        self._messages = queue.Queue()
+        self._job = None
+        self._callbacks = None
+
+    @property
+    def busy(self) -> bool:
+        return self._job is not None
+
+    def submit(self, name: str, func, on_done=None, on_error=None) -> bool:
+        if self.busy:
+            return False
+        job = Job(name, self._messages)
+        self._job = job
+        self._callbacks = (on_done, on_error)
+        if self.on_start is not None:
+            self.on_start(job)
+        threading.Thread(target=self._run, args=(job, func), daemon=True).start()
+        self.master.after(self.interval, self._poll)
+        return True
+
+    def cancel(self) -> None:
+        if self._job is not None:
+            self._job.cancel()
+
+    def _run(self, job: Job, func) -> None:
+        try:
+            result = func(job)
+        except JobCancelled:
+            self._messages.put(('cancelled', job, None))
+        except Exception as e:
+            self._messages.put(('error', job, e))
+        else:
+            self._messages.put(('done', job, result))
+
+    def _poll(self) -> None:
+        last_progress = None
+        while True:
+            try:
+                kind, job, value = self._messages.get_nowait()
+            except queue.Empty:
+                break
+            if job is not self._job:
+                continue
+            if kind == 'progress':
+                last_progress = value
+                continue
+            self._finish(job, kind, value)
+            return
+        if last_progress is not None and self.on_progress is not None:
+            self.on_progress(self._job, *last_progress)
+        self.master.after(self.interval, self._poll)
+
+    def _finish(self, job: Job, kind: str, value) -> None:
+        on_done, on_error = self._callbacks
+        self._job = None
+        self._callbacks = None
+        if self.on_finish is not None:
+            self.on_finish(job, kind)
+        if kind == 'done' and on_done is not None:
+            on_done(value)
+        elif kind == 'error' and on_error is not None:
+            on_error(value)
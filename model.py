@@ -0,0 +1,185 @@
+import os
+import json
+import zipfile
+import hashlib
+import numpy as np
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.expanduser('~'), '.easycalibration', 'models')
+DEFAULT_MAX_MODEL_BYTES = 256 * 1024 ** 2
+
+
+def file_hash(filename: str) -> str:
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_key(ref_hash: str, measurement: str, material: str, dimension: int, function: str, ranges, x_true,
+              center: float = None, engine: str = 'calibrator') -> str:
+    # 同じ参照スペクトル・範囲・条件なら同じキーになる
+    if measurement != 'Rayleigh':
+        center = None
+    params = dict(ref_hash=ref_hash, measurement=measurement, material=material, dimension=int(dimension),
+                  function=function, center=center, ranges=[list(map(float, r)) for r in ranges],
+                  x_true=[float(x) for x in x_true], engine=engine)
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_arrays(filename: str, arrays: dict) -> None:
+    # 一時ファイルに書いてからrenameする
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, filename)
+
+
+def _json_default(o):
+    # calibration_infoに含まれるNumPyの値をリストや数値にする
+    return o.tolist() if hasattr(o, 'tolist') else str(o)
+
+
+class CalibrationModel:
+    # キャリブレーションの結果．保存しておけば再度フィッティングせずに適用できる
+    def __init__(self, measurement: str, material: str, dimension: int, function: str, center: float,
+                 ranges: list, fitted_x, found_x_true, xdata_before, xdata, calibration_info,
+                 filename_ref: str, ref_hash: str):
+        self.measurement = measurement
+        self.material = material
+        self.dimension = int(dimension)
+        self.function = function
+        self.center = center
+        self.ranges = [tuple(map(float, r)) for r in ranges]
+        self.fitted_x = np.asarray(fitted_x, dtype=float)
+        self.found_x_true = np.asarray(found_x_true, dtype=float)
+        self.xdata_before = np.asarray(xdata_before, dtype=float)
+        self.xdata = np.asarray(xdata, dtype=float)
+        self.calibration_info = calibration_info
+        self.filename_ref = filename_ref
+        self.ref_hash = ref_hash
+        # 元の軸から校正後の軸への多項式
+        self.coefficients = np.polyfit(self.xdata_before, self.xdata, self.dimension)
+
+    @classmethod
+    def from_calibrator(cls, calibrator, measurement: str, material: str, dimension: int, function: str,
+                        ranges: list, center: float, filename_ref: str, ref_hash: str = None):
+        return cls(measurement, material, dimension, function, center, ranges, calibrator.fitted_x,
+                   calibrator.found_x_true, calibrator.xdata_before, calibrator.xdata, calibrator.calibration_info,
+                   filename_ref, ref_hash or file_hash(filename_ref))
+
+    def restore(self, calibrator) -> None:
+        # フィッティングした直後と同じ状態にする
+        calibrator.set_measurement(self.measurement)
+        calibrator.set_material(self.material)
+        calibrator.set_dimension(self.dimension)
+        calibrator.set_function(self.function)
+        calibrator.xdata_before = self.xdata_before.copy()
+        calibrator.xdata = self.xdata.copy()
+        calibrator.fitted_x = self.fitted_x.tolist()
+        calibrator.found_x_true = self.found_x_true.tolist()
+        calibrator.calibration_info = self.calibration_info
+
+    def residuals(self):
+        # 各ピークの校正後の位置と真値の差
+        return np.polyval(self.coefficients, self.fitted_x) - self.found_x_true
+
+    def rms_residual(self) -> float:
+        return float(np.sqrt(np.mean(self.residuals() ** 2)))
+
+    def to_arrays(self, prefix: str = '') -> dict:
+        # calibration_infoもmetaのJSONに入れ，読み込みにpickleを使わないようにする
+        meta = dict(measurement=self.measurement, material=self.material, dimension=self.dimension,
+                    function=self.function, center=self.center, ranges=self.ranges,
+                    calibration_info=self.calibration_info, filename_ref=self.filename_ref, ref_hash=self.ref_hash)
+        arrays = dict(meta=json.dumps(meta, default=_json_default), fitted_x=self.fitted_x,
+                      found_x_true=self.found_x_true, xdata_before=self.xdata_before, xdata=self.xdata,
+                      coefficients=self.coefficients)
+        return {prefix + key: value for key, value in arrays.items()}
+
+    @classmethod
+    def from_arrays(cls, f, prefix: str = ''):
+        meta = json.loads(str(f[prefix + 'meta']))
+        if 'calibration_info' not in meta:
+            # 以前の版はcalibration_infoをpickleで保存していた．安全に読めないのでキャリブレーションし直してもらう
+            raise ValueError('This calibration was saved by an older version. Please calibrate again.')
+        return cls(meta['measurement'], meta['material'], meta['dimension'], meta['function'], meta['center'],
+                   meta['ranges'], f[prefix + 'fitted_x'], f[prefix + 'found_x_true'], f[prefix + 'xdata_before'],
+                   f[prefix + 'xdata'], meta['calibration_info'], meta['filename_ref'], meta['ref_hash'])
+
+    def to_dict(self) -> dict:
+        # JSONで送れる形．calibration_infoに含まれるNumPyの値もリストや数値にする
+        d = dict(measurement=self.measurement, material=self.material, dimension=self.dimension,
+                 function=self.function, center=self.center, ranges=self.ranges, fitted_x=self.fitted_x.tolist(),
+                 found_x_true=self.found_x_true.tolist(), xdata_before=self.xdata_before.tolist(),
+                 xdata=self.xdata.tolist(), calibration_info=self.calibration_info,
+                 filename_ref=self.filename_ref, ref_hash=self.ref_hash)
+        return json.loads(json.dumps(d, default=_json_default))
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(d['measurement'], d['material'], d['dimension'], d['function'], d['center'], d['ranges'],
+                   d['fitted_x'], d['found_x_true'], d['xdata_before'], d['xdata'], d['calibration_info'],
+                   d['filename_ref'], d['ref_hash'])
+
+    def save(self, filename: str) -> None:
+        save_arrays(filename, self.to_arrays())
+
+    @classmethod
+    def load(cls, filename: str):
+        if not zipfile.is_zipfile(filename):
+            raise ValueError(f'{filename} is not a saved calibration (.npz).')
+        with np.load(filename, allow_pickle=False) as f:
+            return cls.from_arrays(f)
+
+
+class ModelStore:
+    # キーで引けるキャリブレーション結果の保存場所
+    # 合計がmax_bytesを超えたら，最後に使ったのが古いものから消す
+    def __init__(self, directory: str = DEFAULT_MODEL_DIR, max_bytes: int = DEFAULT_MAX_MODEL_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            model = CalibrationModel.load(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        # LRUのために最終使用時刻を更新
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return model
+
+    def put(self, key: str, model: CalibrationModel) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        model.save(self.path(key))
+        self.evict()
+
+    def entries(self) -> list:
+        # (最終使用時刻, サイズ, パス)のリスト
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for f in os.scandir(self.directory):
+            if f.is_file() and f.name.endswith('.npz'):
+                st = f.stat()
+                entries.append((st.st_mtime, st.st_size, f.path))
+        return entries
+
+    def evict(self) -> None:
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,116 @@
+import os
+import re
+import zipfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from model import CalibrationModel, save_arrays
+from peaks import get_peak_index, auto_ranges
+from pipeline import calibrate_reference_cached, rayleigh_axis
+
+# Rayleigh(CSS)で複数の中心波長の参照をまとめてキャリブレーションし，中心波長ごとの表にする
+# データは中心波長で表から結果を選んで適用する
+
+CENTERS = [500, 630, 760]
+
+
+def detect_center(filename: str, centers=CENTERS):
+    # ファイル名に数として含まれる中心波長を返す(1500や20240630の一部は数えない)
+    # なければNone，2つ以上の中心波長が含まれていればValueError
+    name = os.path.basename(filename)
+    found = [float(center) for center in centers
+             if re.search(rf'(?<!\d)(?<!\d\.){re.escape(f"{center:g}")}(?!\.?\d)', name)]
+    if len(found) > 1:
+        raise ValueError(f'Several center wavelengths ({", ".join(f"{c:g}" for c in found)}) are in the file name: '
+                         f'{name}')
+    return found[0] if found else None
+
+
+class CalibrationTable:
+    # 中心波長 -> CalibrationModel
+    def __init__(self, models: dict = None):
+        self.models = dict(models or {})
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def centers(self) -> list:
+        return sorted(self.models)
+
+    def add(self, center: float, model: CalibrationModel) -> None:
+        self.models[float(center)] = model
+
+    def route(self, filename: str):
+        # ファイル名の中心波長の結果を返す．中心波長がない，または表にない場合はValueError
+        # 表にない中心波長も探して，別の中心波長のファイルを取り違えないようにする
+        center = detect_center(filename, sorted(set(CENTERS) | set(self.centers())))
+        if center is None:
+            raise ValueError(f'The center wavelength is not in the file name: {os.path.basename(filename)}')
+        if center not in self.models:
+            raise ValueError(f'No calibration for {center:g} nm: {os.path.basename(filename)}')
+        return self.models[center]
+
+    def apply(self, filename: str, spec) -> None:
+        # 適用できない場合はValueError
+        model = self.route(filename)
+        if model.xdata.shape[0] != np.asarray(spec.xdata).shape[0]:
+            raise ValueError(f'The calibration has {model.xdata.shape[0]} channels, '
+                             f'but {os.path.basename(filename)} has {np.asarray(spec.xdata).shape[0]}')
+        spec.xdata = model.xdata
+        spec.abs_path_ref = model.filename_ref
+        spec.calibration = model.calibration_info
+
+    def save(self, filename: str) -> None:
+        arrays = dict(centers=np.array(self.centers(), dtype=float))
+        for i, center in enumerate(self.centers()):
+            arrays.update(self.models[center].to_arrays(prefix=f'model{i}_'))
+        save_arrays(filename, arrays)
+
+    @classmethod
+    def load(cls, filename: str):
+        with np.load(filename, allow_pickle=False) as f:
+            return cls({float(center): CalibrationModel.from_arrays(f, prefix=f'model{i}_')
+                        for i, center in enumerate(f['centers'])})
+
+    @staticmethod
+    def is_table(filename: str) -> bool:
+        # 中身は読まずに名前だけ見る．.npzでなければFalse(ファイルがなければFileNotFoundError)
+        try:
+            with zipfile.ZipFile(filename) as f:
+                return 'centers.npy' in f.namelist()
+        except zipfile.BadZipFile:
+            return False
+
+
+def calibrate_center(calibrator, store, spec_ref, filename_ref: str, material: str, dimension: int, function: str,
+                     center: float, tolerance: float = None, engine: str = 'calibrator'):
+    # 1つの中心波長の参照を，ピークを自動で探してキャリブレーションする．(ok, model, cached)を返す
+    calibrator.set_measurement('Rayleigh')
+    calibrator.set_material(material)
+    x = rayleigh_axis(center, spec_ref.xdata.shape[0])
+    ranges, x_true = auto_ranges(x, spec_ref.ydata, get_peak_index(calibrator), tolerance=tolerance)
+    if len(ranges) <= dimension:
+        return False, None, False
+    return calibrate_reference_cached(store, calibrator, spec_ref, filename_ref, 'Rayleigh', material, dimension,
+                                      function, ranges, x_true=x_true, center=center, engine=engine)
+
+
+def calibrate_centers(make_calibrator, store, refs: dict, material: str, dimension: int, function: str,
+                      tolerance: float = None, engine: str = 'calibrator', workers: int = None):
+    # refs: 中心波長 -> (ファイル名, スペクトル)．中心波長ごとに別のCalibratorで同時にフィッティングする
+    # (CalibrationTable, 失敗した中心波長のリスト)を返す
+    def run(center):
+        filename_ref, spec_ref = refs[center]
+        ok, model, _ = calibrate_center(make_calibrator(), store, spec_ref, filename_ref, material, dimension,
+                                        function, center, tolerance=tolerance, engine=engine)
+        return center, ok, model
+
+    table = CalibrationTable()
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or len(refs) or 1) as executor:
+        for center, ok, model in executor.map(run, sorted(refs)):
+            if ok:
+                table.add(center, model)
+            else:
+                failed.append(center)
+    return table, failed
@@ -0,0 +1,177 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dataloader import DataLoader
+from pipeline import apply_calibration, calibrate_file, calibrate_files as calibrate_files_serial
+
+# ファイル数がこれより少ない場合はプロセス起動のコストの方が大きいので逐次処理する
+MIN_FILES_PARALLEL = 16
+# 逐次に返す処理で，ワーカー1つあたり同時に投入しておくタスク数
+# 使う側が遅くても，読み込み済みで待っているスペクトルはワーカー数×これ以下になる
+TASKS_PER_WORKER = 4
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def _use_pool(n_files: int, workers: int) -> bool:
+    return workers > 1 and n_files >= MIN_FILES_PARALLEL
+
+
+def _load_one(filename: str, cache=None):
+    dl = DataLoader()
+    dl.load_file(filename)
+    spec = dl.spec_dict.get(filename)
+    if spec is not None and cache is not None:
+        cache.put(filename, spec)
+    return spec
+
+
+def load_files(dl, filenames, workers: int = None, progress=None, cache=None) -> None:
+    # 並列に読み込んだ結果をfilenamesの順にspec_dictへ格納するので，逐次処理と同じ結果になる
+    filenames = list(filenames)
+    workers = workers or default_workers()
+    n = len(filenames)
+    specs = [None] * n
+    done = 0
+    missed = []
+    for i, filename in enumerate(filenames):
+        spec = cache.get(filename) if cache is not None else None
+        if spec is None:
+            missed.append(i)
+            continue
+        specs[i] = spec
+        done += 1
+        if progress is not None:
+            progress(done, n)
+
+    if not _use_pool(len(missed), workers):
+        for i in missed:
+            specs[i] = _load_one(filenames[i], cache)
+            done += 1
+            if progress is not None:
+                progress(done, n)
+    else:
+        chunksize = max(1, len(missed) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                results = executor.map(_load_one, [filenames[i] for i in missed], [cache] * len(missed),
+                                       chunksize=chunksize)
+                for i, spec in zip(missed, results):
+                    specs[i] = spec
+                    done += 1
+                    if progress is not None:
+                        progress(done, n)
+            except BaseException:
+                # キャンセル時などは未着手のタスクを捨てる
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    for filename, spec in zip(filenames, specs):
+        if spec is not None:
+            dl.spec_dict[filename] = spec
+    if cache is not None and missed:
+        cache.evict()
+
+
+def _map_bounded(executor, fn, items, window: int):
+    # executor.mapと同じく入力の順に結果を返すが，最初に全件を投入せずに未取得のタスクをwindow個までに抑える
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _load_one_safe(filename: str):
+    try:
+        return _load_one(filename), None
+    except Exception as e:
+        return None, e
+
+
+def iter_load(filenames, workers: int = None):
+    # (filename, spec, error)を入力の順に1つずつ返す．全ファイルを一度にメモリに載せない
+    filenames = list(filenames)
+    workers = workers or default_workers()
+    if not _use_pool(len(filenames), workers):
+        for filename in filenames:
+            yield (filename, *_load_one_safe(filename))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for filename, (spec, error) in zip(filenames, _map_bounded(executor, _load_one_safe, filenames,
+                                                                       workers * TASKS_PER_WORKER)):
+                yield filename, spec, error
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def apply_to_all(dl, calibrator, filename_ref: str) -> None:
+    for spec in dl.spec_dict.values():
+        apply_calibration(spec, calibrator, filename_ref)
+
+
+def save_files(dl, filenames, workers: int = None, progress=None) -> list:
+    # 書き込みはI/O待ちが主なのでスレッドで十分
+    filenames = list(filenames)
+    workers = workers or default_workers()
+    n = len(filenames)
+    if not _use_pool(n, workers):
+        for i, filename in enumerate(filenames):
+            dl.save(filename)
+            if progress is not None:
+                progress(i + 1, n)
+        return filenames
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for i, _ in enumerate(executor.map(dl.save, filenames)):
+                if progress is not None:
+                    progress(i + 1, n)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return filenames
+
+
+_worker_state = {}
+
+
+def _init_calibrate_worker(calibrator, filename_ref: str) -> None:
+    _worker_state['calibrator'] = calibrator
+    _worker_state['filename_ref'] = filename_ref
+    _worker_state['dl'] = DataLoader()
+
+
+def _calibrate_one(filename: str):
+    try:
+        calibrate_file(_worker_state['dl'], filename, _worker_state['calibrator'], _worker_state['filename_ref'])
+    except Exception as e:
+        return filename, e
+    return filename, None
+
+
+def calibrate_files(filenames, calibrator, filename_ref: str, workers: int = None):
+    # pipeline.calibrate_filesの並列版．結果は入力の順に返す
+    filenames = list(filenames)
+    workers = workers or default_workers()
+    if not _use_pool(len(filenames), workers):
+        yield from calibrate_files_serial(DataLoader(), filenames, calibrator, filename_ref)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_calibrate_worker,
+                             initargs=(calibrator, filename_ref)) as executor:
+        try:
+            yield from _map_bounded(executor, _calibrate_one, filenames, workers * TASKS_PER_WORKER)
+        except BaseException:
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
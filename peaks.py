@@ -0,0 +1,110 @@
+import numpy as np
+
+# 真値の候補として両隣から何本ずつ見るか
+N_CANDIDATES = 3
+
+
+class PeakIndex:
+    # 参照物質の真のピーク位置をソートして保持し，searchsortedで最近傍を引く
+    def __init__(self, x_true):
+        self.x = np.sort(np.asarray(x_true, dtype=float))
+
+    def assign(self, ranges, tolerance: float = None):
+        # 全ての範囲の中心に対して一度に最近傍の真値を割り当てる
+        # 複数の範囲が同じ真値を指す場合は近い方を優先し，もう一方は次に近い空いている真値にする
+        # tolerance以内に割り当てられる真値がない範囲はnanになる
+        n = len(ranges)
+        assigned = np.full(n, np.nan)
+        if n == 0 or self.x.shape[0] == 0:
+            return assigned
+        ranges = np.asarray(ranges, dtype=float).reshape(n, 4)
+        x_mid = (ranges[:, 0] + ranges[:, 2]) / 2
+        m = self.x.shape[0]
+        idx = np.searchsorted(self.x, x_mid)
+        offsets = np.arange(-N_CANDIDATES, N_CANDIDATES)
+        candidates = np.clip(idx[:, None] + offsets[None, :], 0, m - 1)
+        distance = np.abs(self.x[candidates] - x_mid[:, None])
+        if tolerance is not None:
+            distance[distance > tolerance] = np.inf
+
+        order = np.argsort(distance, axis=None)
+        used = set()
+        for flat in order:
+            i, j = divmod(int(flat), candidates.shape[1])
+            if not np.isfinite(distance[i, j]):
+                break
+            if not np.isnan(assigned[i]) or candidates[i, j] in used:
+                continue
+            assigned[i] = self.x[candidates[i, j]]
+            used.add(candidates[i, j])
+        return assigned
+
+
+_index_cache = {}
+
+
+def get_peak_index(calibrator) -> PeakIndex:
+    key = (calibrator.measurement, calibrator.material)
+    if key not in _index_cache:
+        _index_cache[key] = PeakIndex(calibrator.get_true_x())
+    return _index_cache[key]
+
+
+def clear_index_cache() -> None:
+    _index_cache.clear()
+
+
+def find_peak_ranges(x, y, n_max: int = 20, threshold: float = 5.0, width_factor: float = 3.0) -> list:
+    # 参照スペクトルからピークを探し，(x0, y0, x1, y1)の範囲のリストを返す
+    # thresholdはノイズ(中央絶対偏差)の何倍以上をピークとみなすか
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if y.shape[0] < 3:
+        return []
+    baseline = np.median(y)
+    noise = np.median(np.abs(y - baseline)) * 1.4826
+    if noise == 0:
+        noise = np.std(y) or 1.0
+    is_peak = (y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:]) & (y[1:-1] - baseline > threshold * noise)
+    peaks = np.nonzero(is_peak)[0] + 1
+    peaks = peaks[np.argsort(y[peaks])[::-1]]
+
+    ranges = []
+    occupied = np.zeros(y.shape[0], dtype=bool)
+    for p in peaks:
+        if len(ranges) >= n_max:
+            break
+        if occupied[p]:
+            continue
+        # 半値まで下がるところを半値半幅とする
+        half = baseline + (y[p] - baseline) / 2
+        left = p
+        while left > 0 and y[left] > half:
+            left -= 1
+        right = p
+        while right < y.shape[0] - 1 and y[right] > half:
+            right += 1
+        i0 = max(int(p - width_factor * (p - left)), 0)
+        i1 = min(int(p + width_factor * (right - p)), y.shape[0] - 1)
+        if i1 - i0 < 2 or occupied[i0:i1 + 1].any():
+            continue
+        occupied[i0:i1 + 1] = True
+        x0, x1 = sorted([float(x[i0]), float(x[i1])])
+        ranges.append((x0, float(y[i0:i1 + 1].min()), x1, float(y[p])))
+    return sorted(ranges)
+
+
+def default_tolerance(x) -> float:
+    # 自動で範囲を決めたときに，真値から離れすぎているものを捨てるための閾値
+    x = np.asarray(x, dtype=float)
+    return 0.02 * (x.max() - x.min())
+
+
+def auto_ranges(x, y, index: PeakIndex, tolerance: float = None):
+    # ピークを探して真値を割り当て，割り当てられなかったものは捨てる
+    if tolerance is None:
+        tolerance = default_tolerance(x)
+    ranges = find_peak_ranges(x, y)
+    x_true = index.assign(ranges, tolerance=tolerance)
+    ok = ~np.isnan(x_true)
+    return [r for r, o in zip(ranges, ok) if o], x_true[ok].tolist()
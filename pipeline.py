@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import fitting
+from peaks import PeakIndex
+from model import CalibrationModel, file_hash, model_key
+
+# GUIを介さずにキャリブレーションを行うための共通処理
+# tkinterやTkAggバックエンドには依存しないこと
+
+RAYLEIGH_WAVELENGTH_RANGE = 134
+
+
+def rayleigh_axis(center: float, n: int):
+    # Rayleighでは中心波長の周りの等間隔な軸を初期値とする
+    return np.linspace(center - RAYLEIGH_WAVELENGTH_RANGE / 2, center + RAYLEIGH_WAVELENGTH_RANGE / 2, n)
+
+
+def assign_nearest(x_true, ranges, tolerance: float = None) -> list:
+    index = x_true if isinstance(x_true, PeakIndex) else PeakIndex(x_true)
+    return index.assign(ranges, tolerance=tolerance).tolist()
+
+
+def calibrate_reference(calibrator, spec_ref, measurement: str, material: str, dimension: int, function: str,
+                        ranges: list, x_true: list = None, center: float = None, engine: str = 'calibrator',
+                        robust: str = 'huber', warm_centers: list = None) -> bool:
+    # warm_centers: 同じ参照の前回のピーク位置．範囲を少し変えただけの再キャリブレーションが速くなる
+    # 別の参照の結果を渡すと初期値がずれるので，呼び出し側で同じ参照のときだけ渡す
+    calibrator.set_data(spec_ref.xdata, spec_ref.ydata)
+    if measurement == 'Rayleigh':
+        calibrator.xdata = rayleigh_axis(center, spec_ref.xdata.shape[0])
+    calibrator.set_measurement(measurement)
+    calibrator.set_material(material)
+    calibrator.set_dimension(dimension)
+    calibrator.set_function(function)
+    if x_true is None:
+        x_true = assign_nearest(calibrator.get_true_x(), ranges)
+    # 真値を割り当てられなかった範囲は使わない
+    pairs = [(r, x) for r, x in zip(ranges, x_true) if not np.isnan(x)]
+    if len(pairs) == 0:
+        return False
+    ranges, x_true = map(list, zip(*pairs))
+    if engine == 'calibrator' or function not in fitting.FUNCTIONS:
+        calibrator.fit_result = None
+        return calibrator.calibrate(mode='manual', ranges=ranges, x_true=x_true)
+    result = fitting.calibrate(calibrator, function, dimension, ranges, x_true, warm_centers=warm_centers or (),
+                               robust=robust)
+    if result is None:
+        return False
+    calibrator.calibration_info = [measurement, material, int(dimension), function, result.coefficients.tolist()]
+    return True
+
+
+def calibrate_reference_cached(store, calibrator, spec_ref, filename_ref: str, measurement: str, material: str,
+                               dimension: int, function: str, ranges: list, x_true: list = None,
+                               center: float = None, engine: str = 'calibrator', robust: str = 'huber',
+                               ref_hash: str = None, warm_centers: list = None):
+    # 同じ参照スペクトル・範囲・条件で一度フィッティングしていれば，その結果を使う
+    # (ok, model, cached)を返す．参照ファイルが手元にない場合(service.py)はref_hashを渡す
+    if x_true is None:
+        x_true = assign_nearest(calibrator.get_true_x(), ranges)
+    ref_hash = ref_hash or file_hash(filename_ref)
+    key = model_key(ref_hash, measurement, material, dimension, function, ranges, x_true, center,
+                    engine=engine if engine == 'calibrator' else f'{engine}-{robust}')
+    model = store.get(key) if store is not None else None
+    if model is not None:
+        calibrator.set_data(spec_ref.xdata, spec_ref.ydata)
+        model.restore(calibrator)
+        calibrator.fit_result = None
+        return True, model, True
+    ok = calibrate_reference(calibrator, spec_ref, measurement, material, dimension, function, ranges,
+                             x_true=x_true, center=center, engine=engine, robust=robust, warm_centers=warm_centers)
+    if not ok:
+        return False, None, False
+    model = CalibrationModel.from_calibrator(calibrator, measurement, material, dimension, function, ranges,
+                                             center, filename_ref, ref_hash=ref_hash)
+    if store is not None:
+        try:
+            store.put(key, model)
+        except OSError:
+            pass
+    return True, model, False
+
+
+def apply_calibration(spec, calibrator, filename_ref: str) -> None:
+    spec.xdata = calibrator.xdata
+    spec.abs_path_ref = filename_ref
+    spec.calibration = calibrator.calibration_info
+
+
+def calibrate_file(dl, filename: str, calibrator, filename_ref: str) -> None:
+    dl.load_file(filename)
+    try:
+        apply_calibration(dl.spec_dict[filename], calibrator, filename_ref)
+        dl.save(filename)
+    finally:
+        if filename in dl.spec_dict:
+            dl.delete_file(filename)
+
+
+def save_spectrum(dl, filename: str, spec) -> list:
+    # DataLoader.saveで保存し，書き出したパスのリストを返す
+    # saveは出力のパスを返さないので，このファイルだけの一時フォルダに書かせてから元のフォルダに移す
+    directory = os.path.dirname(os.path.abspath(filename))
+    staging = tempfile.mkdtemp(prefix='.easycalibration_', dir=directory)
+    key = os.path.join(staging, os.path.basename(filename))
+    dl.spec_dict[key] = spec
+    try:
+        dl.save(key)
+        outputs = []
+        for name in sorted(os.listdir(staging)):
+            output = os.path.join(directory, name)
+            os.replace(os.path.join(staging, name), output)
+            outputs.append(output)
+        return outputs
+    finally:
+        if key in dl.spec_dict:
+            dl.delete_file(key)
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def calibrate_files(dl, filenames, calibrator, filename_ref: str):
+    # 1ファイルずつ読み込み→適用→保存→破棄するので，メモリ使用量はファイル数に依存しない
+    for filename in filenames:
+        try:
+            calibrate_file(dl, filename, calibrator, filename_ref)
+        except Exception as e:
+            yield filename, e
+        else:
+            yield filename, None
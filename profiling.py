@@ -0,0 +1,112 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupProfiler:
+    # --profile-startupで起動時のimportと初期化にかかった時間を表示する
+    def __init__(self):
+        self.enabled = False
+        self.t0 = time.perf_counter()
+        self.records = []
+
+    @contextmanager
+    def section(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((name, t - self.t0, time.perf_counter() - t))
+
+    def mark(self, name: str) -> None:
+        self.records.append((name, time.perf_counter() - self.t0, 0.0))
+
+    def report(self, file=None) -> None:
+        if not self.enabled:
+            return
+        file = file or sys.stderr
+        print(f'{"":40s} {"start [ms]":>12s} {"took [ms]":>12s}', file=file)
+        for name, start, elapsed in self.records:
+            print(f'{name:40s} {start * 1000:12.1f} {elapsed * 1000:12.1f}', file=file)
+
+
+profiler = StartupProfiler()
+
+
+class Tracer:
+    # --traceで主な処理の時間と件数を記録する．Chromeのトレース形式で保存し，chrome://tracingやPerfettoで見られる
+    def __init__(self):
+        self.enabled = False
+        self.t0 = time.perf_counter()
+        self.events = []
+        self.stats = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **args):
+        if not self.enabled:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, t, time.perf_counter() - t, args)
+
+    def add_span(self, name: str, start: float, elapsed: float, args: dict = None) -> None:
+        event = dict(name=name, ph='X', ts=(start - self.t0) * 1e6, dur=elapsed * 1e6, pid=os.getpid(),
+                     tid=threading.get_ident(), args=args or {})
+        with self.lock:
+            self.events.append(event)
+            n, total, longest = self.stats.get(name, (0, 0.0, 0.0))
+            self.stats[name] = (n + 1, total + elapsed, max(longest, elapsed))
+
+    def wrap(self, name: str, func):
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def iterate(self, name: str, iterable):
+        # 各要素を受け取るまでの待ち時間をnameとして記録する(読み込みながら処理するループ用)
+        iterator = iter(iterable)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, value=1) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.events.append(dict(name=name, ph='C', ts=(time.perf_counter() - self.t0) * 1e6, pid=os.getpid(),
+                                    tid=threading.get_ident(), args={name: self.counters[name]}))
+
+    def summary(self) -> str:
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: -item[1][1])
+            counters = dict(self.counters)
+        lines = [f'{name}: {n} x, total {total * 1000:.0f} ms, max {longest * 1000:.0f} ms'
+                 for name, (n, total, longest) in stats]
+        lines += [f'{name}: {value}' for name, value in counters.items()]
+        return '\n'.join(lines)
+
+    def save(self, filename: str) -> None:
+        with self.lock:
+            data = dict(traceEvents=list(self.events), displayTimeUnit='ms',
+                        summary={name: dict(count=n, total_ms=total * 1000, max_ms=longest * 1000)
+                                 for name, (n, total, longest) in self.stats.items()},
+                        counters=dict(self.counters))
+        with open(filename, 'w') as f:
+            json.dump(data, f)
+
+
+tracer = Tracer()
@@ -0,0 +1,519 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import hmac
+import hashlib
+import argparse
+import ipaddress
+import threading
+import collections
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# 1台のPCでキャリブレーションを引き受けるHTTPのサービス
+# 各装置のGUIは--serviceでここにジョブを送り，重い処理を測定用のPCで行わないようにする
+# ジョブはキューに入れてワーカーのスレッドで順に処理する．キューが一杯のときは503を返す
+# フィッティングした結果はメモリに置いておき(ディスクのModelStoreにも保存)，同じ条件の次の要求ではすぐに返す
+# 認証は--tokenの共有の文字列だけなので，既定ではloopbackでのみ待ち受ける．loopback以外では--tokenを必須にする
+# 読み書きするファイルは--rootのフォルダの中のものに限る
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_BODY = 64 * 1024 ** 2
+MAX_FINISHED_JOBS = 1000
+
+
+class QueueFull(Exception):
+    pass
+
+
+class ServiceError(Exception):
+    pass
+
+
+class RequestTooLarge(ServiceError):
+    pass
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WarmStore:
+    # ModelStoreの前に置くメモリ上のLRU
+    def __init__(self, store, max_models: int = 32):
+        self.store = store
+        self.max_models = max_models
+        self.models = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                self.hits += 1
+                return self.models[key]
+        model = self.store.get(key) if self.store is not None else None
+        with self.lock:
+            self.misses += 1
+            if model is not None:
+                self._keep(key, model)
+        return model
+
+    def put(self, key: str, model) -> None:
+        with self.lock:
+            self._keep(key, model)
+        if self.store is not None:
+            self.store.put(key, model)
+
+    def _keep(self, key: str, model) -> None:
+        self.models[key] = model
+        self.models.move_to_end(key)
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+
+
+class Spectrum:
+    # クライアントから受け取った参照スペクトル
+    def __init__(self, xdata, ydata):
+        import numpy as np
+        self.xdata = np.asarray(xdata, dtype=float)
+        self.ydata = np.asarray(ydata, dtype=float)
+
+
+class ServiceJob:
+    def __init__(self, kind: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel = threading.Event()
+
+    def to_dict(self) -> dict:
+        return dict(id=self.id, kind=self.kind, status=self.status, result=self.result, error=self.error,
+                    submitted=self.submitted, started=self.started, finished=self.finished)
+
+
+class CalibrationService:
+    def __init__(self, jobs: int = 2, queue_size: int = 16, workers: int = None, store=None, max_models: int = 32,
+                 database: str = None, roots: list = None):
+        from calibrator import Calibrator
+        from database import ReferenceDatabase, DEFAULT_DATABASE
+
+        self.Calibrator = Calibrator
+        self.reference_db = ReferenceDatabase(database or DEFAULT_DATABASE)
+        self.reference_db.import_builtin(Calibrator(measurement='Raman', material='sulfur', dimension=1).database)
+        self.models = WarmStore(store, max_models=max_models)
+        self.workers = workers
+        self.roots = [os.path.realpath(root) for root in (roots or [os.getcwd()])]
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = {}
+        self.finished = collections.deque()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(jobs)]
+        for thread in self.threads:
+            thread.start()
+
+    def new_calibrator(self, measurement: str, material: str, dimension: int):
+        calibrator = self.Calibrator(measurement=measurement, material=material, dimension=dimension)
+        self.reference_db.install(calibrator)
+        calibrator.set_measurement(measurement)
+        calibrator.set_material(material)
+        return calibrator
+
+    def check_path(self, path) -> str:
+        # シンボリックリンクや..を解決したうえで，--rootのどれかの中にあるか調べる
+        if not isinstance(path, str) or path == '':
+            raise ServiceError(f'Invalid path: {path!r}')
+        real = os.path.realpath(path)
+        for root in self.roots:
+            if os.path.commonpath([root, real]) == root:
+                return path
+        raise ServiceError(f'{path} is outside the served folders.')
+
+    def check_params(self, kind: str, params: dict) -> None:
+        if kind == 'calibrate' and 'xdata' not in params:
+            self.check_path(params.get('filename_ref'))
+        if kind == 'apply':
+            files = params.get('files')
+            if not isinstance(files, list):
+                raise ServiceError('"files" must be a list.')
+            for filename in files:
+                self.check_path(filename)
+            if params.get('output') is not None:
+                self.check_path(params['output'])
+
+    def submit(self, kind: str, params: dict) -> ServiceJob:
+        if kind not in ('calibrate', 'apply'):
+            raise ServiceError(f'Unknown job kind: {kind}')
+        self.check_params(kind, params)
+        job = ServiceJob(kind, params)
+        with self.lock:
+            self.jobs[job.id] = job
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                del self.jobs[job.id]
+            raise QueueFull(f'{self.queue.maxsize} jobs are already waiting.')
+        return job
+
+    def job(self, job_id: str) -> ServiceJob:
+        with self.lock:
+            if job_id not in self.jobs:
+                raise KeyError(job_id)
+            return self.jobs[job_id]
+
+    def cancel(self, job_id: str) -> ServiceJob:
+        job = self.job(job_id)
+        job.cancel.set()
+        return job
+
+    def status(self) -> dict:
+        with self.lock:
+            running = self.running
+        return dict(queued=self.queue.qsize(), queue_size=self.queue.maxsize, running=running,
+                    jobs=len(self.threads), models=len(self.models.models), model_hits=self.models.hits,
+                    model_misses=self.models.misses)
+
+    def work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if job.cancel.is_set():
+                self._finish(job, 'cancelled')
+                continue
+            job.status = 'running'
+            job.started = time.time()
+            with self.lock:
+                self.running += 1
+            try:
+                if job.kind == 'calibrate':
+                    job.result = self.run_calibrate(job.params)
+                else:
+                    job.result = self.run_apply(job, job.params)
+                self._finish(job, 'cancelled' if job.cancel.is_set() else 'done')
+            except Exception as e:
+                job.error = f'{type(e).__name__}: {e}'
+                self._finish(job, 'failed')
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+    def _finish(self, job: ServiceJob, status: str) -> None:
+        job.status = status
+        job.finished = time.time()
+        with self.lock:
+            # 終わったジョブは結果を取りに来るまで残し，古いものから消す
+            self.finished.append(job.id)
+            while len(self.finished) > MAX_FINISHED_JOBS:
+                self.jobs.pop(self.finished.popleft(), None)
+
+    def run_calibrate(self, params: dict) -> dict:
+        from pipeline import calibrate_reference_cached
+
+        measurement, material = params['measurement'], params['material']
+        dimension, function = int(params['dimension']), params['function']
+        filename_ref = params['filename_ref']
+        ref_hash = None
+        if 'xdata' in params:
+            # 参照ファイルがサービス側から見えない場合は，スペクトルそのものを受け取る
+            spec_ref = Spectrum(params['xdata'], params['ydata'])
+            ref_hash = hashlib.sha256(spec_ref.xdata.tobytes() + spec_ref.ydata.tobytes()).hexdigest()
+        else:
+            from dataloader import DataLoader
+            dl = DataLoader()
+            dl.load_file(filename_ref)
+            spec_ref = dl.spec_dict[filename_ref]
+        calibrator = self.new_calibrator(measurement, material, dimension)
+        ok, model, cached = calibrate_reference_cached(
+            self.models, calibrator, spec_ref, filename_ref, measurement, material, dimension, function,
+            [tuple(r) for r in params['ranges']], x_true=params.get('x_true'), center=params.get('center'),
+            engine=params.get('engine', 'calibrator'), robust=params.get('robust', 'huber'), ref_hash=ref_hash)
+        if not ok:
+            raise ServiceError('Calibration failed.')
+        key = self.put_model(model)
+        return dict(key=key, cached=cached, model=model.to_dict(), rms_residual=model.rms_residual())
+
+    def put_model(self, model) -> str:
+        # 内容から決まるキーで置いておき，applyで使う
+        key = hashlib.sha256(json.dumps(model.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+        if self.models.get(key) is None:
+            self.models.put(key, model)
+        return key
+
+    def get_model(self, key: str):
+        model = self.models.get(key)
+        if model is None:
+            raise KeyError(key)
+        return model
+
+    def run_apply(self, job: ServiceJob, params: dict) -> dict:
+        # ファイルはサービス側から同じパスで見える必要がある(共有フォルダなど)
+        from export import open_writer, metadata
+        from parallel import calibrate_files, iter_load
+        from pipeline import apply_calibration
+
+        model = self.get_model(params['key'])
+        calibrator = self.new_calibrator(model.measurement, model.material, model.dimension)
+        model.restore(calibrator)
+        filenames = list(params['files'])
+        fmt = params.get('format', 'txt')
+        saved, failed = [], []
+        if fmt == 'txt':
+            for filename, error in calibrate_files(filenames, calibrator, model.filename_ref, workers=self.workers):
+                if error is None:
+                    saved.append(filename)
+                else:
+                    failed.append([filename, str(error)])
+                if job.cancel.is_set():
+                    break
+            return dict(saved=saved, failed=failed)
+        with open_writer(fmt, params.get('output')) as writer:
+            for filename, spec, error in iter_load(filenames, workers=self.workers):
+                if error is not None:
+                    raise ServiceError(f'{filename}: {error}')
+                if job.cancel.is_set():
+                    raise ServiceError('Cancelled.')
+                apply_calibration(spec, calibrator, model.filename_ref)
+                writer.add(filename, spec.xdata, spec.ydata, metadata(spec))
+                saved.append(filename)
+        return dict(saved=saved, failed=failed, output=params.get('output'))
+
+    def shutdown(self) -> None:
+        for _ in self.threads:
+            self.queue.put(None)
+        self.reference_db.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    # GET /status, POST /jobs, GET|DELETE /jobs/<id>, POST /models, GET /models/<key>
+    service = None
+    token = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def reply(self, code: int, obj: dict, headers: dict = None) -> None:
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self) -> dict:
+        n = int(self.headers.get('Content-Length') or 0)
+        if n < 0 or n > MAX_BODY:
+            # 本文を読まずに返すので，残りが次の要求として読まれないよう接続を閉じる
+            self.close_connection = True
+            raise RequestTooLarge('The request is too large.')
+        obj = json.loads(self.rfile.read(n) or b'{}')
+        if not isinstance(obj, dict):
+            raise ServiceError('The request must be a JSON object.')
+        return obj
+
+    def handle_request(self, method: str) -> None:
+        # 比べるのにかかる時間からトークンを推測されないようにする
+        if self.token is not None and not hmac.compare_digest(self.headers.get('X-Token', '').encode(),
+                                                              self.token.encode()):
+            self.reply(403, dict(error='Invalid token.'))
+            return
+        parts = [p for p in self.path.split('?')[0].split('/') if p]
+        try:
+            if method == 'GET' and parts == ['status']:
+                self.reply(200, self.service.status())
+            elif method == 'POST' and parts == ['jobs']:
+                params = self.read_json()
+                job = self.service.submit(params.pop('kind', None), params)
+                self.reply(202, job.to_dict())
+            elif method == 'GET' and len(parts) == 2 and parts[0] == 'jobs':
+                self.reply(200, self.service.job(parts[1]).to_dict())
+            elif method == 'DELETE' and len(parts) == 2 and parts[0] == 'jobs':
+                self.reply(200, self.service.cancel(parts[1]).to_dict())
+            elif method == 'POST' and parts == ['models']:
+                from model import CalibrationModel
+                params = self.read_json()
+                if 'model' not in params:
+                    raise ServiceError('"model" is required.')
+                model = CalibrationModel.from_dict(params['model'])
+                self.reply(200, dict(key=self.service.put_model(model)))
+            elif method == 'GET' and len(parts) == 2 and parts[0] == 'models':
+                self.reply(200, dict(key=parts[1], model=self.service.get_model(parts[1]).to_dict()))
+            else:
+                self.reply(404, dict(error=f'Not found: {method} {self.path}'))
+        except QueueFull as e:
+            self.reply(503, dict(error=str(e)), headers={'Retry-After': '1'})
+        except RequestTooLarge as e:
+            self.reply(413, dict(error=str(e)), headers={'Connection': 'close'})
+        except KeyError as e:
+            self.reply(404, dict(error=f'Not found: {e.args[0] if e.args else e}'))
+        except (ServiceError, ValueError, TypeError) as e:
+            self.reply(400, dict(error=str(e)))
+
+    def do_GET(self) -> None:
+        self.handle_request('GET')
+
+    def do_POST(self) -> None:
+        self.handle_request('POST')
+
+    def do_DELETE(self) -> None:
+        self.handle_request('DELETE')
+
+
+def make_server(service: CalibrationService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                token: str = None) -> ThreadingHTTPServer:
+    # port=0なら空いているポートを使う(server.server_address[1])
+    handler = type('BoundHandler', (Handler,), dict(service=service, token=token))
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class ServiceClient:
+    # GUIやスクリプトからサービスを使う．標準ライブラリのurllibだけで通信する
+    def __init__(self, url: str, token: str = None, timeout: float = 30):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, obj: dict = None) -> dict:
+        data = json.dumps(obj).encode('utf-8') if obj is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method)
+        request.add_header('Content-Type', 'application/json')
+        if self.token is not None:
+            request.add_header('X-Token', self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            if e.code == 503:
+                raise QueueFull(message)
+            raise ServiceError(f'{e.code}: {message}')
+        except urllib.error.URLError as e:
+            raise ServiceError(f'Could not connect to {self.url}: {e.reason}')
+
+    def status(self) -> dict:
+        return self.request('GET', '/status')
+
+    def submit(self, kind: str, **params) -> str:
+        return self.request('POST', '/jobs', dict(kind=kind, **params))['id']
+
+    def job(self, job_id: str) -> dict:
+        return self.request('GET', f'/jobs/{job_id}')
+
+    def cancel(self, job_id: str) -> dict:
+        return self.request('DELETE', f'/jobs/{job_id}')
+
+    def wait(self, job_id: str, interval: float = 0.2, timeout: float = None, check=None) -> dict:
+        # 終わるまで待って結果を返す．checkは待っている間に呼ぶ関数(GUIのジョブの中断など)
+        # すぐ終わるジョブ(メモリにある結果など)を待たせないように，問い合わせの間隔は短いところから伸ばす
+        start = time.time()
+        delay = 0.01
+        while True:
+            job = self.job(job_id)
+            if job['status'] == 'done':
+                return job['result']
+            if job['status'] in ('failed', 'cancelled'):
+                raise ServiceError(job['error'] or f'The job was {job["status"]}.')
+            if timeout is not None and time.time() - start > timeout:
+                raise ServiceError('Timed out.')
+            if check is not None:
+                try:
+                    check()
+                except BaseException:
+                    self.cancel(job_id)
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, interval)
+
+    def put_model(self, model) -> str:
+        return self.request('POST', '/models', dict(model=model.to_dict()))['key']
+
+    def get_model(self, key: str):
+        from model import CalibrationModel
+        return CalibrationModel.from_dict(self.request('GET', f'/models/{key}')['model'])
+
+    def calibrate(self, spec_ref, filename_ref: str, measurement: str, material: str, dimension: int, function: str,
+                  ranges: list, x_true: list = None, center: float = None, engine: str = 'calibrator',
+                  robust: str = 'huber', check=None):
+        # 参照スペクトルを送ってフィッティングさせる．(model, cached)を返す
+        import numpy as np
+        job_id = self.submit('calibrate', filename_ref=filename_ref, measurement=measurement, material=material,
+                             dimension=int(dimension), function=function, ranges=[list(map(float, r)) for r in ranges],
+                             x_true=None if x_true is None else [float(x) for x in x_true], center=center,
+                             engine=engine, robust=robust, xdata=np.asarray(spec_ref.xdata, dtype=float).tolist(),
+                             ydata=np.asarray(spec_ref.ydata, dtype=float).tolist())
+        result = self.wait(job_id, check=check)
+        from model import CalibrationModel
+        return CalibrationModel.from_dict(result['model']), result['cached']
+
+    def apply(self, model, filenames: list, fmt: str = 'txt', output: str = None, check=None) -> dict:
+        key = self.put_model(model)
+        job_id = self.submit('apply', key=key, files=list(filenames), format=fmt, output=output)
+        return self.wait(job_id, check=check)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help='address to listen on (default: loopback only; other addresses require --token)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on')
+    parser.add_argument('--jobs', type=int, default=2, help='number of jobs run at the same time')
+    parser.add_argument('--queue-size', type=int, default=16, help='jobs waiting beyond this are refused with 503')
+    parser.add_argument('--max-models', type=int, default=32, help='fitted calibrations kept in memory')
+    parser.add_argument('--token', default=None, help='shared secret clients send in the X-Token header')
+    parser.add_argument('--root', nargs='+', default=None,
+                        help='folders whose files clients may read and write (default: the current folder)')
+
+
+def run(args: argparse.Namespace) -> int:
+    if not is_loopback(args.host) and not args.token:
+        print(f'Refusing to serve on {args.host} without --token.', file=sys.stderr)
+        return 1
+    for root in args.root or []:
+        if not os.path.isdir(root):
+            print(f'{root} is not a folder.', file=sys.stderr)
+            return 1
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from model import ModelStore
+
+    service = CalibrationService(jobs=args.jobs, queue_size=args.queue_size, workers=args.workers,
+                                 store=ModelStore(), max_models=args.max_models, database=args.database,
+                                 roots=args.root)
+    server = make_server(service, args.host, args.port, token=args.token)
+    host, port = server.server_address[:2]
+    print(f'Serving on http://{host}:{port} ({args.jobs} jobs, queue {args.queue_size}) '
+          f'for files in {", ".join(service.roots)}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
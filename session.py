@@ -0,0 +1,62 @@
+import os
+import json
+
+# 作業状態(参照，範囲，割り当て，条件，データのファイル名，キャリブレーション結果)を保存して復元する
+# スペクトルそのものは保存せず，復元時にキャッシュ(cache.py)から読み込むので小さく，速い
+
+SESSION_VERSION = 1
+DEFAULT_SESSION_DIR = os.path.join(os.path.expanduser('~'), '.easycalibration', 'sessions')
+LAST_SESSION = os.path.join(DEFAULT_SESSION_DIR, 'last.json')
+
+
+class Session:
+    def __init__(self, measurement: str, material: str, dimension: str, function: str, center: float,
+                 filename_ref: str, ranges: list, x_true: list, filenames: list, calibration: str = None):
+        self.measurement = measurement
+        self.material = material
+        self.dimension = dimension
+        self.function = function
+        self.center = center
+        self.filename_ref = filename_ref
+        self.ranges = [tuple(map(float, r)) for r in ranges]
+        # ASSIGNで手動で割り当てた真値．自動の場合はNone
+        self.x_true = None if x_true is None else [float(x) for x in x_true]
+        self.filenames = list(filenames)
+        # キャリブレーション結果(.npz)のパス
+        self.calibration = calibration
+
+    @staticmethod
+    def calibration_path(filename: str) -> str:
+        return os.path.splitext(filename)[0] + '.calib.npz'
+
+    def to_dict(self) -> dict:
+        return dict(version=SESSION_VERSION, measurement=self.measurement, material=self.material,
+                    dimension=self.dimension, function=self.function, center=self.center,
+                    filename_ref=self.filename_ref, ranges=self.ranges, x_true=self.x_true,
+                    filenames=self.filenames, calibration=self.calibration)
+
+    def save(self, filename: str, model=None) -> None:
+        # modelはCalibrationModelまたはCalibrationTable．セッションと同じ場所に保存する
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        self.calibration = None
+        if model is not None:
+            path = self.calibration_path(filename)
+            model.save(path)
+            self.calibration = os.path.basename(path)
+        tmp = filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(',', ':'))
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename: str):
+        with open(filename, 'r', encoding='utf-8') as f:
+            d = json.load(f)
+        if d.get('version') != SESSION_VERSION:
+            raise ValueError(f'Unsupported session version: {d.get("version")}')
+        calibration = d['calibration']
+        if calibration is not None:
+            calibration = os.path.join(os.path.dirname(os.path.abspath(filename)), calibration)
+        return cls(d['measurement'], d['material'], d['dimension'], d['function'], d['center'], d['filename_ref'],
+                   d['ranges'], d['x_true'], d['filenames'], calibration)
@@ -0,0 +1,146 @@
+import hashlib
+import numpy as np
+
+from dataloader import DataLoader
+
+
+def _axis_key(xdata) -> tuple:
+    xdata = np.ascontiguousarray(xdata)
+    return xdata.shape[0], hashlib.sha1(xdata.tobytes()).hexdigest()
+
+
+class SpectrumArray:
+    # 同じ軸を持つ複数のスペクトルを，1本の軸と(スペクトル数, チャンネル数)の2次元配列で保持する
+    # マッピングデータのように軸が共通のものはファイルごとのオブジェクトを持つより省メモリで，
+    # キャリブレーションや補間もまとめて行える
+    def __init__(self, filenames: list, xdata, ydata):
+        self.filenames = list(filenames)
+        self.xdata = np.asarray(xdata)
+        self.ydata = np.asarray(ydata)
+        if self.ydata.ndim != 2 or self.ydata.shape != (len(self.filenames), self.xdata.shape[0]):
+            raise ValueError('ydata must have the shape (number of files, number of channels).')
+        self.abs_path_ref = None
+        self.calibration = None
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    @property
+    def nbytes(self) -> int:
+        return self.xdata.nbytes + self.ydata.nbytes
+
+    def calibrate(self, calibrator, filename_ref: str) -> None:
+        # pipeline.apply_calibrationと同じ内容を全スペクトルに一度に適用する
+        if calibrator.xdata.shape != self.xdata.shape:
+            raise ValueError('The number of channels differs from the reference.')
+        self.xdata = calibrator.xdata
+        self.abs_path_ref = filename_ref
+        self.calibration = calibrator.calibration_info
+
+    def resample(self, grid):
+        # 共通の軸grid上に全スペクトルを線形補間する．範囲外はnan
+        grid = np.asarray(grid, dtype=float)
+        x = np.asarray(self.xdata, dtype=float)
+        y = self.ydata
+        if x[0] > x[-1]:
+            x = x[::-1]
+            y = y[:, ::-1]
+        i = np.clip(np.searchsorted(x, grid) - 1, 0, x.shape[0] - 2)
+        w = (grid - x[i]) / (x[i + 1] - x[i])
+        resampled = y[:, i] * (1 - w) + y[:, i + 1] * w
+        resampled[:, (grid < x[0]) | (grid > x[-1])] = np.nan
+        return resampled
+
+    def spectra(self):
+        for filename, ydata in zip(self.filenames, self.ydata):
+            yield filename, self.xdata, ydata
+
+
+def group_spec_dict(spec_dict) -> list:
+    # 軸が同じスペクトルごとにSpectrumArrayにまとめる
+    groups = {}
+    for filename, spec in spec_dict.items():
+        groups.setdefault(_axis_key(spec.xdata), []).append((filename, spec))
+    arrays = []
+    for items in groups.values():
+        xdata = items[0][1].xdata
+        ydata = np.vstack([spec.ydata for _, spec in items])
+        arrays.append(SpectrumArray([f for f, _ in items], xdata, ydata))
+    return arrays
+
+
+def pack_spec_dict(spec_dict) -> list:
+    # 各スペクトルのxdataを共有し，ydataを2次元配列の行(view)に置き換える
+    # キャッシュからmmapしたものはメモリに読み込まないようにそのままにする
+    spec_dict = {k: spec for k, spec in spec_dict.items() if not isinstance(spec.ydata, np.memmap)}
+    arrays = group_spec_dict(spec_dict)
+    for array in arrays:
+        for i, filename in enumerate(array.filenames):
+            spec = spec_dict[filename]
+            spec.xdata = array.xdata
+            spec.ydata = array.ydata[i]
+    return arrays
+
+
+class _Rows:
+    # 行を追加していく2次元配列．容量が足りなくなったら倍にする
+    def __init__(self, n_channels: int, dtype):
+        self.data = np.empty((16, n_channels), dtype=dtype)
+        self.n = 0
+
+    def append(self, row) -> None:
+        if self.n == self.data.shape[0]:
+            data = np.empty((self.n * 2, self.data.shape[1]), dtype=self.data.dtype)
+            data[:self.n] = self.data
+            self.data = data
+        self.data[self.n] = row
+        self.n += 1
+
+    def array(self):
+        return self.data[:self.n].copy()
+
+
+def load_arrays(filenames, cache=None, progress=None):
+    # ファイルごとのオブジェクトを残さずに読み込んでSpectrumArrayにまとめる
+    # (SpectrumArrayのリスト, 読み込めなかった(ファイル名, 例外)のリスト)を返す
+    filenames = list(filenames)
+    n = len(filenames)
+    dl = DataLoader()
+    groups = {}
+    failed = []
+    for i, filename in enumerate(filenames):
+        spec = cache.get(filename) if cache is not None else None
+        if spec is None:
+            try:
+                dl.load_file(filename)
+                spec = dl.spec_dict.get(filename)
+                if spec is None:
+                    raise ValueError('The file could not be read.')
+            except Exception as e:
+                failed.append((filename, e))
+                spec = None
+            finally:
+                if filename in dl.spec_dict:
+                    dl.delete_file(filename)
+            if spec is not None and cache is not None:
+                cache.put(filename, spec)
+        if spec is not None:
+            key = _axis_key(spec.xdata)
+            if key not in groups:
+                ydata = np.asarray(spec.ydata)
+                groups[key] = (np.array(spec.xdata), [], _Rows(ydata.shape[0], ydata.dtype))
+            groups[key][1].append(filename)
+            groups[key][2].append(spec.ydata)
+        if progress is not None:
+            progress(i + 1, n)
+    return [SpectrumArray(names, xdata, rows.array()) for xdata, names, rows in groups.values()], failed
+
+
+def save_arrays_npz(filename: str, arrays: list) -> None:
+    # 軸ごとのグループをまとめて1つの.npzに保存する
+    data = {}
+    for i, array in enumerate(arrays):
+        data[f'filenames_{i}'] = np.array(array.filenames)
+        data[f'xdata_{i}'] = array.xdata
+        data[f'ydata_{i}'] = array.ydata
+    np.savez(filename, **data)
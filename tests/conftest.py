@@ -0,0 +1,25 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# CalibratorとDataLoaderはGitHubから入れるパッケージなので，テストではtests/standinsの簡単な代わりを使う
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standins'))
+sys.path.insert(1, ROOT)
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+def lorentzian(x, centers, width: float = 3.0, height: float = 1000.0, baseline: float = 100.0):
+    x = np.asarray(x, dtype=float)
+    return baseline + sum(height / (1 + ((x - c) / width) ** 2) for c in centers)
+
+
+@pytest.fixture
+def write_spectrum(tmp_path):
+    # tmp_pathに2列のテキストを書いてパスを返す
+    def write(name: str, x, y) -> str:
+        path = str(tmp_path / name)
+        np.savetxt(path, np.column_stack([x, y]), delimiter='\t')
+        return path
+    return write
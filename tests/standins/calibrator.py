@@ -0,0 +1,75 @@
+import numpy as np
+
+# テスト用のCalibrator．範囲内の最大値の位置をピークとし，真値に多項式を合わせる
+
+
+class Calibrator:
+    database = {
+        'Raman': {'unit': 'cm-1',
+                  'sulfur': np.array([153.8, 219.1, 473.2]),
+                  'naphthalene': np.array([513.8, 763.8, 1021.6, 1147.2, 1382.2, 1464.5, 1576.6])},
+        'Rayleigh': {'unit': 'nm',
+                     'neon': np.array([585.2, 588.2, 603.0, 607.4, 609.6, 614.3, 616.4, 621.7, 626.6, 630.5, 633.4,
+                                       638.3, 640.2, 650.6, 653.3, 659.9, 667.8, 671.7, 692.9])},
+    }
+
+    def __init__(self, measurement: str = 'Raman', material: str = 'sulfur', dimension: int = 1):
+        self.measurement = measurement
+        self.material = material
+        self.dimension = dimension
+        self.function = 'Lorentzian'
+        self.xdata = None
+        self.ydata = None
+        self.xdata_before = None
+        self.fitted_x = []
+        self.found_x_true = []
+        self.calibration_info = None
+
+    def get_measurement_list(self) -> list:
+        return list(self.database)
+
+    def get_material_list(self) -> list:
+        return [k for k in self.database[self.measurement] if k != 'unit']
+
+    def get_dimension_list(self) -> list:
+        return ['1 (Linear)', '2 (Quadratic)', '3 (Cubic)']
+
+    def get_function_list(self) -> list:
+        return ['Lorentzian', 'Gaussian', 'Voigt']
+
+    def set_measurement(self, measurement: str) -> None:
+        self.measurement = measurement
+
+    def set_material(self, material: str) -> None:
+        self.material = material
+
+    def set_dimension(self, dimension: int) -> None:
+        self.dimension = int(dimension)
+
+    def set_function(self, function: str) -> None:
+        self.function = function
+
+    def set_data(self, xdata, ydata) -> None:
+        self.xdata = np.array(xdata, dtype=float)
+        self.ydata = np.array(ydata, dtype=float)
+
+    def get_true_x(self):
+        return self.database[self.measurement][self.material]
+
+    def calibrate(self, mode: str, ranges: list, x_true: list) -> bool:
+        fitted = []
+        for x0, _, x1, _ in ranges:
+            mask = (self.xdata >= min(x0, x1)) & (self.xdata <= max(x0, x1))
+            if not mask.any():
+                return False
+            fitted.append(self.xdata[mask][np.argmax(self.ydata[mask])])
+        if len(fitted) <= self.dimension:
+            return False
+        coefficients = np.polyfit(fitted, x_true, self.dimension)
+        self.xdata_before = self.xdata
+        self.xdata = np.polyval(coefficients, self.xdata)
+        self.fitted_x = fitted
+        self.found_x_true = list(x_true)
+        self.calibration_info = [self.measurement, self.material, self.dimension, self.function,
+                                 coefficients.tolist()]
+        return True
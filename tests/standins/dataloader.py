@@ -0,0 +1,44 @@
+import os
+import datetime
+import numpy as np
+
+# テスト用のDataLoader．2列のテキスト(タブ・カンマ・空白区切り，#はコメント)を読む
+
+
+class Spectrum:
+    def __init__(self, xdata, ydata, device: str = 'Test'):
+        self.xdata = xdata
+        self.ydata = ydata
+        self.device = device
+        self.abs_path_ref = None
+        self.calibration = None
+
+
+class DataLoader:
+    def __init__(self):
+        self.spec_dict = {}
+
+    def load_file(self, filename: str) -> bool:
+        with open(filename, 'r') as f:
+            text = f.read()
+        rows = [line.replace(',', ' ').split() for line in text.splitlines()
+                if line.strip() and not line.startswith('#')]
+        data = np.array(rows, dtype=float)
+        if data.ndim != 2 or data.shape[1] < 2:
+            raise ValueError(f'{filename} is not a two-column spectrum.')
+        self.spec_dict[filename] = Spectrum(data[:, 0], data[:, 1])
+        return True
+
+    def load_files(self, filenames) -> None:
+        for filename in filenames:
+            self.load_file(filename)
+
+    def delete_file(self, filename: str) -> None:
+        del self.spec_dict[filename]
+
+    def save(self, filename: str) -> None:
+        spec = self.spec_dict[filename]
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+        output = f'{os.path.splitext(filename)[0]}_{stamp}.txt'
+        header = f'abs_path_ref: {spec.abs_path_ref}\ncalibration: {spec.calibration}'
+        np.savetxt(output, np.column_stack([spec.xdata, spec.ydata]), delimiter='\t', header=header)
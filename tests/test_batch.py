@@ -0,0 +1,101 @@
+import json
+import os
+import numpy as np
+import pytest
+
+from conftest import lorentzian
+from main import main
+from model import CalibrationModel
+
+TRUE = [153.8, 219.1, 473.2]
+MEASURED = [(c - 2.0) / 1.002 for c in TRUE]
+X = np.linspace(100, 600, 2001)
+
+
+@pytest.fixture
+def model_store(tmp_path, monkeypatch):
+    # ~/.easycalibration/modelsに書かないようにする
+    import model
+    store = model.ModelStore
+    monkeypatch.setattr(model, 'ModelStore', lambda: store(str(tmp_path / 'models')))
+    return tmp_path / 'models'
+
+
+def save_shift_model(path: str, x, shift: float = 1.0) -> str:
+    CalibrationModel('Raman', 'sulfur', 1, 'Lorentzian', None, [], [], [], x, x + shift,
+                     ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, shift]], 'ref.txt', 'hash').save(path)
+    return path
+
+
+def outputs(directory, inputs) -> list:
+    names = {os.path.basename(f) for f in inputs}
+    return sorted(str(p) for p in directory.iterdir() if p.suffix == '.txt' and p.name not in names)
+
+
+def test_apply_a_saved_model_to_each_file(tmp_path, write_spectrum, capsys):
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i}.txt', x, lorentzian(x, [300])) for i in range(3)]
+    model = save_shift_model(str(tmp_path / 'calib.npz'), x)
+    assert main(['--workers', '1', 'batch', *filenames, '--model', model]) == 0
+    assert capsys.readouterr().out.split() == filenames
+    written = outputs(tmp_path, filenames)
+    assert len(written) == 3
+    for output in written:
+        np.testing.assert_allclose(np.loadtxt(output, delimiter='\t')[:, 0], x + 1)
+
+
+def test_glob_patterns_are_expanded(tmp_path, write_spectrum):
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i}.txt', x, lorentzian(x, [300])) for i in range(2)]
+    model = save_shift_model(str(tmp_path / 'calib.npz'), x)
+    assert main(['--workers', '1', 'batch', str(tmp_path / '*.txt'), '--model', model]) == 0
+    assert len(outputs(tmp_path, filenames)) == 2
+
+
+def test_missing_model(tmp_path, write_spectrum, capsys):
+    filename = write_spectrum('a.txt', X, lorentzian(X, [300]))
+    assert main(['batch', filename, '--model', str(tmp_path / 'missing.npz')]) == 1
+    assert 'was not found' in capsys.readouterr().err
+
+
+def test_fit_the_reference_and_reuse_the_result(tmp_path, write_spectrum, model_store, capsys):
+    ref = write_spectrum('ref.txt', X, lorentzian(X, MEASURED))
+    data = write_spectrum('data.txt', X, lorentzian(X, [300]))
+    ranges = str(tmp_path / 'ranges.json')
+    with open(ranges, 'w') as f:
+        json.dump(dict(ranges=[[c - 12, 0, c + 12, 1] for c in MEASURED], x_true=TRUE), f)
+    args = ['--workers', '1', '--database', str(tmp_path / 'db.sqlite'), 'batch', data, '--ref', ref,
+            '--material', 'sulfur', '--ranges', ranges, '--save-model', str(tmp_path / 'calib.npz')]
+    assert main(args) == 0
+    model = CalibrationModel.load(str(tmp_path / 'calib.npz'))
+    np.testing.assert_allclose(np.polyval(model.calibration_info[4], MEASURED), TRUE, atol=1e-2)
+    assert 'Used the previous result' not in capsys.readouterr().err
+    # 同じ参照・範囲・条件ならフィッティングを省略する
+    assert main(args) == 0
+    assert 'Used the previous result' in capsys.readouterr().err
+
+
+def test_output_is_required_before_fitting(tmp_path, write_spectrum, capsys):
+    filename = write_spectrum('a.txt', X, lorentzian(X, [300]))
+    model = save_shift_model(str(tmp_path / 'calib.npz'), X)
+    assert main(['batch', filename, '--model', model, '--format', 'npz']) == 1
+    assert '--output is required' in capsys.readouterr().err
+
+
+def test_export_leaves_nothing_when_a_file_fails(tmp_path, write_spectrum, capsys):
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i}.txt', x, lorentzian(x, [300])) for i in range(2)]
+    broken = str(tmp_path / 'broken.txt')
+    with open(broken, 'w') as f:
+        f.write('not a spectrum\n')
+    model = save_shift_model(str(tmp_path / 'calib.npz'), x)
+    output = str(tmp_path / 'out.npz')
+    assert main(['--workers', '1', 'batch', *filenames, broken, '--model', model, '--format', 'npz',
+                 '--output', output]) == 2
+    assert 'Nothing was written.' in capsys.readouterr().err
+    assert not os.path.exists(output)
+    assert main(['--workers', '1', 'batch', *filenames, '--model', model, '--format', 'npz',
+                 '--output', output]) == 0
+    with np.load(output, allow_pickle=False) as f:
+        assert list(f['filenames']) == filenames
+        np.testing.assert_allclose(f['xdata_00001'], x + 1)
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+
+from cache import SpectrumCache
+from dataloader import Spectrum
+
+
+def test_put_and_get_with_mmap(tmp_path, write_spectrum):
+    cache = SpectrumCache(str(tmp_path / 'cache'))
+    filename = write_spectrum('a.txt', [1.0, 2.0, 3.0], [4.0, 5.0, 6.0])
+    assert cache.get(filename) is None
+    cache.put(filename, Spectrum(np.array([1.0, 2.0, 3.0]), np.array([4.0, 5.0, 6.0]), device='Renishaw'))
+    spec = cache.get(filename)
+    assert isinstance(spec.xdata, np.memmap) and isinstance(spec.ydata, np.memmap)
+    np.testing.assert_array_equal(spec.ydata, [4.0, 5.0, 6.0])
+    assert spec.device == 'Renishaw'
+
+
+def test_modified_file_is_not_read_from_the_cache(tmp_path, write_spectrum):
+    cache = SpectrumCache(str(tmp_path / 'cache'))
+    filename = write_spectrum('a.txt', [1.0, 2.0], [3.0, 4.0])
+    key = cache.key(filename)
+    cache.put(filename, Spectrum(np.array([1.0, 2.0]), np.array([3.0, 4.0])))
+    write_spectrum('a.txt', [1.0, 2.0, 3.0], [3.0, 4.0, 5.0])
+    os.utime(filename, ns=(1, 1))
+    assert cache.key(filename) != key
+    assert cache.get(filename) is None
+
+
+def test_evict_removes_the_least_recently_used(tmp_path, write_spectrum):
+    cache = SpectrumCache(str(tmp_path / 'cache'))
+    filenames = [write_spectrum(f'{i}.txt', [1.0], [float(i)]) for i in range(3)]
+    for i, filename in enumerate(filenames):
+        cache.put(filename, Spectrum(np.zeros(100), np.zeros(100)))
+        os.utime(os.path.join(cache.directory, cache.key(filename)), (i, i))
+    # 最も古いエントリを使ったので，次に古いものが消える
+    assert cache.get(filenames[0]) is not None
+    cache.max_bytes = cache.size() * 2 // 3 + 1
+    cache.evict()
+    assert cache.get(filenames[1]) is None
+    assert cache.get(filenames[0]) is not None and cache.get(filenames[2]) is not None
+
+
+def test_corrupt_entry_is_a_miss(tmp_path, write_spectrum):
+    cache = SpectrumCache(str(tmp_path / 'cache'))
+    filename = write_spectrum('a.txt', [1.0, 2.0], [3.0, 4.0])
+    cache.put(filename, Spectrum(np.array([1.0, 2.0]), np.array([3.0, 4.0])))
+    with open(os.path.join(cache.directory, cache.key(filename), 'ydata.npy'), 'wb') as f:
+        f.write(b'broken')
+    assert cache.get(filename) is None
+    cache.clear()
+    assert cache.entries() == []
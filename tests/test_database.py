@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from calibrator import Calibrator
+from database import ReferenceDatabase, InstalledDatabase
+
+
+@pytest.fixture
+def db():
+    db = ReferenceDatabase(':memory:')
+    db.import_builtin(Calibrator.database)
+    yield db
+    db.close()
+
+
+def test_import_builtin(db):
+    assert db.measurements() == ['Raman', 'Rayleigh']
+    assert db.unit('Rayleigh') == 'nm'
+    assert db.materials('Raman') == ['sulfur', 'naphthalene']
+    np.testing.assert_allclose(db.lines('Raman', 'sulfur'), [153.8, 219.1, 473.2])
+    assert db.is_builtin('Raman', 'sulfur')
+
+
+def test_add_and_remove_material(db):
+    db.add_material('Raman', 'mystd', [1001.4, 620.9], note='polystyrene')
+    assert db.materials('Raman')[-1] == 'mystd'
+    np.testing.assert_allclose(db.lines('Raman', 'mystd'), [620.9, 1001.4])
+    assert not db.is_builtin('Raman', 'mystd')
+    db.remove_material('Raman', 'mystd')
+    assert 'mystd' not in db.materials('Raman')
+    with pytest.raises(KeyError):
+        db.lines('Raman', 'mystd')
+
+
+def test_add_material_errors(db):
+    with pytest.raises(ValueError):
+        db.add_material('Raman', 'sulfur', [1.0])
+    with pytest.raises(ValueError):
+        db.add_material('Raman', 'empty', [])
+    with pytest.raises(ValueError):
+        db.add_material('IR', 'x', [1.0])
+    db.add_material('IR', 'x', [1.0], unit='cm-1')
+    assert db.unit('IR') == 'cm-1'
+
+
+def test_lines_between(db):
+    lines = db.lines_between('Raman', 500, 800)
+    assert lines == [(513.8, 'naphthalene'), (763.8, 'naphthalene')]
+    assert db.lines_between('Raman', 100, 500, materials=['sulfur']) == [
+        (153.8, 'sulfur'), (219.1, 'sulfur'), (473.2, 'sulfur')]
+
+
+def test_match_longest_name(db):
+    db.add_material('Raman', 'sulfur2', [100.0])
+    assert db.match('/data/sulfur2_001.txt') == ('Raman', 'sulfur2')
+    assert db.match('/data/neon_630.txt') == ('Rayleigh', 'neon')
+    assert db.match('/data/sample.txt') is None
+
+
+def test_install(db):
+    db.add_material('Raman', 'mystd', [620.9, 1001.4])
+    calibrator = Calibrator()
+    db.install(calibrator)
+    assert isinstance(calibrator.database, InstalledDatabase)
+    calibrator.set_material('mystd')
+    np.testing.assert_allclose(calibrator.get_true_x(), [620.9, 1001.4])
+    assert 'mystd' in calibrator.get_material_list()
+
+
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'references.sqlite')
+    db = ReferenceDatabase(path)
+    db.import_builtin(Calibrator.database)
+    db.add_material('Raman', 'mystd', [620.9])
+    db.close()
+    db = ReferenceDatabase(path)
+    np.testing.assert_allclose(db.lines('Raman', 'mystd'), [620.9])
+    db.close()
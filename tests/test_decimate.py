@@ -0,0 +1,52 @@
+import numpy as np
+
+from decimate import LODPlotter, minmax_envelope
+
+
+def test_envelope_keeps_the_extremes_and_both_ends():
+    rng = np.random.default_rng(0)
+    x = np.arange(10001, dtype=float)
+    y = rng.normal(size=x.shape[0])
+    y[1234] = 50.0
+    y[5678] = -50.0
+    xs, ys = minmax_envelope(x, y, 100)
+    assert xs.shape[0] <= 2 * 100 + 2
+    assert np.all(np.diff(xs) > 0)
+    assert xs[0] == 0 and xs[-1] == 10000
+    assert 1234 in xs and 5678 in xs
+    # 各区間の最大値・最小値は残る
+    for block in np.array_split(y[:10000], 100):
+        assert block.max() in ys and block.min() in ys
+
+
+def test_short_data_is_returned_as_is():
+    x = np.arange(10.0)
+    xs, ys = minmax_envelope(x, x ** 2, 100)
+    np.testing.assert_array_equal(xs, x)
+    np.testing.assert_array_equal(ys, x ** 2)
+
+
+def test_descending_axis_and_xlim():
+    x = np.linspace(1000, 0, 10001)
+    y = np.sin(x)
+    xs, ys = minmax_envelope(x, y, 50, xlim=(600, 200))
+    assert np.all(np.diff(xs) > 0)
+    # 表示範囲の外の1点まで含む
+    assert xs[0] < 200 <= xs[1] and xs[-2] <= 600 < xs[-1]
+    np.testing.assert_allclose(ys, np.sin(xs))
+
+
+def test_lod_plotter_refines_on_zoom():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    x = np.linspace(0, 1000, 100001)
+    lod = LODPlotter(ax)
+    line = lod.plot(x, np.sin(x))
+    assert line.get_xdata().shape[0] < x.shape[0]
+    ax.set_xlim(100, 101)
+    xs = line.get_xdata()
+    assert xs[0] < 100 and xs[-1] > 101 and xs.shape[0] < 200
+    plt.close(fig)
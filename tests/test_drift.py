@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from conftest import lorentzian
+from drift import peak_positions, fit_corrections, interpolate_corrections, apply_corrections
+
+
+def test_peak_positions_finer_than_a_channel():
+    x = np.linspace(100, 600, 1001)
+    shifts = np.array([0.0, 0.13, -0.27])
+    ydata = np.vstack([lorentzian(x, [200 + s, 400 + s]) for s in shifts])
+    positions = peak_positions(x, ydata, [200, 400], 10)
+    np.testing.assert_allclose(positions, np.column_stack([200 + shifts, 400 + shifts]), atol=0.05)
+
+
+def test_peak_positions_descending_axis():
+    x = np.linspace(600, 100, 1001)
+    positions = peak_positions(x, lorentzian(x, [300.1]), [300], 10)
+    np.testing.assert_allclose(positions, [[300.1]], atol=0.05)
+
+
+def test_peak_at_window_edge_is_nan():
+    x = np.linspace(100, 600, 1001)
+    positions = peak_positions(x, lorentzian(x, [215.0]), [200], 10)
+    assert np.isnan(positions[0, 0])
+
+
+def test_fit_corrections_shift_and_linear():
+    true = np.array([200.0, 400.0])
+    measured = np.array([[199.0, 399.0], [200.0, 402.0], [np.nan, 400.0]])
+    shift = fit_corrections(measured, true, order=0)
+    np.testing.assert_allclose(shift[:2], [[1.0, 1.0], [-1.0, 1.0]])
+    np.testing.assert_allclose(shift[2], [0.0, 1.0])
+    linear = fit_corrections(measured, true, order=1)
+    np.testing.assert_allclose(linear[1, 0] + linear[1, 1] * measured[1], true)
+    # 1次式には有効なピークが2本必要
+    assert np.isnan(linear[2]).all()
+    with pytest.raises(ValueError):
+        fit_corrections(measured, true, order=2)
+
+
+def test_interpolate_and_apply_corrections():
+    coeffs = interpolate_corrections([0.0, 10.0, 20.0], [[0.0, 1.0], [np.nan, np.nan], [2.0, 1.0]], [5.0, 30.0])
+    np.testing.assert_allclose(coeffs, [[0.5, 1.0], [2.0, 1.0]])
+    x = np.array([1.0, 2.0])
+    np.testing.assert_allclose(apply_corrections(x, np.array([[0.5, 1.0], [np.nan, np.nan]])),
+                               [[1.5, 2.5], [1.0, 2.0]])
+    with pytest.raises(ValueError):
+        interpolate_corrections([0.0], [[np.nan, np.nan]], [1.0])
+
+
+def save_identity_model(path, x):
+    from model import CalibrationModel
+    CalibrationModel('Raman', 'sulfur', 1, 'Lorentzian', None, [], [], [], x, x,
+                     ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, 0.0]], 'ref.txt', 'hash').save(path)
+
+
+def test_batch_drift_refuses_dataloader_txt(tmp_path, write_spectrum, capsys):
+    from main import main
+
+    x = np.linspace(100, 600, 1001)
+    filename = write_spectrum('a.txt', x, lorentzian(x, [300.2]))
+    save_identity_model(str(tmp_path / 'calib.npz'), x)
+    assert main(['batch', filename, '--model', str(tmp_path / 'calib.npz'), '--drift-peaks', '300']) == 1
+    assert 'cannot record the drift correction' in capsys.readouterr().err
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.txt', 'calib.npz']
+
+
+def test_batch_drift_corrects_each_file(tmp_path, write_spectrum):
+    from main import main
+
+    x = np.linspace(100, 600, 1001)
+    filenames = [write_spectrum(f'{name}.txt', x, lorentzian(x, [300 + shift]))
+                 for name, shift in [('a', 0.3), ('b', -0.2)]]
+    save_identity_model(str(tmp_path / 'calib.npz'), x)
+    assert main(['batch', *filenames, '--model', str(tmp_path / 'calib.npz'), '--drift-peaks', '300',
+                 '--format', 'npz', '--output', str(tmp_path / 'out.npz')]) == 0
+    with np.load(str(tmp_path / 'out.npz'), allow_pickle=False) as f:
+        assert list(f['filenames']) == filenames
+        # 補正後はどちらのファイルもピークが300に来る
+        for i in range(2):
+            x_corrected = f[f'xdata_{i:05d}']
+            assert x_corrected[np.argmax(f[f'ydata_{i:05d}'])] == pytest.approx(300, abs=0.3)
+        np.testing.assert_allclose(f['xdata_00000'], x - 0.3, atol=0.05)
@@ -0,0 +1,57 @@
+import json
+import os
+import numpy as np
+import pytest
+
+import export
+
+
+def test_npz_writer_round_trip(tmp_path):
+    filename = str(tmp_path / 'out.npz')
+    with export.open_writer('npz', filename) as writer:
+        writer.add('a.txt', np.array([1.0, 2.0]), np.array([3.0, 4.0]), {'abs_path_ref': 'ref.txt'})
+        writer.add('b.txt', np.array([5.0]), np.array([6.0]))
+    with np.load(filename, allow_pickle=False) as f:
+        assert f['filenames'].tolist() == ['a.txt', 'b.txt']
+        np.testing.assert_array_equal(f['xdata_00000'], [1, 2])
+        np.testing.assert_array_equal(f['ydata_00001'], [6])
+        assert json.loads(str(f['metadata']))[0] == {'abs_path_ref': 'ref.txt'}
+    assert os.listdir(tmp_path) == ['out.npz']
+
+
+def test_batch_writer_leaves_nothing_on_error(tmp_path):
+    filename = str(tmp_path / 'out.npz')
+    with pytest.raises(RuntimeError):
+        with export.open_writer('npz', filename) as writer:
+            writer.add('a.txt', np.array([1.0]), np.array([2.0]))
+            raise RuntimeError('stop')
+    assert os.listdir(tmp_path) == []
+
+
+def test_text_writer(tmp_path):
+    name = str(tmp_path / 'a.txt')
+    with export.TextWriter(timestamp='20240101000000') as writer:
+        writer.add(name, np.array([1.0, 2.0]), np.array([3.0, 4.0]), {'abs_path_ref': 'ref.txt'})
+    output = str(tmp_path / 'a_20240101000000.txt')
+    assert writer.written == [output]
+    with open(output) as f:
+        assert f.readline() == '# abs_path_ref: ref.txt\n'
+    np.testing.assert_allclose(np.loadtxt(output), [[1, 3], [2, 4]])
+
+
+def test_text_writer_abort_removes_the_batch(tmp_path):
+    writer = export.TextWriter()
+    writer.add(str(tmp_path / 'a.txt'), np.array([1.0]), np.array([2.0]))
+    writer.abort()
+    assert os.listdir(tmp_path) == []
+
+
+def test_format_text():
+    assert export.format_text([1, 2], [3, 4], fmt='%.1f') == '1.0\t3.0\n2.0\t4.0\n'
+
+
+def test_open_writer_errors():
+    with pytest.raises(ValueError):
+        export.open_writer('npz')
+    with pytest.raises(ValueError):
+        export.open_writer('csv', 'out.csv')
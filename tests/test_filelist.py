@@ -0,0 +1,66 @@
+import random
+import time
+import pytest
+
+from filelist import _Order
+
+
+def test_order_matches_a_list():
+    rng = random.Random(0)
+    order = _Order()
+    expected = []
+    for step in range(3000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            expected.remove(key)
+            order.remove(key)
+        else:
+            expected.append(f'file{step}')
+            order.append(f'file{step}')
+        if step % 97 == 0:
+            assert [order.get(i) for i in range(len(order))] == expected
+    assert len(order) == len(expected)
+    assert [order.get(i) for i in range(len(order))] == expected
+
+
+def test_order_rebuild_keeps_keys():
+    order = _Order(f'file{i}' for i in range(1000))
+    for i in range(1000):
+        if i % 3 != 1:
+            order.remove(f'file{i}')
+    assert len(order.keys) < 1000
+    assert [order.get(i) for i in range(3)] == ['file1', 'file4', 'file7']
+    assert 'file2' not in order and 'file4' in order
+    order.append('new')
+    assert order.get(len(order) - 1) == 'new'
+
+
+def test_order_window_does_not_scan_the_list():
+    # 末尾付近の数行を取り出すのにかかる時間がファイル数にほぼ比例しない
+    def window_time(n):
+        order = _Order(f'file{i}' for i in range(n))
+        start = time.perf_counter()
+        for _ in range(200):
+            [order.get(i) for i in range(n - 6, n)]
+        return time.perf_counter() - start
+
+    assert window_time(200000) < 20 * window_time(2000)
+
+
+def test_file_list_renders_the_window():
+    tk = pytest.importorskip('tkinter')
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip('no display')
+    from filelist import FileList
+    try:
+        filelist = FileList(root, height=3)
+        filelist.add([f'f{i}' for i in range(10)])
+        filelist.yview('moveto', 1.0)
+        assert filelist.rendered == ['f7', 'f8', 'f9']
+        filelist.remove(['f8', 'f0'])
+        assert filelist.rendered == ['f6', 'f7', 'f9']
+        assert filelist.keys(0, 2) == ['f1', 'f2']
+    finally:
+        root.destroy()
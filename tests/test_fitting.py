@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+import fitting
+from conftest import lorentzian
+
+
+@pytest.mark.parametrize('function', fitting.FUNCTIONS)
+def test_fit_peaks_recovers_centers(function):
+    x = np.linspace(100, 600, 2000)
+    centers = [153.8, 219.1, 473.2]
+    if function == 'Gaussian':
+        y = 100 + sum(1000 * np.exp(-np.log(2) * ((x - c) / 3.0) ** 2) for c in centers)
+    else:
+        y = lorentzian(x, centers)
+    ranges = [(c - 12, 0, c + 12, 1) for c in centers]
+    result = fitting.fit_peaks(x, y, ranges, function)
+    assert result.ok.all()
+    # 隣のピークの裾が傾いたベースラインになるので，少しだけずれる
+    np.testing.assert_allclose(result.centers, centers, atol=0.01)
+    np.testing.assert_allclose(result.widths, 3.0, rtol=0.01)
+
+
+def test_fit_peaks_marks_empty_range():
+    x = np.linspace(100, 600, 2000)
+    result = fitting.fit_peaks(x, lorentzian(x, [200.0]), [(195, 0, 205, 1), (700, 0, 710, 1)], 'Lorentzian')
+    assert result.ok.tolist() == [True, False]
+    assert np.isnan(result.centers[1])
+
+
+def test_voigt_is_left_to_calibrator():
+    assert 'Voigt' not in fitting.FUNCTIONS
+
+
+def test_huber_flags_outlier():
+    x = np.array([100.0, 200, 300, 400, 500, 600])
+    y = 1.01 * x + 2
+    y[3] += 20
+    coeffs, inliers = fitting.robust_polyfit(x, y, 1, method='huber')
+    assert inliers.tolist() == [True, True, True, False, True, True]
+    np.testing.assert_allclose(coeffs, [1.01, 2], atol=0.05)
+
+
+def test_min_scale_keeps_good_points():
+    # 残差がチャンネル間隔よりずっと小さいときは，どの点も外れ値にしない
+    x = np.array([100.0, 200, 300, 400, 500, 600])
+    y = 1.01 * x + 2 + np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.05])
+    _, inliers = fitting.robust_polyfit(x, y, 1, min_scale=0.5)
+    assert inliers.all()
+
+
+def test_ransac_needs_more_than_a_minimal_subset():
+    # 次数+1点はどの組でも通るので，それ以上の点が合わなければ全点の最小二乗になる
+    x = np.array([0.0, 1, 2])
+    y = np.array([0.0, 5, 1])
+    coeffs, inliers = fitting.robust_polyfit(x, y, 0, method='ransac', threshold=0.1)
+    assert inliers.all()
+    np.testing.assert_allclose(coeffs, [2.0])
+
+
+def test_ransac_rejects_outlier():
+    x = np.arange(8, dtype=float)
+    y = 2 * x + 1
+    y[5] = 40
+    coeffs, inliers = fitting.robust_polyfit(x, y, 1, method='ransac')
+    assert inliers.sum() == 7 and not inliers[5]
+    np.testing.assert_allclose(coeffs, [2, 1], atol=1e-9)
+
+
+def test_calibrate_sets_calibrator_state():
+    from calibrator import Calibrator
+
+    x = np.linspace(100, 600, 2000)
+    true = np.array([153.8, 219.1, 473.2])
+    measured = (true - 2.0) / 1.002
+    calibrator = Calibrator()
+    calibrator.set_data(x, lorentzian(x, measured))
+    ranges = [(c - 12, 0, c + 12, 1) for c in measured]
+    result = fitting.calibrate(calibrator, 'Lorentzian', 1, ranges, true)
+    assert result is not None
+    np.testing.assert_allclose(calibrator.found_x_true, true)
+    np.testing.assert_allclose(np.polyval(result.coefficients, measured), true, atol=1e-3)
+    np.testing.assert_array_equal(calibrator.xdata_before, x)
+
+
+def test_calibrate_reference_uses_calibrator_by_default():
+    from calibrator import Calibrator
+    from pipeline import calibrate_reference
+
+    class Spec:
+        xdata = np.linspace(100, 600, 2000)
+        ydata = lorentzian(xdata, [153.8, 219.1, 473.2])
+
+    calibrator = Calibrator()
+    ranges = [(c - 12, 0, c + 12, 1) for c in [153.8, 219.1, 473.2]]
+    assert calibrate_reference(calibrator, Spec(), 'Raman', 'sulfur', 1, 'Lorentzian', ranges)
+    assert calibrator.fit_result is None
+
+
+def test_calibrate_reference_does_not_warm_start_from_another_reference():
+    from calibrator import Calibrator
+    from pipeline import calibrate_reference
+
+    class Spec:
+        xdata = np.linspace(100, 600, 2000)
+        ydata = lorentzian(xdata, [153.8, 219.1, 473.2])
+
+    ranges = [(c - 12, 0, c + 12, 1) for c in [153.8, 219.1, 473.2]]
+    fresh = Calibrator()
+    assert calibrate_reference(fresh, Spec(), 'Raman', 'sulfur', 1, 'Lorentzian', ranges, engine='fast')
+    # 前の参照のピーク位置が残っていても使わない
+    used = Calibrator()
+    used.fitted_x = [160.0, 225.0, 480.0]
+    assert calibrate_reference(used, Spec(), 'Raman', 'sulfur', 1, 'Lorentzian', ranges, engine='fast')
+    np.testing.assert_array_equal(used.fitted_x, fresh.fitted_x)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import grid
+from dataloader import Spectrum
+
+
+def test_make_grid_includes_stop():
+    np.testing.assert_allclose(grid.make_grid(0, 1, 0.25), [0, 0.25, 0.5, 0.75, 1])
+    with pytest.raises(ValueError):
+        grid.make_grid(1, 0, 0.1)
+
+
+def test_default_grid():
+    spec_dict = {'a': Spectrum(np.linspace(0, 10, 11), np.zeros(11)),
+                 'b': Spectrum(np.linspace(5, 20, 31), np.zeros(31))}
+    assert grid.default_grid(spec_dict) == (0.0, 20.0, 0.5)
+
+
+def test_statistics_match_numpy(tmp_path):
+    rng = np.random.default_rng(0)
+    grid_x = np.linspace(0, 1, 50)
+    ydata = rng.normal(size=(30, 50))
+    ydata[rng.random(ydata.shape) < 0.1] = np.nan
+    with grid.GridAggregator(grid_x, directory=str(tmp_path)) as aggregator:
+        # 何回かに分けて加えても同じ
+        for i in range(0, 30, 7):
+            aggregator.add([f'f{j}' for j in range(i, min(i + 7, 30))], ydata[i:i + 7])
+        stats = aggregator.statistics()
+        np.testing.assert_allclose(stats['mean'], np.nanmean(ydata, axis=0))
+        np.testing.assert_allclose(stats['std'], np.nanstd(ydata, axis=0, ddof=1))
+        np.testing.assert_allclose(stats['median'], np.nanmedian(ydata, axis=0))
+        np.testing.assert_array_equal(stats['count'], (~np.isnan(ydata)).sum(axis=0))
+        np.testing.assert_array_equal(aggregator.ydata(), ydata)
+
+
+def test_add_spectrum_resamples_and_saves(tmp_path):
+    grid_x = np.array([1.0, 2.0, 3.0, 4.0])
+    with grid.GridAggregator(grid_x, directory=str(tmp_path)) as aggregator:
+        # 降順の軸や範囲外の点も扱う
+        aggregator.add_spectrum('a', Spectrum(np.array([0.0, 2.0, 4.0]), np.array([0.0, 2.0, 4.0])))
+        aggregator.add_spectrum('b', Spectrum(np.array([3.5, 2.5, 1.5]), np.array([3.5, 2.5, 1.5])))
+        assert len(aggregator) == 2
+        saved = aggregator.save(str(tmp_path / 'out'))
+    with np.load(saved[0]) as f:
+        assert f['filenames'].tolist() == ['a', 'b']
+        np.testing.assert_allclose(f['ydata'], [[1, 2, 3, 4], [np.nan, 2, 3, np.nan]])
+        np.testing.assert_allclose(f['mean'], [1, 2, 3, 4])
+        np.testing.assert_array_equal(f['count'], [1, 2, 2, 1])
+    assert np.loadtxt(saved[1]).shape == (4, 5)
+
+
+def test_clear(tmp_path):
+    with grid.GridAggregator([0.0, 1.0], directory=str(tmp_path)) as aggregator:
+        aggregator.add(['a'], [[1.0, 2.0]])
+        aggregator.add_spectrum('b', Spectrum(np.array([0.0, 1.0]), np.array([3.0, 3.0])))
+        aggregator.clear()
+        assert len(aggregator) == 0
+        aggregator.add(['c'], [[5.0, 6.0]])
+        np.testing.assert_allclose(aggregator.mean(), [5, 6])
+        assert aggregator.ydata().shape == (1, 2)
+
+
+def test_close_removes_temporary_file(tmp_path):
+    aggregator = grid.GridAggregator([0.0, 1.0], directory=str(tmp_path))
+    aggregator.add(['a'], [[1.0, 2.0]])
+    aggregator.close()
+    assert list(tmp_path.iterdir()) == []
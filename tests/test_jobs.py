@@ -0,0 +1,97 @@
+import threading
+
+from jobs import JobRunner
+
+
+class FakeMaster:
+    # after()で渡された関数を溜めておき，run()でメインスレッドの代わりに呼ぶ
+    def __init__(self):
+        self.pending = []
+
+    def after(self, ms, func) -> None:
+        self.pending.append(func)
+
+    def run(self) -> None:
+        while self.pending:
+            self.pending.pop(0)()
+            threading.Event().wait(0.001)
+
+
+def make_runner(events):
+    master = FakeMaster()
+    runner = JobRunner(master, on_start=lambda job: events.append(('start', job.name)),
+                       on_progress=lambda job, i, n: events.append(('progress', i, n)),
+                       on_finish=lambda job, kind: events.append(('finish', kind)))
+    return master, runner
+
+
+def test_done_and_error():
+    events = []
+    master, runner = make_runner(events)
+    assert runner.submit('ok', lambda job: 42, on_done=lambda v: events.append(('done', v)))
+    master.run()
+    assert events == [('start', 'ok'), ('finish', 'done'), ('done', 42)]
+    assert not runner.busy
+
+    events.clear()
+
+    def fail(job):
+        raise ValueError('broken')
+
+    runner.submit('ng', fail, on_error=lambda e: events.append(('error', str(e))))
+    master.run()
+    assert events == [('start', 'ng'), ('finish', 'error'), ('error', 'broken')]
+
+
+def test_busy_runner_refuses_a_second_job():
+    events = []
+    master, runner = make_runner(events)
+    release = threading.Event()
+    assert runner.submit('first', lambda job: release.wait(5))
+    assert runner.busy
+    assert not runner.submit('second', lambda job: None)
+    release.set()
+    master.run()
+    assert ('start', 'second') not in events
+    assert not runner.busy
+
+
+def test_cancel_stops_at_the_next_progress():
+    events = []
+    master, runner = make_runner(events)
+    started = threading.Event()
+    done = []
+
+    def work(job):
+        started.set()
+        while True:
+            job.progress(0, 1)
+            threading.Event().wait(0.001)
+
+    runner.submit('loop', work, on_done=done.append, on_error=done.append)
+    started.wait(5)
+    runner.cancel()
+    master.run()
+    assert events[-1] == ('finish', 'cancelled')
+    assert done == []
+
+
+def test_progress_is_coalesced():
+    events = []
+    master, runner = make_runner(events)
+    finished = threading.Event()
+
+    def work(job):
+        for i in range(100):
+            job.progress(i + 1, 100)
+        finished.set()
+        # 最初のポーリングまでに全ての進捗が届くようにする
+        threading.Event().wait(0.05)
+
+    runner.submit('progress', work)
+    finished.wait(5)
+    master.pending.pop(0)()
+    # 溜まった進捗は最後の1つだけ通知する
+    assert events == [('start', 'progress'), ('progress', 100, 100)]
+    master.run()
+    assert events[-1] == ('finish', 'done')
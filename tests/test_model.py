@@ -0,0 +1,79 @@
+import json
+import os
+import time
+import numpy as np
+import pytest
+
+from model import CalibrationModel, ModelStore
+from multicenter import CalibrationTable
+
+
+def make_model(center=None):
+    x = np.linspace(100, 600, 50)
+    return CalibrationModel('Raman', 'sulfur', 1, 'Lorentzian', center, [(150, 0, 160, 1), (470, 0, 480, 1)],
+                            [152.0, 471.0], [153.8, 473.2], x, 1.002 * x + 2,
+                            ['Raman', 'sulfur', 1, 'Lorentzian', [np.float64(1.002), 2.0]], 'ref.txt', 'hash')
+
+
+def test_save_and_load_without_pickle(tmp_path):
+    filename = str(tmp_path / 'calib.npz')
+    make_model().save(filename)
+    with np.load(filename, allow_pickle=False) as f:
+        assert all(f[key].dtype != object for key in f.files)
+    model = CalibrationModel.load(filename)
+    assert model.calibration_info == ['Raman', 'sulfur', 1, 'Lorentzian', [1.002, 2.0]]
+    np.testing.assert_allclose(model.xdata, make_model().xdata)
+    assert model.ranges == [(150, 0, 160, 1), (470, 0, 480, 1)]
+
+
+def test_old_pickled_file_is_refused(tmp_path):
+    arrays = make_model().to_arrays()
+    meta = json.loads(arrays['meta'])
+    del meta['calibration_info']
+    arrays['meta'] = json.dumps(meta)
+    calibration_info = np.empty(1, dtype=object)
+    calibration_info[0] = ['Raman']
+    arrays['calibration_info'] = calibration_info
+    filename = str(tmp_path / 'old.npz')
+    np.savez(filename, **arrays)
+    with pytest.raises(ValueError):
+        CalibrationModel.load(filename)
+
+
+def test_not_a_calibration(tmp_path):
+    filename = tmp_path / 'a.txt'
+    filename.write_text('1 2\n')
+    with pytest.raises(ValueError):
+        CalibrationModel.load(str(filename))
+    assert not CalibrationTable.is_table(str(filename))
+    with pytest.raises(FileNotFoundError):
+        CalibrationTable.is_table(str(tmp_path / 'missing.npz'))
+
+
+def test_dict_round_trip():
+    model = CalibrationModel.from_dict(json.loads(json.dumps(make_model().to_dict())))
+    assert model.rms_residual() == pytest.approx(make_model().rms_residual())
+
+
+def test_table_round_trip(tmp_path):
+    filename = str(tmp_path / 'table.npz')
+    CalibrationTable({630.0: make_model(630.0), 500.0: make_model(500.0)}).save(filename)
+    assert CalibrationTable.is_table(filename)
+    table = CalibrationTable.load(filename)
+    assert table.centers() == [500.0, 630.0]
+    assert table.route('/data/neon_630nm.txt').center == 630.0
+
+
+def test_model_store_evicts_least_recently_used(tmp_path):
+    model = make_model()
+    model.save(str(tmp_path / 'size.npz'))
+    size = os.path.getsize(str(tmp_path / 'size.npz'))
+    store = ModelStore(str(tmp_path / 'store'), max_bytes=3 * size)
+    for key in 'abc':
+        store.put(key, model)
+        time.sleep(0.01)
+    # aを使ったのでbが最も古い
+    assert store.get('a') is not None
+    store.put('d', model)
+    assert store.get('b') is None
+    assert sorted(os.listdir(str(tmp_path / 'store'))) == ['a.npz', 'c.npz', 'd.npz']
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from model import CalibrationModel
+from multicenter import CalibrationTable, detect_center
+
+
+class Spec:
+    def __init__(self, n: int):
+        self.xdata = np.arange(n, dtype=float)
+        self.ydata = np.zeros(n)
+        self.abs_path_ref = None
+        self.calibration = None
+
+
+def make_model(center: float, n: int = 1024):
+    x = np.arange(n, dtype=float)
+    return CalibrationModel('Rayleigh', 'neon', 1, 'Lorentzian', center, [], [], [], x, center - 67 + 0.13 * x,
+                            ['Rayleigh', 'neon', 1, 'Lorentzian', [0.13, center - 67]], f'ref_{center:g}.txt', 'hash')
+
+
+@pytest.mark.parametrize('name, center', [
+    ('neon_630nm.txt', 630.0),
+    ('/data/630/sample_500.txt', 500.0),
+    ('sample_1500_630.txt', 630.0),
+    ('run20240630_a.txt', None),
+    ('sample_7600.txt', None),
+    ('sample_630.5.txt', None),
+    ('sample.760.txt', 760.0),
+])
+def test_detect_center_matches_whole_numbers(name, center):
+    assert detect_center(name) == center
+
+
+def test_detect_center_refuses_ambiguous_names():
+    with pytest.raises(ValueError):
+        detect_center('neon_500_to_630.txt')
+
+
+def test_route_by_file_name():
+    table = CalibrationTable({500.0: make_model(500.0), 630.0: make_model(630.0)})
+    assert table.route('sample_1500_630.txt').center == 630.0
+    spec = Spec(1024)
+    table.apply('x_500nm.txt', spec)
+    assert spec.abs_path_ref == 'ref_500.txt'
+    assert spec.xdata[0] == pytest.approx(433.0)
+
+
+@pytest.mark.parametrize('name', ['run20240630_a.txt', 'sample_760.txt', 'a_500_630.txt'])
+def test_route_fails_loudly(name):
+    # 軸の値からは推測しない(生データの軸はピクセル番号のことがある)
+    table = CalibrationTable({500.0: make_model(500.0), 630.0: make_model(630.0)})
+    spec = Spec(1024)
+    with pytest.raises(ValueError):
+        table.apply(name, spec)
+    np.testing.assert_array_equal(spec.xdata, np.arange(1024))
+
+
+def test_apply_checks_the_number_of_channels():
+    table = CalibrationTable({630.0: make_model(630.0)})
+    with pytest.raises(ValueError):
+        table.apply('a_630.txt', Spec(512))
+
+
+@pytest.mark.parametrize('fmt', ['txt', 'txt-fast'])
+def test_batch_applies_a_table_per_center(tmp_path, write_spectrum, capsys, fmt):
+    from main import main
+
+    table = str(tmp_path / 'table.npz')
+    CalibrationTable({500.0: make_model(500.0), 630.0: make_model(630.0)}).save(table)
+    pixels = np.arange(1024, dtype=float)
+    names = ['a_500.txt', 'b_630.txt', 'c_1500.txt']
+    filenames = [write_spectrum(name, pixels, np.ones(1024)) for name in names]
+    assert main(['--workers', '1', 'batch', *filenames, '--model', table, '--format', fmt]) == 2
+    assert 'The center wavelength is not in the file name: c_1500.txt' in capsys.readouterr().err
+    outputs = sorted(p for p in tmp_path.iterdir() if p.name not in names + ['table.npz'])
+    assert [p.name[0] for p in outputs] == ['a', 'b']
+    for output, center in zip(outputs, [500, 630]):
+        x = np.loadtxt(str(output), delimiter='\t')[:, 0]
+        assert x[0] == pytest.approx(center - 67)
@@ -0,0 +1,101 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import parallel
+from conftest import lorentzian
+
+
+def test_map_bounded_keeps_order_and_limits_tasks():
+    submitted = []
+    lock = threading.Lock()
+
+    def work(i):
+        with lock:
+            submitted.append(i)
+        return i * i
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = parallel._map_bounded(executor, work, range(100), 5)
+        for i, result in enumerate(results):
+            assert result == i * i
+            # 使う側が受け取っていない結果はwindow個まで
+            assert len(submitted) <= i + 5
+    assert sorted(submitted) == list(range(100))
+
+
+def test_map_bounded_stops_submitting_when_closed():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = parallel._map_bounded(executor, lambda i: i, range(1000), 4)
+        assert next(results) == 0
+        results.close()
+
+
+def test_iter_load_in_order_with_errors(tmp_path, write_spectrum):
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i:02d}.txt', x, lorentzian(x, [200 + i]))
+                 for i in range(parallel.MIN_FILES_PARALLEL)]
+    broken = str(tmp_path / 'broken.txt')
+    with open(broken, 'w') as f:
+        f.write('not a spectrum\n')
+    filenames.insert(3, broken)
+    for workers in [1, 2]:
+        results = list(parallel.iter_load(filenames, workers=workers))
+        assert [r[0] for r in results] == filenames
+        assert [r[2] is None for r in results] == [f != broken for f in filenames]
+        assert results[0][1].ydata.argmax() == 20
+
+
+def test_calibrate_files_saves_each_file(tmp_path, write_spectrum):
+    from calibrator import Calibrator
+
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i:02d}.txt', x, lorentzian(x, [300])) for i in range(parallel.MIN_FILES_PARALLEL)]
+    calibrator = Calibrator()
+    calibrator.xdata = x + 1
+    calibrator.calibration_info = ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, 1.0]]
+    results = list(parallel.calibrate_files(filenames, calibrator, 'ref.txt', workers=2))
+    assert results == [(f, None) for f in filenames]
+    outputs = sorted(set(map(str, tmp_path.iterdir())) - set(filenames))
+    assert len(outputs) == len(filenames)
+    np.testing.assert_allclose(np.loadtxt(outputs[0], delimiter='\t')[:, 0], x + 1)
+
+
+def test_load_files_keeps_the_input_order(write_spectrum):
+    from dataloader import DataLoader
+
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i:02d}.txt', x, lorentzian(x, [200 + 5 * i]))
+                 for i in range(parallel.MIN_FILES_PARALLEL + 4)][::-1]
+    for workers in [1, 3]:
+        dl = DataLoader()
+        progress = []
+        parallel.load_files(dl, filenames, workers=workers, progress=lambda i, n: progress.append((i, n)))
+        assert list(dl.spec_dict) == filenames
+        assert progress[-1] == (len(filenames), len(filenames))
+        assert x[dl.spec_dict[filenames[0]].ydata.argmax()] == 200 + 5 * (len(filenames) - 1)
+
+
+def test_load_files_uses_the_cache(tmp_path, write_spectrum):
+    from cache import SpectrumCache
+    from dataloader import DataLoader
+
+    x = np.linspace(100, 600, 101)
+    filename = write_spectrum('a.txt', x, lorentzian(x, [300]))
+    cache = SpectrumCache(str(tmp_path / 'cache'))
+    parallel.load_files(DataLoader(), [filename], workers=1, cache=cache)
+    dl = DataLoader()
+    parallel.load_files(dl, [filename], workers=1, cache=cache)
+    assert isinstance(dl.spec_dict[filename].ydata, np.memmap)
+
+
+def test_save_files_saves_every_file(tmp_path, write_spectrum):
+    from dataloader import DataLoader
+
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i:02d}.txt', x, lorentzian(x, [300]))
+                 for i in range(parallel.MIN_FILES_PARALLEL)]
+    dl = DataLoader()
+    parallel.load_files(dl, filenames, workers=1)
+    assert parallel.save_files(dl, filenames, workers=4) == filenames
+    assert len(list(tmp_path.iterdir())) == 2 * len(filenames)
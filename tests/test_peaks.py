@@ -0,0 +1,45 @@
+import numpy as np
+
+from conftest import lorentzian
+from peaks import PeakIndex, find_peak_ranges, auto_ranges
+
+
+def test_assign_nearest_true_value():
+    index = PeakIndex([473.2, 153.8, 219.1])
+    assigned = index.assign([(150, 0, 156, 1), (470, 0, 476, 1)])
+    assert assigned.tolist() == [153.8, 473.2]
+
+
+def test_assign_gives_each_true_value_once():
+    # 2つの範囲が同じ真値に最も近い場合，遠い方は次に近い真値になる
+    index = PeakIndex([100.0, 110.0])
+    assigned = index.assign([(99, 0, 101, 1), (101, 0, 103, 1)])
+    assert assigned.tolist() == [100.0, 110.0]
+
+
+def test_assign_outside_tolerance_is_nan():
+    index = PeakIndex([100.0, 200.0])
+    assigned = index.assign([(98, 0, 102, 1), (148, 0, 152, 1)], tolerance=5)
+    assert assigned[0] == 100.0
+    assert np.isnan(assigned[1])
+
+
+def test_assign_without_ranges():
+    assert PeakIndex([1.0]).assign([]).shape == (0,)
+
+
+def test_find_peak_ranges_contains_each_peak():
+    x = np.linspace(100, 600, 2000)
+    centers = [153.8, 219.1, 473.2]
+    ranges = find_peak_ranges(x, lorentzian(x, centers))
+    assert len(ranges) == 3
+    for (x0, _, x1, _), c in zip(ranges, centers):
+        assert x0 < c < x1
+
+
+def test_auto_ranges_drops_unassigned_peaks():
+    x = np.linspace(100, 600, 2000)
+    # 350は真値にないので捨てられる
+    ranges, x_true = auto_ranges(x, lorentzian(x, [153.8, 350.0, 473.2]), PeakIndex([153.8, 219.1, 473.2]))
+    assert x_true == [153.8, 473.2]
+    assert len(ranges) == 2
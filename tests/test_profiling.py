@@ -0,0 +1,66 @@
+import json
+import numpy as np
+import pytest
+
+from conftest import lorentzian
+from profiling import Tracer, tracer
+
+
+@pytest.fixture
+def clean_tracer(monkeypatch):
+    # main()はtracerを有効にしたままにするので，テストの後で元に戻す
+    monkeypatch.setattr(tracer, 'enabled', False)
+    monkeypatch.setattr(tracer, 'events', [])
+    monkeypatch.setattr(tracer, 'stats', {})
+    monkeypatch.setattr(tracer, 'counters', {})
+    return tracer
+
+
+def test_span_and_count():
+    t = Tracer()
+    t.enabled = True
+    with t.span('fit', n=3):
+        pass
+    t.count('files', 2)
+    t.count('files', 3)
+    assert t.stats['fit'][0] == 1
+    assert t.counters == {'files': 5}
+    assert 'fit: 1 x' in t.summary()
+
+
+def test_disabled_tracer_records_nothing():
+    t = Tracer()
+    with t.span('fit'):
+        pass
+    t.count('files')
+    assert t.events == [] and t.counters == {}
+
+
+def test_iterate_times_each_item():
+    t = Tracer()
+    t.enabled = True
+    assert list(t.iterate('load', range(3))) == [0, 1, 2]
+    # 3つの要素と終わりの確認
+    assert t.stats['load'][0] == 4
+
+
+def test_batch_export_traces_each_stage(tmp_path, write_spectrum, clean_tracer):
+    from main import main
+    from model import CalibrationModel
+
+    x = np.linspace(100, 600, 101)
+    filenames = [write_spectrum(f'{i}.txt', x, lorentzian(x, [300])) for i in range(3)]
+    CalibrationModel('Raman', 'sulfur', 1, 'Lorentzian', None, [], [], [], x, x + 1,
+                     ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, 1.0]], 'ref.txt', 'hash').save(str(tmp_path / 'c.npz'))
+    trace = str(tmp_path / 'trace.json')
+    assert main(['--trace', trace, '--workers', '1', 'batch', *filenames, '--model', str(tmp_path / 'c.npz'),
+                 '--format', 'npz', '--output', str(tmp_path / 'out.npz')]) == 0
+    with open(trace) as f:
+        data = json.load(f)
+    for name in ['prepare_calibrator', 'export', 'load_file', 'apply_calibration', 'write_spectrum']:
+        assert name in data['summary']
+    assert data['summary']['write_spectrum']['count'] == 3
+    assert data['counters']['files loaded'] == 3
+    assert data['counters']['points loaded'] == 303
+    assert data['counters']['files saved'] == 3
+    assert data['counters']['bytes saved'] > 0
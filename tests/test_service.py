@@ -0,0 +1,119 @@
+import glob
+import os
+import threading
+import http.client
+import numpy as np
+import pytest
+
+import service
+from conftest import lorentzian
+from dataloader import Spectrum
+from model import ModelStore
+
+TRUE = [153.8, 219.1, 473.2]
+MEASURED = [(x - 2.0) / 1.002 for x in TRUE]
+RANGES = [(x - 12, 0, x + 12, 1) for x in MEASURED]
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / 'data'
+    root.mkdir()
+    calibration_service = service.CalibrationService(jobs=1, queue_size=4, workers=1,
+                                                     store=ModelStore(str(tmp_path / 'models')),
+                                                     database=':memory:', roots=[str(root)])
+    http_server = service.make_server(calibration_service, port=0, token='secret')
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server, root
+    http_server.shutdown()
+    http_server.server_close()
+    calibration_service.shutdown()
+
+
+def client(http_server, token='secret'):
+    return service.ServiceClient(f'http://127.0.0.1:{http_server.server_address[1]}', token=token, timeout=10)
+
+
+def reference():
+    x = np.linspace(100, 600, 2000)
+    return Spectrum(x, lorentzian(x, MEASURED))
+
+
+def test_calibrate_and_apply(server, write_spectrum):
+    http_server, root = server
+    c = client(http_server)
+    model, cached = c.calibrate(reference(), 'ref.txt', 'Raman', 'sulfur', 1, 'Lorentzian', RANGES, x_true=TRUE,
+                                 engine='fast')
+    assert not cached
+    np.testing.assert_allclose(np.polyval(model.coefficients, MEASURED), TRUE, atol=1e-2)
+    # 同じ条件ならフィッティングし直さない
+    _, cached = c.calibrate(reference(), 'ref.txt', 'Raman', 'sulfur', 1, 'Lorentzian', RANGES, x_true=TRUE,
+                            engine='fast')
+    assert cached
+
+    spec = reference()
+    filenames = [write_spectrum(f'data/d{i}.txt', spec.xdata, spec.ydata) for i in range(3)]
+    result = c.apply(model, filenames)
+    assert result['saved'] == filenames and result['failed'] == []
+    assert len(glob.glob(str(root / 'd0_*.txt'))) == 1
+
+    output = str(root / 'out.npz')
+    result = c.apply(model, filenames, fmt='npz', output=output)
+    with np.load(output) as f:
+        assert f['filenames'].tolist() == filenames
+        np.testing.assert_allclose(f['xdata_00000'], model.xdata)
+
+
+def test_paths_outside_root_are_refused(server, tmp_path, write_spectrum):
+    http_server, root = server
+    c = client(http_server)
+    model, _ = c.calibrate(reference(), 'ref.txt', 'Raman', 'sulfur', 1, 'Lorentzian', RANGES, x_true=TRUE)
+    outside = write_spectrum('outside.txt', [1.0, 2.0], [1.0, 2.0])
+    for kwargs in (dict(filenames=[outside]), dict(filenames=[str(root / '..' / 'outside.txt')]),
+                   dict(filenames=[], fmt='npz', output=str(tmp_path / 'out.npz'))):
+        with pytest.raises(service.ServiceError, match='400'):
+            c.apply(model, **kwargs)
+    with pytest.raises(service.ServiceError, match='400'):
+        c.submit('calibrate', filename_ref=outside)
+    assert not os.path.exists(str(tmp_path / 'out.npz'))
+
+
+def test_token_is_required(server):
+    http_server, _ = server
+    for token in ['wrong', 'secre', None]:
+        with pytest.raises(service.ServiceError, match='403'):
+            client(http_server, token=token).status()
+    assert client(http_server).status()['jobs'] == 1
+
+
+def test_unknown_job_and_model(server):
+    http_server, _ = server
+    c = client(http_server)
+    with pytest.raises(service.ServiceError, match='400'):
+        c.submit('unknown')
+    with pytest.raises(service.ServiceError, match='404'):
+        c.job('nothing')
+    with pytest.raises(service.ServiceError, match='404'):
+        c.get_model('nothing')
+
+
+def test_too_large_body_closes_the_connection(server):
+    http_server, _ = server
+    connection = http.client.HTTPConnection('127.0.0.1', http_server.server_address[1], timeout=10)
+    connection.putrequest('POST', '/jobs')
+    connection.putheader('X-Token', 'secret')
+    connection.putheader('Content-Length', str(service.MAX_BODY + 1))
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 413
+    assert response.getheader('Connection') == 'close'
+    connection.close()
+
+
+def test_loopback_only_without_token():
+    assert service.is_loopback('127.0.0.1')
+    assert service.is_loopback('localhost')
+    assert service.is_loopback('::1')
+    assert not service.is_loopback('0.0.0.0')
+    assert not service.is_loopback('192.168.0.10')
@@ -0,0 +1,48 @@
+import json
+import os
+import pytest
+
+from model import CalibrationModel
+from session import Session
+from test_model import make_model
+
+
+def make_session(filenames=('a.txt', 'b.txt')):
+    return Session('Raman', 'sulfur', '1', 'Lorentzian', 630.0, 'ref.txt', [(150, 0, 160, 1), (470, 0, 480, 1)],
+                   [153.8, 473.2], list(filenames))
+
+
+def test_round_trip_with_a_model(tmp_path):
+    filename = str(tmp_path / 'sessions' / 'work.json')
+    make_session().save(filename, model=make_model())
+    assert os.path.exists(str(tmp_path / 'sessions' / 'work.calib.npz'))
+    assert not os.path.exists(filename + '.tmp')
+
+    session = Session.load(filename)
+    assert session.to_dict()['filenames'] == ['a.txt', 'b.txt']
+    assert session.ranges == [(150.0, 0.0, 160.0, 1.0), (470.0, 0.0, 480.0, 1.0)]
+    assert session.x_true == [153.8, 473.2]
+    # キャリブレーション結果はセッションからの相対パスで保存し，読み込み時に絶対パスにする
+    assert session.calibration == str(tmp_path / 'sessions' / 'work.calib.npz')
+    model = CalibrationModel.load(session.calibration)
+    assert model.calibration_info[-1] == make_model().calibration_info[-1]
+
+
+def test_without_model_and_manual_assignment(tmp_path):
+    filename = str(tmp_path / 'work.json')
+    session = Session('Raman', 'sulfur', '1', 'Lorentzian', None, 'ref.txt', [], None, [], calibration='old.npz')
+    session.save(filename)
+    session = Session.load(filename)
+    assert session.calibration is None and session.x_true is None
+
+
+def test_unknown_version_is_refused(tmp_path):
+    filename = str(tmp_path / 'work.json')
+    make_session().save(filename)
+    with open(filename, 'r', encoding='utf-8') as f:
+        d = json.load(f)
+    d['version'] = 99
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(d, f)
+    with pytest.raises(ValueError, match='version'):
+        Session.load(filename)
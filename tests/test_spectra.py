@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from calibrator import Calibrator
+from dataloader import Spectrum
+from spectra import SpectrumArray, load_arrays, pack_spec_dict, save_arrays_npz
+
+
+def test_load_arrays_groups_by_axis_and_keeps_failures(tmp_path, write_spectrum):
+    x1 = np.linspace(100, 600, 11)
+    x2 = np.linspace(100, 600, 21)
+    filenames = [write_spectrum(f'a{i}.txt', x1, x1 * i) for i in range(40)]
+    filenames.append(write_spectrum('b.txt', x2, x2))
+    broken = str(tmp_path / 'broken.txt')
+    with open(broken, 'w') as f:
+        f.write('not a spectrum\n')
+    progress = []
+    arrays, failed = load_arrays(filenames + [broken], progress=lambda i, n: progress.append((i, n)))
+    assert [len(array) for array in arrays] == [40, 1]
+    assert arrays[0].filenames == filenames[:40]
+    np.testing.assert_array_equal(arrays[0].ydata[7], x1 * 7)
+    assert [f for f, _ in failed] == [broken]
+    assert progress[-1] == (42, 42)
+
+    output = str(tmp_path / 'arrays.npz')
+    save_arrays_npz(output, arrays)
+    with np.load(output) as f:
+        assert f['filenames_1'].tolist() == [filenames[-1]]
+        np.testing.assert_array_equal(f['ydata_0'], arrays[0].ydata)
+
+
+def test_calibrate_and_resample():
+    x = np.array([3.0, 2.0, 1.0, 0.0])
+    array = SpectrumArray(['a', 'b'], x, np.array([x, 2 * x]))
+    calibrator = Calibrator()
+    calibrator.xdata = x[:3]
+    with pytest.raises(ValueError):
+        array.calibrate(calibrator, 'ref.txt')
+    calibrator.xdata = x + 1
+    calibrator.calibration_info = ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, 1.0]]
+    array.calibrate(calibrator, 'ref.txt')
+    assert array.abs_path_ref == 'ref.txt' and array.calibration[0] == 'Raman'
+    # 軸が降順でも補間でき，範囲外はnan
+    resampled = array.resample([1.5, 2.5, 3.5, 5.0])
+    np.testing.assert_allclose(resampled[:, :3], [[0.5, 1.5, 2.5], [1.0, 3.0, 5.0]])
+    assert np.isnan(resampled[:, 3]).all()
+
+
+def test_shape_is_checked():
+    with pytest.raises(ValueError):
+        SpectrumArray(['a'], np.arange(3.0), np.zeros((2, 3)))
+
+
+def test_pack_spec_dict_shares_the_axis():
+    x = np.linspace(0, 1, 5)
+    spec_dict = {name: Spectrum(x.copy(), np.full(5, float(i))) for i, name in enumerate('abc')}
+    spec_dict['d'] = Spectrum(np.linspace(0, 1, 6), np.zeros(6))
+    arrays = pack_spec_dict(spec_dict)
+    assert sorted(len(array) for array in arrays) == [1, 3]
+    assert spec_dict['a'].xdata is spec_dict['c'].xdata
+    assert spec_dict['a'].ydata.base is spec_dict['b'].ydata.base is not None
+    np.testing.assert_array_equal(spec_dict['b'].ydata, np.ones(5))
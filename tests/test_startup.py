@@ -0,0 +1,27 @@
+import os
+import sys
+import subprocess
+import pytest
+
+from conftest import ROOT
+
+HEAVY = ['numpy', 'matplotlib', 'scipy']
+
+
+def imported_heavy_modules(code: str) -> list:
+    # 新しいプロセスでcodeを実行し，読み込まれた重いモジュールを返す
+    code = f'import sys\n{code}\nprint(",".join(m for m in {HEAVY!r} if m in sys.modules))'
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, 'tests', 'standins'), ROOT]))
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return [m for m in result.stdout.strip().split(',') if m]
+
+
+def test_parser_does_not_import_heavy_modules():
+    assert imported_heavy_modules('import main\nmain.build_parser()\nimport batch') == []
+
+
+def test_gui_imports_heavy_modules_after_the_window():
+    pytest.importorskip('tkinterdnd2')
+    pytest.importorskip('tooltip')
+    assert imported_heavy_modules('import gui') == []
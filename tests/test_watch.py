@@ -0,0 +1,55 @@
+from watch import Ledger
+
+
+def test_ledger_remembers_done_failed_and_outputs(tmp_path):
+    filename = str(tmp_path / 'ledger.jsonl')
+    ledger = Ledger(filename)
+    ok, bad = ('/data/a.txt', 1, 10), ('/data/b.txt', 2, 20)
+    ledger.add(ok, 'ok', outputs=['/data/a_20240101.txt'])
+    ledger.add(bad, 'error', error='broken', outputs=[])
+    ledger.close()
+
+    ledger = Ledger(filename)
+    assert ok in ledger
+    # 失敗したファイルは書き換えられる(更新時刻か大きさが変わる)までは処理しない
+    assert bad in ledger
+    assert ('/data/b.txt', 3, 20) not in ledger
+    assert ledger.is_output('/data/a_20240101.txt')
+    # 日付を含む名前でも，書き出したものでなければ監視の対象
+    assert not ledger.is_output('/data/sulfur_20230913.txt')
+    ledger.close()
+
+
+def test_process_batch_records_only_what_it_wrote(tmp_path, write_spectrum, monkeypatch):
+    import argparse
+    import os
+    import numpy as np
+    import dataloader
+    from calibrator import Calibrator
+    from watch import process_batch
+
+    x = np.linspace(100, 600, 101)
+    path = write_spectrum('a.txt', x, np.ones_like(x))
+    save = dataloader.DataLoader.save
+
+    def save_while_a_file_arrives(self, filename):
+        save(self, filename)
+        # 保存中に同じ接頭辞の新しい生データが届く
+        write_spectrum('a_x.txt', x, np.ones_like(x))
+
+    monkeypatch.setattr(dataloader.DataLoader, 'save', save_while_a_file_arrives)
+    calibrator = Calibrator()
+    calibrator.xdata = x + 1
+    calibrator.calibration_info = ['Raman', 'sulfur', 1, 'Lorentzian', [1.0, 1.0]]
+    ledger = Ledger(str(tmp_path / '.ledger.jsonl'))
+    args = argparse.Namespace(format='txt', workers=1, output_dir=None, directories=[str(tmp_path)])
+    st = os.stat(path)
+    process_batch(args, [((path, st.st_mtime_ns, st.st_size), 0.0)], calibrator, 'ref.txt', ledger, [])
+    ledger.close()
+
+    outputs = sorted(set(os.listdir(str(tmp_path))) - {'a.txt', 'a_x.txt', '.ledger.jsonl'})
+    assert len(outputs) == 1 and outputs[0].startswith('a_')
+    ledger = Ledger(str(tmp_path / '.ledger.jsonl'))
+    assert ledger.is_output(str(tmp_path / outputs[0]))
+    assert not ledger.is_output(str(tmp_path / 'a_x.txt'))
+    ledger.close()
@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import queue
+import fnmatch
+import argparse
+import datetime
+import threading
+
+from choices import FORMATS
+
+# 装置が書き出したファイルを監視し，届いたものから順にキャリブレーションする
+# python main.py watch /path/to/data --model calib.npz
+
+# 書き出したファイルは台帳に記録し，監視対象にしない(名前からは判断しない)
+DEFAULT_LEDGER = '.easycalibration_ledger.jsonl'
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    from batch import add_calibration_arguments
+    parser.add_argument('directories', nargs='+', help='directories to watch')
+    add_calibration_arguments(parser)
+    parser.add_argument('--pattern', default='*.txt', help='file name pattern to calibrate')
+    parser.add_argument('--interval', type=float, default=1.0, help='polling interval in seconds')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='a file is processed after its size and mtime stay unchanged for this many seconds')
+    parser.add_argument('--batch-size', type=int, default=64, help='maximum number of files per batch')
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help='maximum number of files waiting to be processed; the scanner waits when full')
+    parser.add_argument('--ledger', default=None,
+                        help=f'processed-files ledger (default: {DEFAULT_LEDGER} in the first directory)')
+    parser.add_argument('--format', default='txt', choices=FORMATS)
+    parser.add_argument('--output-dir', default=None, help='directory for npz/hdf5/parquet batch files')
+    parser.add_argument('--workers', type=int, default=argparse.SUPPRESS,
+                        help='number of worker processes (default: CPU count)')
+
+
+class Ledger:
+    # 処理済みのファイルを1行1レコードのJSONで追記していく．再起動しても同じファイルは処理しない
+    # 失敗したファイルも記録し，書き換えられる(更新時刻か大きさが変わる)までは処理し直さない
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.done = set()
+        self.failed = set()
+        self.outputs = set()
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._remember(record)
+        self.f = open(filename, 'a', encoding='utf-8')
+
+    def _remember(self, record: dict) -> None:
+        key = (record['path'], record['mtime_ns'], record['size'])
+        if record.get('status') == 'ok':
+            self.done.add(key)
+            self.failed.discard(key)
+        elif record.get('status') == 'error':
+            self.failed.add(key)
+        self.outputs.update(record.get('outputs', []))
+
+    def __contains__(self, key) -> bool:
+        return key in self.done or key in self.failed
+
+    def is_output(self, path: str) -> bool:
+        return path in self.outputs
+
+    def add(self, key, status: str, **info) -> None:
+        path, mtime_ns, size = key
+        record = dict(path=path, mtime_ns=mtime_ns, size=size, status=status,
+                      time=datetime.datetime.now().isoformat(timespec='seconds'), **info)
+        # 出力は監視のスレッドが次の走査で見つける前に分かるようにしておく
+        self._remember(record)
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class Scanner:
+    # ディレクトリを定期的に走査し，大きさと更新時刻が一定時間変わらなかったファイルをキューに入れる
+    # watchdogが使える場合は変更の通知を受けてすぐに走査する
+    def __init__(self, directories: list, pattern: str, ledger: Ledger, out: queue.Queue, interval: float,
+                 settle: float):
+        self.directories = directories
+        self.pattern = pattern
+        self.ledger = ledger
+        self.out = out
+        self.interval = interval
+        self.settle = settle
+        self.pending = {}
+        self.queued = set()
+        self.wakeup = threading.Event()
+        self.stop = threading.Event()
+        self.observer = None
+
+    def start_notifier(self) -> None:
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            print('watchdog is not installed. Polling the directories.', file=sys.stderr)
+            return
+        wakeup = self.wakeup
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wakeup.set()
+
+        self.observer = Observer()
+        for directory in self.directories:
+            self.observer.schedule(Handler(), directory, recursive=False)
+        self.observer.start()
+
+    def candidates(self):
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_file() or entry.name.startswith('.'):
+                    continue
+                if not fnmatch.fnmatch(entry.name, self.pattern):
+                    continue
+                path = os.path.abspath(entry.path)
+                if self.ledger.is_output(path):
+                    continue
+                st = entry.stat()
+                yield path, st.st_mtime_ns, st.st_size
+
+    def scan(self) -> None:
+        now = time.monotonic()
+        seen = set()
+        for path, mtime_ns, size in self.candidates():
+            seen.add(path)
+            key = (path, mtime_ns, size)
+            if key in self.ledger or key in self.queued:
+                continue
+            state = self.pending.get(path)
+            if state is None or state[0] != key:
+                # 新しいファイルか，書き込み中で変化している
+                first_seen = state[2] if state is not None else now
+                self.pending[path] = (key, now, first_seen)
+                continue
+            if now - state[1] < self.settle:
+                continue
+            try:
+                # キューが一杯なら待つ(背圧)．その間は新しいファイルを探さない
+                self.out.put((key, state[2]), timeout=self.interval)
+            except queue.Full:
+                return
+            self.queued.add(key)
+            del self.pending[path]
+        for path in list(self.pending):
+            if path not in seen:
+                del self.pending[path]
+
+    def run(self) -> None:
+        self.start_notifier()
+        while not self.stop.is_set():
+            self.scan()
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def finished(self, key) -> None:
+        self.queued.discard(key)
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def process_batch(args, batch: list, calibrator, filename_ref: str, ledger: Ledger, latencies: list) -> None:
+    from dataloader import DataLoader
+    from parallel import iter_load
+    from export import open_writer, metadata, EXTENSIONS
+    from pipeline import apply_calibration, save_spectrum
+
+    t0 = time.monotonic()
+    paths = [key[0] for key, _ in batch]
+    results = {}
+    outputs = {}
+    if args.format == 'txt':
+        # 書き出したパスを台帳に記録するため，保存はsave_spectrumでここで行う
+        dl = DataLoader()
+        for path, spec, error in iter_load(paths, workers=args.workers):
+            if error is None:
+                try:
+                    apply_calibration(spec, calibrator, filename_ref)
+                    outputs[path] = save_spectrum(dl, path, spec)
+                except Exception as e:
+                    error = e
+            results[path] = error
+    else:
+        output = None
+        if args.format in EXTENSIONS:
+            stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+            output = os.path.join(args.output_dir or args.directories[0], f'calibrated_{stamp}{EXTENSIONS[args.format]}')
+        try:
+            with open_writer(args.format, output) as writer:
+                for path, spec, error in iter_load(paths, workers=args.workers):
+                    if error is not None:
+                        results[path] = error
+                        continue
+                    apply_calibration(spec, calibrator, filename_ref)
+                    writer.add(path, spec.xdata, spec.ydata, metadata(spec))
+                    results[path] = None
+                    outputs[path] = [os.path.abspath(output if output is not None else writer.path(path))]
+        except Exception as e:
+            for path in paths:
+                results[path] = e
+            outputs = {}
+    done = time.monotonic()
+    for key, first_seen in batch:
+        error = results.get(key[0])
+        if error is None:
+            latency = done - first_seen
+            latencies.append(latency)
+            ledger.add(key, 'ok', latency=round(latency, 3), process=round(done - t0, 3),
+                       outputs=outputs.get(key[0], []))
+            print(f'{key[0]}\t{latency * 1000:.0f} ms', flush=True)
+        else:
+            ledger.add(key, 'error', error=str(error), outputs=outputs.get(key[0], []))
+            print(f'Failed: {key[0]}: {error}', file=sys.stderr, flush=True)
+
+
+def run(args: argparse.Namespace) -> int:
+    from batch import prepare_calibrator
+    from profiling import tracer
+
+    if args.refs is not None:
+        # 中心波長ごとの表はファイルごとに振り分ける必要があるので，batchでのみ使える
+        print('watch applies a single calibration. Use batch for --refs.', file=sys.stderr)
+        return 1
+    prepared = prepare_calibrator(args)
+    if prepared is None:
+        return 1
+    calibrator, filename_ref = prepared
+
+    ledger = Ledger(args.ledger or os.path.join(args.directories[0], DEFAULT_LEDGER))
+    files = queue.Queue(maxsize=args.queue_size)
+    scanner = Scanner(args.directories, args.pattern, ledger, files, args.interval, args.settle)
+    thread = threading.Thread(target=scanner.run, daemon=True)
+    thread.start()
+    print(f'Watching {", ".join(args.directories)} (Ctrl+C to stop)', file=sys.stderr)
+
+    latencies = []
+    try:
+        while True:
+            batch = [files.get()]
+            # 届いているものはまとめて処理する
+            while len(batch) < args.batch_size:
+                try:
+                    batch.append(files.get_nowait())
+                except queue.Empty:
+                    break
+            # 前のバッチの出力が台帳に記録される前にキューに入っていたら，ここで除く
+            skipped = [item for item in batch if ledger.is_output(item[0][0])]
+            batch = [item for item in batch if not ledger.is_output(item[0][0])]
+            if batch:
+                with tracer.span('process_batch', files=len(batch), queued=files.qsize()):
+                    process_batch(args, batch, calibrator, filename_ref, ledger, latencies)
+            for key, _ in batch + skipped:
+                scanner.finished(key)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scanner.stop.set()
+        scanner.wakeup.set()
+        thread.join(timeout=5)
+        ledger.close()
+    if latencies:
+        print(f'Processed {len(latencies)} files. Latency: mean {sum(latencies) / len(latencies) * 1000:.0f} ms, '
+              f'p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p95 {percentile(latencies, 0.95) * 1000:.0f} ms',
+              file=sys.stderr)
+    return 0